@@ -1,85 +1,121 @@
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import LLMChain
-from langchain.agents import AgentExecutor, create_tool_calling_agent
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.messages import get_buffer_string
+from langchain_core.callbacks import BaseCallbackHandler
 
-from datetime import datetime, time, timedelta
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from contextvars import ContextVar
 import os
+import threading
 from dotenv import load_dotenv, find_dotenv
-from typing import List, Dict, Optional
+from typing import List, Dict, NamedTuple, Optional, Set, Tuple
 from collections import defaultdict
 from pydantic import BaseModel, Field, ValidationError
-from utils import from_hhmm, calculate_duration_minutes
-from scrapers import albany_scraper
-import redis
-import json
+from utils import hhmm_to_minutes, minutes_to_hhmm
+from availability_index import INDEX_RESOLUTION_MINUTES, CourtKey, bitmaps_to_matrix, free_blocks, matrix_free_blocks, minutes_to_cells, nearest_block_starts, runs_at_least, window_mask, window_vector
+from snapshot_codec import Snapshot
+from scrapers import registered_cities
+import scrape_cache
+from metrics import SCRAPE_CACHE_LOOKUPS, LLMMetricsHandler, TurnTokenCounter, timed
 
 # Load .env
 _ = load_dotenv(find_dotenv())
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-_redis_client = None
-_scrape_cache_ttl_seconds = 3600 # Default to 1 hour, will be overridden by app.py
 
-def get_tennis_court_availability(date: str = None, city_names:List[str]=None) -> List[Dict]:
-    """
-    Fetches tennis court availability for a given date, using Redis cache.
-    The date should be provided in 'MM/DD/YYYY' format (e.g., '06/21/2025').
-    If no date is provided, it defaults to today's date.
-    The web scraping always starts at 05:00 AM.
-    Returns a list of dictionaries, each representing a court availability slot.
-    """
-    global _redis_client, _scrape_cache_ttl_seconds # Declare intent to modify globals
+# Longest date range a single tool call may ask for, to bound how much one query can scrape
+MAX_DATE_RANGE_DAYS = int(os.getenv("MAX_DATE_RANGE_DAYS", "14"))
 
-    if _redis_client is None:
-        print("WARNING: Redis client not initialized in agent.py. Scraping cache will NOT work.")
+# Snapshots read in the current context while record_snapshot_reads is active
+_snapshot_reads: ContextVar[Optional[Dict]] = ContextVar("snapshot_reads", default=None)
 
-    if not city_names:
-        # TODO later add other cities you can scrape
-        city_names = ["Albany"]
 
+def expand_date_range(date: str, end_date: Optional[str] = None) -> List[str]:
+    """
+    Returns every date from `date` through `end_date` (inclusive) in MM/DD/YYYY format.
+    Raises ValueError if a date is malformed, the range is reversed or longer than MAX_DATE_RANGE_DAYS.
+    """
+    start = datetime.strptime(date, "%m/%d/%Y")
+    if not end_date:
+        return [date]
+    end = datetime.strptime(end_date, "%m/%d/%Y")
+    days = (end - start).days
+    if days < 0:
+        raise ValueError(f"end_date {end_date} is before date {date}")
+    if days >= MAX_DATE_RANGE_DAYS:
+        raise ValueError(f"date ranges are limited to {MAX_DATE_RANGE_DAYS} days")
+    return [(start + timedelta(days=offset)).strftime("%m/%d/%Y") for offset in range(days + 1)]
+
+
+def availability_keys(date: str = None, city_names: List[str] = None, end_date: str = None) -> List[Tuple[str, str]]:
+    """
+    Returns the (date, city) pairs a query covers, in date order and then the caller's city order.
+    Dates are MM/DD/YYYY; date defaults to today and city_names to every registered city.
+    Raises ValueError for an invalid date or date range.
+    """
+    if not city_names:
+        city_names = registered_cities()
     if date is None:
-        target_date = datetime.now().strftime("%m/%d/%Y")
-    else:
-        try:
-            datetime.strptime(date, "%m/%d/%Y")
-            target_date = date
-        except ValueError:
-            return [{"message": f"Error: Invalid date format provided. Please use MM/DD/YYYY (e.g., 06/21/2025). You provided: {date}"}]
-
-    availability_data = []
-    for city in city_names:
-        # Create a unique cache key for each date and city
-        cache_key = f"scrape_cache:{target_date}:{city.lower()}"
-
-        cached_rows = None
-        if _redis_client:
-            cached_rows_json = _redis_client.get(cache_key)
-            if cached_rows_json:
-                try:
-                    cached_rows = json.loads(cached_rows_json)
-                    print(f"INFO: Cache hit for scrape_cache:{cache_key}")
-                except (json.JSONDecodeError, TypeError) as e:
-                    print(f"WARNING: Corrupted cache data for {cache_key}: {e}. Will re-scrape.")
-                    # In case of corruption, delete the bad key to force re-scrape
-                    _redis_client.delete(cache_key)
-            else:
-                print(f"INFO: Cache miss for scrape_cache:{cache_key}. Scraping...")
-
-        if cached_rows is None: # If not in cache or Redis is not available or data was corrupted
-            if city.lower() == "albany":
-                rows = albany_scraper(target_date)
-                if _redis_client and rows and not any("message" in r for r in rows): # Only cache if scrape was successful and not an error message
-                    _redis_client.set(cache_key, json.dumps(rows), ex=_scrape_cache_ttl_seconds) # Cache with TTL
-                    print(f"INFO: Cached {len(rows)} entries for scrape_cache:{cache_key}")
-                elif _redis_client:
-                    print(f"WARNING: Did not cache for {cache_key} due to empty rows or error message from scraper.")
-                availability_data.extend(rows)
-            # TODO: Add logic for other cities like Berkeley, Oakland
+        date = datetime.now().strftime("%m/%d/%Y")
+    return [(target_date, city) for target_date in expand_date_range(date, end_date) for city in city_names]
+
+
+def read_availability_snapshots(keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Snapshot]:
+    """
+    Returns the scrape snapshot for every (date, city) pair, in the order given.
+    Snapshots come from the in-process cache or, for the rest, from Redis with one MGET. Stale snapshots are returned immediately and refreshed in
+    the background; only missing snapshots are scraped inline, concurrently.
+    """
+    if not scrape_cache.is_enabled():
+        print("WARNING: Redis client not initialized in agent.py. Scrape snapshots are only cached in this process.")
+
+    snapshots = {}
+    missing_keys = []
+    for key, snapshot in scrape_cache.read_snapshots(keys).items():
+        if snapshot is None: # If not in cache or Redis is not available or data was corrupted
+            print(f"INFO: Cache miss for {scrape_cache.cache_key(*key)}. Scraping...")
+            SCRAPE_CACHE_LOOKUPS.labels("miss").inc()
+            missing_keys.append(key)
+            continue
+        print(f"INFO: Cache hit for {scrape_cache.cache_key(*key)}")
+        if scrape_cache.is_stale(snapshot.fetched_at):
+            SCRAPE_CACHE_LOOKUPS.labels("stale").inc()
+            scrape_cache.refresh_in_background(*key)
         else:
-            availability_data.extend(cached_rows)
+            SCRAPE_CACHE_LOOKUPS.labels("hit").inc()
+        snapshots[key] = snapshot
 
-    return availability_data
+    # Scrape all cache misses concurrently
+    if missing_keys:
+        with timed("scrape_inline"):
+            snapshots.update(scrape_cache.refresh_many(missing_keys))
 
+    reads = _snapshot_reads.get()
+    if reads is not None:
+        reads.update(snapshots)
+    return {key: snapshots[key] for key in keys if key in snapshots}
+
+
+@contextmanager
+def record_snapshot_reads():
+    """
+    Collects every snapshot that read_availability_snapshots returns inside the with-block (including from tool
+    calls of an agent run in it) into the yielded dict, keyed by (date, city). Used to tie cached answers to the
+    availability they were built from, see response_cache.py.
+    """
+    reads = {}
+    token = _snapshot_reads.set(reads)
+    try:
+        yield reads
+    finally:
+        _snapshot_reads.reset(token)
+
+
+def get_availability_snapshots(date: str = None, city_names: List[str] = None, end_date: str = None) -> Dict[Tuple[str, str], Snapshot]:
+    """
+    Returns the scrape snapshot for every (date, city) pair from date through end_date, see availability_keys
+    and read_availability_snapshots. Raises ValueError for an invalid date or date range.
+    """
+    return read_availability_snapshots(availability_keys(date, city_names, end_date))
 
 
 class FilteredCourtSlot(BaseModel):
@@ -93,63 +129,58 @@ class FilteredCourtSlot(BaseModel):
     availability: str = Field(..., description="The availability status ('Available' or 'Unavailable').")
 
 
-def merge_consecutive_slots(filtered_rows: List[FilteredCourtSlot]) -> List[FilteredCourtSlot]:
+class SlotRecord(NamedTuple):
     """
-    Merge consecutive available time slots for the same court and park.
-
-    Args:
-        filtered_rows: A list of FilteredCourtSlot objects representing filtered court availabilities.
-
-    Returns:
-        A new list of FilteredCourtSlot objects where consecutive time slots are merged.
+    One available block on one court, as passed between the filtering steps. Times are minutes after midnight.
+    Results stay in this form internally and become FilteredCourtSlot models (or plain dicts) only when handed out.
     """
-
-    merged = []
-    grouped = defaultdict(list)
-
-    # Group available slots by date, city, park, and court
-    for row in filtered_rows:
-        if row.availability == "Available": # Accessing attribute
-            key = (row.date, row.city_name, row.park_name, row.court_name) # Accessing attributes
-            grouped[key].append((row.start_time, row.end_time)) # Accessing attributes
-
-    # Iterate through grouped intervals and merge
-    for (date, city, park, court), intervals in grouped.items():
-        intervals.sort()
-
-        if not intervals:
+    court: CourtKey
+    start_minutes: int
+    end_minutes: int
+
+    def to_dict(self) -> Dict:
+        """Same fields as FilteredCourtSlot.model_dump(), without building the model."""
+        return {
+            "date": self.court.date,
+            "city_name": self.court.city_name,
+            "park_name": self.court.park_name,
+            "court_name": self.court.court_name,
+            "start_time": minutes_to_hhmm(self.start_minutes),
+            "end_time": minutes_to_hhmm(self.end_minutes),
+            "availability": "Available",
+        }
+
+    def to_model(self) -> FilteredCourtSlot:
+        return FilteredCourtSlot(**self.to_dict())
+
+
+class Unavailable(NamedTuple):
+    """A (date, city) pair whose availability could not be read (timeout, fetch error, rate limit), with the scraper's message."""
+    date: str
+    city: str
+    message: str
+    retry_after_seconds: Optional[float] = None  # when the scraper knows how long to wait (rate limits)
+
+
+def unavailable_pairs(snapshots: Dict[Tuple[str, str], Snapshot]) -> List[Unavailable]:
+    """
+    Returns the pairs in snapshots that hold a scraper message instead of availability. Those never have a blob
+    (failed scrapes aren't cached, see scrape_cache.write_snapshot), so cached snapshots aren't decoded here.
+    """
+    unavailable = []
+    for (date, city), snapshot in snapshots.items():
+        if snapshot.blob is not None:
             continue
-
-        merged_intervals = []
-        current_start, current_end = intervals[0]
-
-        for start, end in intervals[1:]:
-            if from_hhmm(start) == from_hhmm(current_end):
-                current_end = end
-            else:
-                merged_intervals.append((current_start, current_end))
-                current_start, current_end = start, end
-
-        merged_intervals.append((current_start, current_end))
-
-        # Format and append merged intervals to the final list, creating FilteredCourtSlot instances
-        for start, end in merged_intervals:
-            merged.append(FilteredCourtSlot(
-                date=date,
-                city_name=city,
-                park_name=park,
-                court_name=court,
-                start_time=start,
-                end_time=end,
-                availability="Available"
-            ))
-
-    return merged
+        for row in snapshot.rows:
+            if "message" in row:
+                unavailable.append(Unavailable(date, city, row["message"], row.get("retry_after_seconds")))
+    return unavailable
 
 
 class FilterInput(BaseModel):
     """Input schema for the filter_court_availability tool."""
-    date: str = Field(..., description="Date of the slot in MM/DD/YYYY format.")
+    date: str = Field(..., description="Date of the slot in MM/DD/YYYY format. For a date range, this is the first date.")
+    end_date: Optional[str] = Field(None, description="Last date (inclusive, MM/DD/YYYY) when asking about a range of dates, e.g. a whole weekend. Leave empty for a single date.")
     city_names: Optional[List[str]] = Field(None, description="List of city names to filter by.")
     min_start_time: Optional[str] = Field(None, description="Minimum start time for filtering (HH:MM 24-hour format).")
     max_end_time: Optional[str] = Field(None, description="Maximum end time for filtering (HH:MM 24-hour format).")
@@ -159,6 +190,11 @@ class FilterInput(BaseModel):
     cache: Optional[Dict] = Field(None, description="Cache")
 
 
+class FilterToolInput(FilterInput):
+    """Input schema of the agent's filter tool: FilterInput plus paging through long results."""
+    page: Optional[int] = Field(None, description="Page of results to return (1 by default). Only ask for further pages when the previous result says there are more and the user needs them.")
+
+
 def filter_court_availability(
         date: str,
         city_names: Optional[List[str]] = None,
@@ -167,87 +203,493 @@ def filter_court_availability(
         park_name: Optional[str] = None,
         court_name: Optional[str] = None,
         min_duration_minutes: Optional[int] = None,
+        end_date: Optional[str] = None,
 ) -> List[FilteredCourtSlot]:
     """
     Filters a list of court availability slots based on specified criteria.
+    If end_date is given, slots for every date from date through end_date are returned together.
+    Pairs that could not be scraped are left out; find_available_slots also reports them.
+    Raises ValueError for an invalid date, date range or time.
     """
-    availability_data = get_tennis_court_availability(date=date, city_names=city_names)
-
-    filtered_slots_list = []
-
-    min_start_dt = from_hhmm(min_start_time) if min_start_time else None
-    max_end_dt = from_hhmm(max_end_time) if max_end_time else None
-
-    for slot in availability_data:
-        if "message" in slot:
-            continue
-
-        if slot.get("availability") != "Available":
-            continue
-
-        match = True
-
-        # Date filtering (already passed to get_tennis_court_availability, so might be redundant here if the scraper is perfect, but good for robustness)
-        if slot.get("date") != date:
-            match = False
-
-        if city_names:
-            city_match = False
-            for city_name_filter in city_names:
-                if city_name_filter.lower() in slot.get("city_name", "").lower():
-                    city_match = True
-                    break
-            if not city_match:
-                match = False
-
-        if park_name and park_name.lower() not in slot.get("park_name", "").lower():
-            match = False
-
-        if court_name and court_name.lower() not in slot.get("court_name", "").lower():
-            match = False
-
-        if min_start_dt:
-            slot_start_dt = from_hhmm(slot["start_time"])
-            if slot_start_dt < min_start_dt:
-                match = False
-
-        if max_end_dt:
-            slot_end_dt = from_hhmm(slot["end_time"])
-            if slot_end_dt > max_end_dt:
-                match = False
-
-        # # TODO - this should be after merging
-        # if min_duration_minutes is not None:
-        #     duration = calculate_duration_minutes(slot["start_time"], slot["end_time"])
-        #     if duration < min_duration_minutes:
-        #         match = False
-
-        if match:
-            filtered_slots_list.append(FilteredCourtSlot(
-                date=slot["date"],
-                city_name=slot["city_name"],
-                park_name=slot["park_name"],
-                court_name=slot["court_name"],
-                start_time=slot["start_time"],
-                end_time=slot["end_time"],
-                availability=slot["availability"]
-            ))
+    with timed("filter_court_availability"):
+        slots, _ = find_available_slots(
+            date=date,
+            city_names=city_names,
+            min_start_time=min_start_time,
+            max_end_time=max_end_time,
+            park_name=park_name,
+            court_name=court_name,
+            min_duration_minutes=min_duration_minutes,
+            end_date=end_date,
+        )
+        return [slot.to_model() for slot in slots]
+
+
+def find_available_slots(
+        date: str,
+        city_names: Optional[List[str]] = None,
+        min_start_time: Optional[str] = None,
+        max_end_time: Optional[str] = None,
+        park_name: Optional[str] = None,
+        court_name: Optional[str] = None,
+        min_duration_minutes: Optional[int] = None,
+        end_date: Optional[str] = None,
+) -> Tuple[List[SlotRecord], List[Unavailable]]:
+    """
+    filter_court_availability returning SlotRecords, for callers that don't need the models, along with the
+    (date, city) pairs that could not be scraped. Raises ValueError for an invalid date, date range or time.
+    """
+    # Check the times before anything is fetched or scraped
+    for hhmm in (min_start_time, max_end_time):
+        if hhmm:
+            hhmm_to_minutes(hhmm)
+    with timed("availability_snapshots"):
+        snapshots = get_availability_snapshots(date=date, city_names=city_names, end_date=end_date)
+
+    with timed("filter"):
+        slots = filter_snapshots(
+            snapshots,
+            city_names=city_names,
+            min_start_time=min_start_time,
+            max_end_time=max_end_time,
+            park_name=park_name,
+            court_name=court_name,
+            min_duration_minutes=min_duration_minutes,
+        )
+    return slots, unavailable_pairs(snapshots)
+
+
+def filter_court_availability_batch(queries: List[FilterInput]) -> List[Tuple[List[SlotRecord], List[Unavailable]]]:
+    """
+    Runs several filter queries against one shared snapshot fetch: the (date, city) pairs of all queries are
+    read with a single MGET and any misses are scraped together. Returns one (slots, unavailable pairs) result
+    per query, in order, like find_available_slots. Raises ValueError if any query has an invalid date, date range or time.
+    """
+    query_keys = [availability_keys(query.date, query.city_names, query.end_date) for query in queries]
+    for query in queries:
+        for hhmm in (query.min_start_time, query.max_end_time):
+            if hhmm:
+                hhmm_to_minutes(hhmm)
+
+    all_keys = list(dict.fromkeys(key for keys in query_keys for key in keys))
+    with timed("availability_snapshots"):
+        snapshots = read_availability_snapshots(all_keys)
+
+    results = []
+    for query, keys in zip(queries, query_keys):
+        query_snapshots = {key: snapshots[key] for key in keys if key in snapshots}
+        with timed("filter"):
+            slots = filter_snapshots(
+                query_snapshots,
+                city_names=query.city_names,
+                min_start_time=query.min_start_time,
+                max_end_time=query.max_end_time,
+                park_name=query.park_name,
+                court_name=query.court_name,
+                min_duration_minutes=query.min_duration_minutes,
+            )
+        results.append((slots, unavailable_pairs(query_snapshots)))
+    return results
+
+
+# Below this many courts the per-court bit operations beat NumPy's fixed per-call overhead
+VECTORIZE_MIN_COURTS = 32
+
+
+def filter_snapshots(
+        snapshots: Dict[Tuple[str, str], Snapshot],
+        city_names: Optional[List[str]] = None,
+        min_start_time: Optional[str] = None,
+        max_end_time: Optional[str] = None,
+        park_name: Optional[str] = None,
+        court_name: Optional[str] = None,
+        min_duration_minutes: Optional[int] = None,
+) -> List[SlotRecord]:
+    """
+    The filtering engine behind filter_court_availability, working on each snapshot's per-court bitmaps.
+    Name filters are checked once per court. The time window, merging of consecutive slots and
+    min_duration_minutes are then bit operations: per court for small queries, or, from
+    VECTORIZE_MIN_COURTS courts up (multi-day, multi-city queries), one vectorized NumPy pass over
+    a matrix of all the surviving courts, so per-slot cost stays flat as cities, courts and days are added.
+    """
+    city_filters = [city.lower() for city in city_names] if city_names else None
+
+    courts = []
+    bitmaps = []
+    for (target_date, _), snapshot in snapshots.items():
+        for court, bits in snapshot.index.items():
+            # Date filtering (already passed to the scrapers, so might be redundant here if the scraper is perfect, but good for robustness)
+            if court.date != target_date:
+                continue
+            if city_filters and not any(city in court.city_name.lower() for city in city_filters):
+                continue
+            if park_name and park_name.lower() not in court.park_name.lower():
+                continue
+            if court_name and court_name.lower() not in court.court_name.lower():
+                continue
+            courts.append(court)
+            bitmaps.append(bits)
+
+    if not courts:
+        return []
+
+    min_start_minutes = hhmm_to_minutes(min_start_time) if min_start_time else None
+    max_end_minutes = hhmm_to_minutes(max_end_time) if max_end_time else None
+    min_cells = minutes_to_cells(min_duration_minutes) if min_duration_minutes else 1
+
+    if len(courts) >= VECTORIZE_MIN_COURTS:
+        window = window_vector(min_start_minutes, max_end_minutes)
+        rows, starts, ends = matrix_free_blocks(bitmaps_to_matrix(bitmaps) & window, min_cells)
+        blocks = zip(rows.tolist(), starts.tolist(), ends.tolist())
+    else:
+        mask = window_mask(min_start_minutes, max_end_minutes)
+        blocks = [
+            (row, start, end)
+            for row, bits in enumerate(bitmaps)
+            for start, end in free_blocks(runs_at_least(bits & mask, min_cells))
+        ]
+
+    return [SlotRecord(courts[row], start, end) for row, start, end in blocks]
+
+
+# --- Alternatives ---
+# When the requested court or time isn't free, rank_alternatives finds the nearest bookable options in one pass over
+# the day's courts: for every court, the blocks of the requested length that start closest to the requested time
+# (one at or before it, one after). Options are ranked by how far they move the start time plus
+# ALTERNATIVE_LOCATION_PENALTY_MINUTES for each step away from the requested place
+# (requested court, another court in the same park, another park). When only a court name is given, its park is
+# the park of the courts with that name; if no court has it, every other court is one step away ("other court").
+ALTERNATIVE_LOCATION_PENALTY_MINUTES = int(os.getenv("ALTERNATIVE_LOCATION_PENALTY_MINUTES", "45"))
+ALTERNATIVE_LOCATIONS = ("requested court", "same park", "other park", "other court")
+# Steps away from the requested place for each of ALTERNATIVE_LOCATIONS
+ALTERNATIVE_LOCATION_STEPS = (0, 1, 2, 1)
+REQUESTED_COURT, SAME_PARK, OTHER_PARK, OTHER_COURT = range(len(ALTERNATIVE_LOCATIONS))
+DEFAULT_ALTERNATIVE_DURATION_MINUTES = 60
+DEFAULT_ALTERNATIVE_MAX_SHIFT_MINUTES = 180
+DEFAULT_ALTERNATIVE_MAX_RESULTS = 8
+
+
+class AlternativeSlot(NamedTuple):
+    """A bookable block offered instead of the requested one."""
+    slot: SlotRecord
+    offset_minutes: int  # start time minus the requested start time
+    location: int  # index into ALTERNATIVE_LOCATIONS
+
+    @property
+    def score(self) -> int:
+        return abs(self.offset_minutes) + ALTERNATIVE_LOCATION_PENALTY_MINUTES * ALTERNATIVE_LOCATION_STEPS[self.location]
+
+
+class AlternativesInput(BaseModel):
+    """Input schema for the find_alternative_slots tool."""
+    date: str = Field(..., description="Date of the requested slot in MM/DD/YYYY format.")
+    start_time: str = Field(..., description="Requested start time (HH:MM 24-hour format).")
+    duration_minutes: Optional[int] = Field(None, description="Requested duration in minutes (60 by default).")
+    city_names: Optional[List[str]] = Field(None, description="List of city names to search in.")
+    park_name: Optional[str] = Field(None, description="Requested park name, if the user asked for one.")
+    court_name: Optional[str] = Field(None, description="Requested court name, if the user asked for one.")
+    max_shift_minutes: Optional[int] = Field(None, description="How far from the requested start time alternatives may start (180 minutes by default).")
+    max_results: Optional[int] = Field(None, description="Most alternatives to return (8 by default).")
+
+
+def find_alternative_slots(
+        date: str,
+        start_time: str,
+        duration_minutes: Optional[int] = None,
+        city_names: Optional[List[str]] = None,
+        park_name: Optional[str] = None,
+        court_name: Optional[str] = None,
+        max_shift_minutes: Optional[int] = None,
+        max_results: Optional[int] = None,
+) -> Tuple[List[AlternativeSlot], List[Unavailable]]:
+    """
+    Returns the bookable blocks nearest to the requested one, best first: the requested court at nearby times and
+    other courts around the requested time (see rank_alternatives), along with the cities that could not be
+    scraped. Raises ValueError for an invalid date or time.
+    """
+    start_minutes = hhmm_to_minutes(start_time)
+    with timed("alternatives"):
+        with timed("availability_snapshots"):
+            snapshots = get_availability_snapshots(date=date, city_names=city_names)
+        alternatives = rank_alternatives(
+            snapshots,
+            start_minutes=start_minutes,
+            duration_minutes=duration_minutes or DEFAULT_ALTERNATIVE_DURATION_MINUTES,
+            city_names=city_names,
+            park_name=park_name,
+            court_name=court_name,
+            max_shift_minutes=DEFAULT_ALTERNATIVE_MAX_SHIFT_MINUTES if max_shift_minutes is None else max_shift_minutes,
+            max_results=max_results or DEFAULT_ALTERNATIVE_MAX_RESULTS,
+        )
+    return alternatives, unavailable_pairs(snapshots)
+
+
+def _alternative_location(court: CourtKey, park_name: Optional[str], court_name: Optional[str],
+                          requested_parks: Set[Tuple[str, str]]) -> int:
+    """Where court is relative to the requested place, as an index into ALTERNATIVE_LOCATIONS."""
+    if park_name and park_name.lower() not in court.park_name.lower():
+        return OTHER_PARK
+    if court_name and court_name.lower() not in court.court_name.lower():
+        if park_name or (court.city_name, court.park_name) in requested_parks:
+            return SAME_PARK
+        return OTHER_PARK if requested_parks else OTHER_COURT
+    return REQUESTED_COURT
+
+
+def rank_alternatives(
+        snapshots: Dict[Tuple[str, str], Snapshot],
+        start_minutes: int,
+        duration_minutes: int,
+        city_names: Optional[List[str]] = None,
+        park_name: Optional[str] = None,
+        court_name: Optional[str] = None,
+        max_shift_minutes: int = DEFAULT_ALTERNATIVE_MAX_SHIFT_MINUTES,
+        max_results: int = DEFAULT_ALTERNATIVE_MAX_RESULTS,
+) -> List[AlternativeSlot]:
+    """
+    The ranking engine behind find_alternative_slots. For each court in the snapshots (optionally only in
+    city_names), takes the blocks of duration_minutes that start nearest to start_minutes, at most
+    max_shift_minutes away, and returns the max_results with the lowest AlternativeSlot.score.
+    """
+    city_filters = [city.lower() for city in city_names] if city_names else None
+    cells = minutes_to_cells(duration_minutes)
+    courts = [
+        (court, bits)
+        for (target_date, _), snapshot in snapshots.items()
+        for court, bits in snapshot.index.items()
+        if court.date == target_date and (not city_filters or any(city in court.city_name.lower() for city in city_filters))
+    ]
+    # Without a park name, the requested court's park is wherever courts with the requested name are
+    requested_parks = set()
+    if court_name and not park_name:
+        requested_parks = {(court.city_name, court.park_name) for court, _ in courts if court_name.lower() in court.court_name.lower()}
+
+    alternatives = []
+    for court, bits in courts:
+        location = _alternative_location(court, park_name, court_name, requested_parks)
+        for block_start in nearest_block_starts(bits, cells, start_minutes):
+            offset = block_start - start_minutes
+            if abs(offset) <= max_shift_minutes:
+                block = SlotRecord(court, block_start, block_start + cells * INDEX_RESOLUTION_MINUTES)
+                alternatives.append(AlternativeSlot(block, offset, location))
+
+    alternatives.sort(key=lambda alternative: (alternative.score, ALTERNATIVE_LOCATION_STEPS[alternative.location], abs(alternative.offset_minutes), alternative.offset_minutes))
+    return alternatives[:max_results]
+
+
+def _offset_text(offset_minutes: int) -> str:
+    if offset_minutes == 0:
+        return "requested time"
+    hours, minutes = divmod(abs(offset_minutes), 60)
+    amount = " ".join(part for part in (f"{hours}h" if hours else "", f"{minutes}min" if minutes else "") if part)
+    return f"{amount} {'later' if offset_minutes > 0 else 'earlier'}"
+
+
+def format_alternatives_for_llm(alternatives: List[AlternativeSlot], show_location: bool = True,
+                                unavailable: List[Unavailable] = ()) -> str:
+    """
+    Renders ranked alternatives for the LLM, one numbered line each, best first, after the messages of any
+    cities that could not be scraped. Pass show_location=False when no park or court was requested, so options
+    aren't labelled relative to one.
+    """
+    notes = _unavailable_lines(unavailable)
+    if not alternatives:
+        return "\n".join(notes or ["No courts have a free block of that length near the requested time."])
+    lines = notes + ["Alternatives, best first (24-hour times):"]
+    for number, alternative in enumerate(alternatives, 1):
+        court = alternative.slot.court
+        lines.append(
+            f"{number}. {court.date} {minutes_to_hhmm(alternative.slot.start_minutes)}-{minutes_to_hhmm(alternative.slot.end_minutes)} "
+            f"{court.park_name}, {court.court_name} ({court.city_name}): "
+            + (f"{ALTERNATIVE_LOCATIONS[alternative.location]}, " if show_location else "")
+            + _offset_text(alternative.offset_minutes)
+        )
+    return "\n".join(lines)
+
+
+# --- Tool output ---
+# The filter tool answers the LLM with compact text grouped by date and city, park and court: one line per court
+# with its merged free ranges, instead of a list of objects that repeats every field name for every slot.
+# Whole pages, including the heading, the "Not shown" summary and the paging instructions, stay within about
+# TOOL_OUTPUT_TOKEN_BUDGET tokens (estimated at CHARS_PER_TOKEN characters per token); courts that don't fit are
+# summarized per park and can be fetched with the tool's page argument.
+TOOL_OUTPUT_TOKEN_BUDGET = int(os.getenv("TOOL_OUTPUT_TOKEN_BUDGET", "600"))
+CHARS_PER_TOKEN = 4
+# Parks listed by name in the summary of courts on other pages, and the share of a page kept free for that summary
+TOOL_OUTPUT_SUMMARY_PARKS = 8
+TOOL_OUTPUT_SUMMARY_SHARE = 0.25
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _lines_tokens(lines: List[str]) -> int:
+    """Estimated tokens of lines joined by newlines (one token per newline)."""
+    return sum(estimate_tokens(line) + 1 for line in lines)
+
+
+def _court_ranges(slots: List[SlotRecord]) -> Dict[CourtKey, List[Tuple[int, int]]]:
+    """Each court's free ranges, courts in first-seen order but with the courts of a (date, city, park) kept together."""
+    by_park = defaultdict(lambda: defaultdict(list))
+    for slot in slots:
+        by_park[slot.court[:3]][slot.court].append((slot.start_minutes, slot.end_minutes))
+    return {court: sorted(ranges) for courts in by_park.values() for court, ranges in courts.items()}
+
+
+def _court_lines(court: CourtKey, ranges: List[Tuple[int, int]], previous: Optional[CourtKey]) -> List[str]:
+    """The lines for one court, preceded by its date/city and park headings unless the previous court shares them."""
+    lines = []
+    if previous is None or previous[:2] != court[:2]:
+        lines.append(f"{court.date} {court.city_name}")
+    if previous is None or previous[:3] != court[:3]:
+        lines.append(f"  {court.park_name}")
+    lines.append(f"    {court.court_name}: " + ", ".join(f"{minutes_to_hhmm(start)}-{minutes_to_hhmm(end)}" for start, end in ranges))
+    return lines
+
+
+def _unavailable_lines(unavailable: List[Unavailable]) -> List[str]:
+    """One line per city and scraper message, listing the dates it applies to, for results that could not be loaded."""
+    dates = defaultdict(list)
+    for item in unavailable:
+        dates[(item.city, item.message)].append(item.date)
+    return [f"{', '.join(item_dates)} {city}: {message}" for (city, message), item_dates in dates.items()]
+
+
+def _heading(court_ranges: Dict[CourtKey, List[Tuple[int, int]]]) -> str:
+    total_ranges = sum(len(ranges) for ranges in court_ranges.values())
+    return f"{total_ranges} free time ranges on {len(court_ranges)} courts (24-hour times, consecutive slots merged):"
+
+
+def _park_summaries(court_ranges: Dict[CourtKey, List[Tuple[int, int]]], courts: List[CourtKey]) -> List[str]:
+    """How many courts and free ranges each park has among courts, one entry per park in first-seen order."""
+    parks = defaultdict(lambda: [0, 0])
+    for court in courts:
+        parks[court[:3]][0] += 1
+        parks[court[:3]][1] += len(court_ranges[court])
+    return [f"{park} ({city}, {date}): {court_count} courts, {range_count} ranges"
+            for (date, city, park), (court_count, range_count) in parks.items()]
+
+
+def _summarize_courts(court_ranges: Dict[CourtKey, List[Tuple[int, int]]], courts: List[CourtKey], token_budget: int) -> str:
+    """
+    Names how many courts and free ranges each park has among courts, for the courts left off a page: the first
+    TOOL_OUTPUT_SUMMARY_PARKS parks that fit in about token_budget tokens, then how many more parks there are.
+    """
+    summaries = _park_summaries(court_ranges, courts)
+    room = token_budget - estimate_tokens(f"; {len(summaries)} more parks")
+    listed = []
+    for entry in summaries[:TOOL_OUTPUT_SUMMARY_PARKS]:
+        cost = estimate_tokens(f"; {entry}")
+        if cost > room:
+            break
+        listed.append(entry)
+        room -= cost
+    if len(listed) < len(summaries):
+        listed.append(f"{len(summaries) - len(listed)} more parks")
+    return "; ".join(listed)
+
+
+def _footer_lines(page: int, page_count: int, later_count: int, summary: str) -> List[str]:
+    """The lines after a page's courts: its page number and, unless it is the last page, what the later pages hold."""
+    lines = [f"(page {page} of {page_count})"]
+    if page < page_count:
+        lines.append(f"Not shown: {later_count} more courts. {summary}.")
+        lines.append(f"Call the tool again with page={page + 1} for the next page, or narrow the search by park, court or time.")
+    return lines
+
+
+def _footer_tokens(court_ranges: Dict[CourtKey, List[Tuple[int, int]]]) -> int:
+    """An upper bound on the tokens of any page's footer without its park summary (there are at most as many pages as courts)."""
+    widest = len(court_ranges)
+    return _lines_tokens(_footer_lines(widest, widest + 1, widest, ""))
+
+
+def _paginate(court_ranges: Dict[CourtKey, List[Tuple[int, int]]], token_budget: int) -> List[List[CourtKey]]:
+    """Splits the courts into pages of about token_budget tokens of court lines each (a page always holds at least one court)."""
+    pages = [[]]
+    used = 0
+    for court, ranges in court_ranges.items():
+        previous = pages[-1][-1] if pages[-1] else None
+        cost = _lines_tokens(_court_lines(court, ranges, previous))
+        if previous is not None and used + cost > token_budget:
+            pages.append([])
+            cost = _lines_tokens(_court_lines(court, ranges, None))
+            used = 0
+        pages[-1].append(court)
+        used += cost
+    return pages
+
+
+def format_slots_for_llm(slots: List[SlotRecord], page: int = 1, token_budget: int = TOOL_OUTPUT_TOKEN_BUDGET,
+                         unavailable: List[Unavailable] = ()) -> str:
+    """
+    Renders filter results for the LLM, grouped by date and city, then park, then court, with each court's
+    merged free ranges on one line, after the messages of any (date, city) pairs that could not be scraped.
+    Only page `page` of the results (about token_budget tokens in all) is included; the courts on later pages
+    are summarized per park.
+    """
+    notes = _unavailable_lines(unavailable)
+    if not slots:
+        return "\n".join(notes or ["No available courts match these criteria."])
+    court_ranges = _court_ranges(slots)
+    heading = notes + [_heading(court_ranges)]
+    court_budget = token_budget - _lines_tokens(heading)
+    pages = _paginate(court_ranges, court_budget)
+    if len(pages) > 1:
+        # Paged output also carries a footer: leave room for it on every page, plus a share for its park summary,
+        # which then gets whatever room the page's courts left
+        court_budget -= _footer_tokens(court_ranges) + int(token_budget * TOOL_OUTPUT_SUMMARY_SHARE)
+        pages = _paginate(court_ranges, court_budget)
+    if not 1 <= page <= len(pages):
+        return f"There is no page {page}; these results have {len(pages)} page(s)."
+
+    lines = list(heading)
+    previous = None
+    for court in pages[page - 1]:
+        lines.extend(_court_lines(court, court_ranges[court], previous))
+        previous = court
+    if len(pages) > 1:
+        later = [court for later_page in pages[page:] for court in later_page]
+        summary_budget = token_budget - _lines_tokens(lines) - _lines_tokens(_footer_lines(page, len(pages), len(later), ""))
+        lines.extend(_footer_lines(page, len(pages), len(later), _summarize_courts(court_ranges, later, summary_budget)))
+    return "\n".join(lines)
 
-    merged_slots = merge_consecutive_slots(filtered_slots_list)
 
-    return merged_slots
+# --- LLM Setup ---
+# langchain_openai (with the OpenAI client) and langchain's agents package are most of this module's import time,
+# so they are only imported when the model or an AgentExecutor is first built. Processes that never call the LLM
+# (the prefetch worker, /api/availability-only scripts, most benchmarks) don't load them at all; the web app
+# builds them before serving (see app.warm_up and gunicorn.conf.py).
+# Set by get_llm() on first use; assign a model here to replace it (the benchmarks use fakes).
+llm = None
+_llm_lock = threading.Lock()
 
 
-# --- LLM Setup ---
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0, api_key=OPENAI_API_KEY)
+def get_llm():
+    """
+    Returns the shared chat model, creating it on first use. streaming=True so /chat/stream callbacks receive
+    tokens as they arrive (invoke() still returns the whole message); stream_usage=True keeps token counts in
+    streamed responses for the LLM metrics.
+    """
+    global llm
+    with _llm_lock:
+        if llm is None:
+            from langchain_openai import ChatOpenAI
+            llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0, api_key=OPENAI_API_KEY, streaming=True,
+                             stream_usage=True, callbacks=[LLMMetricsHandler()])
+    return llm
 
 
 # Prompt with tool invocation
-def get_current_date_prompt(current_date):
-
+def get_agent_prompt():
+    """
+    Builds the agent's prompt. The current date is a template variable ({current_date}) filled in on every
+    invoke, so the prompt and the agent built from it can be reused across requests and days.
+    """
     prompt = ChatPromptTemplate.from_messages([
         ("system",
-         f"You are a helpful tennis court booking assistant.\n\n"
+         "You are a helpful tennis court booking assistant.\n\n"
          "Your goal is to help users:\n"
          " - find available courts for a sport (usually tennis or pickleball)\n"
          " - request specific courts and times for booking\n"
@@ -256,18 +698,20 @@ def get_current_date_prompt(current_date):
          "1. Extract user preferences (e.g., date, time window, duration, location, or court name).\n"
          "2. If the user doesn't give a date, assume today. If they don’t say how long, assume 1 hour.\n"
          "3. Clearly present the final results to the user."
-         "   * Follow the grouping level city Name, Park name, and the under each court name present the Available time slots"
+         "   * The filter tool already groups its results by date and city, park and court, with consecutive slots merged; keep that grouping and present each court's available time ranges under it."
+         "   * If the tool result says more courts are on further pages, summarize what was shown and offer to show more or narrow the search, rather than fetching every page."
          "   * If no slots match the user's criteria after filtering and merging, politely explain that no availability was found."
          "   * If any tool returns a dictionary with a message key (indicating an error or no data), relay that message to the user directly."
          "6. when the user chooses a specific court and time from the options, ask again to confirm and make sure it's bookable by using your tools.\n"
-         "7. If what user wants is not possible , show other courts in the area that are available in the time range and other times that the specific park/court has availability of ."
+         "7. If what user wants is not possible , show other courts in the area that are available in the time range and other times that the specific park/court has availability of . Use alternatives_tool_for_llm for this: one call returns the nearest options ranked by time and place, so don't loosen the filter tool's arguments over several calls."
          "Maintain conversation context from previous turns. If you need more information, ask clarifying questions."
     
-         f"""
+         """
              **Important Considerations:**
                 * Convert all times to 24-hour HH:MM format before passing them as arguments to tools (e.g., "5 PM" becomes "17:00", "9 AM" becomes "09:00").
                 * Be conversational and helpful in your responses.
                 * Current date: {current_date}.
+                * When the user asks about several days (e.g. "this weekend", "next week"), make one tool call with date set to the first day and end_date set to the last day.
                 * Figure out the day of the week that today is and then what date it would correspond to if the user says "this friday, this sunday" etc.
                 * Current location: Albany, California, United States.
          """
@@ -279,23 +723,79 @@ def get_current_date_prompt(current_date):
     return prompt
 
 # Create the agent
-def get_agent_executor(user_specific_memory, user_specific_tools, current_date_str, redis_client_from_app, scrape_cache_ttl):
-    """Returns a new AgentExecutor instance with user-specific memory, tools, and a dynamic prompt."""
-    global _redis_client, _scrape_cache_ttl_seconds # Access the global variables
-    _redis_client = redis_client_from_app # Set the global redis client
-    _scrape_cache_ttl_seconds = scrape_cache_ttl # Set the global scrape cache TTL
-
-    print(current_date_str)
-    prompt = get_current_date_prompt(current_date_str)
+def get_agent_executor(tools):
+    """
+    Returns an AgentExecutor for the given tools. Build it once per worker and share it between requests:
+    it holds no per-user state, chat history is passed in by invoke_agent.
+    """
+    from langchain.agents import AgentExecutor, create_tool_calling_agent
 
-    base_agent = create_tool_calling_agent(llm, user_specific_tools, prompt)
+    base_agent = create_tool_calling_agent(get_llm(), tools, get_agent_prompt())
 
     return AgentExecutor(
         agent=base_agent,
-        tools=user_specific_tools,
+        tools=tools,
         verbose=True,
-        memory=user_specific_memory,
         return_intermediate_steps=True
     )
 
 
+def invoke_agent(agent_executor, chat_history, message, current_date_str, callbacks=None):
+    """
+    Runs the shared agent_executor for one user message, with chat_history (a list of messages,
+    see chat_history.load_history) as the conversation so far. callbacks are attached to this run only.
+    """
+    turn_tokens = TurnTokenCounter()
+    with timed("agent"):
+        response = agent_executor.invoke(
+            {"message": message, "current_date": current_date_str, "chat_history": chat_history},
+            config={"callbacks": [turn_tokens] + list(callbacks or [])}
+        )
+    turn_tokens.observe()
+    return response
+
+
+def tool_status_text(tool_input: Optional[Dict]) -> str:
+    """Describes a filter tool call for the user while it runs, e.g. "Checking Albany courts for 06/21/2025…"."""
+    tool_input = tool_input or {}
+    cities = ", ".join(tool_input.get("city_names") or []) or "all"
+    dates = tool_input.get("date") or "today"
+    if tool_input.get("end_date"):
+        dates = f"{dates} to {tool_input['end_date']}"
+    return f"Checking {cities} courts for {dates}…"
+
+
+class AgentEventQueueHandler(BaseCallbackHandler):
+    """
+    Callback handler that puts an agent run's progress on a queue as (event, data) pairs:
+    ("status", {"text": ...}) when a tool starts and ("token", {"text": ...}) for each LLM token.
+    """
+
+    def __init__(self, events):
+        self.events = events
+
+    def on_tool_start(self, serialized, input_str, inputs=None, **kwargs):
+        self.events.put(("status", {"text": tool_status_text(inputs)}))
+
+    def on_llm_new_token(self, token, **kwargs):
+        # Tool-call chunks carry no text
+        if token:
+            self.events.put(("token", {"text": token}))
+
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system",
+     "You keep a running summary of a conversation between a user and a tennis court booking assistant. "
+     "Update the summary with the new messages. Keep the user's preferences (dates, times, cities, parks, courts, "
+     "durations) and any courts they chose or were offered. Reply with the summary only, in a few sentences."),
+    ("human", "Current summary:\n{summary}\n\nNew messages:\n{conversation}")
+])
+
+
+def summarize_messages(previous_summary: Optional[str], messages) -> str:
+    """Returns previous_summary updated with messages, for compacting old chat history."""
+    response = get_llm().invoke(SUMMARY_PROMPT.format_messages(
+        summary=previous_summary or "(none)",
+        conversation=get_buffer_string(messages)
+    ))
+    return response.content
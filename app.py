@@ -1,35 +1,52 @@
 # app.py
 
-from flask import Flask, request, jsonify, render_template, session
+from flask import Flask, Response, request, jsonify, render_template, session
 from datetime import datetime, timedelta
 import os
 import uuid
 import json
+import queue
+import threading
+import time
+import math
 import redis
-from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_core.messages import messages_to_dict, messages_from_dict
+from langchain_core.messages import AIMessage, HumanMessage
 from functools import partial
-from langchain.memory import ConversationBufferMemory
 from langchain_core.exceptions import OutputParserException
 from langchain_core.tools import tool
 from typing import List, Dict, Optional
+from pydantic import ValidationError
 
 # Import the core agent logic and the tool's base definition
-from agent import get_agent_executor, filter_court_availability, FilterInput
+from agent import get_agent_executor, invoke_agent, record_snapshot_reads, summarize_messages, AgentEventQueueHandler, estimate_tokens, find_available_slots, filter_court_availability_batch, find_alternative_slots, format_alternatives_for_llm, format_slots_for_llm, AlternativesInput, FilterInput, FilterToolInput
+import chat_history
+import metrics
+import rate_limit
+import redis_connection
+import response_cache
+from metrics import RESPONSE_CACHE_LOOKUPS, RESPONSE_CACHE_SAVED_SECONDS, STAGE_SECONDS, TOOL_OUTPUT_TOKENS, timed
+import scrape_cache
+from scrape_cache import SCRAPE_CACHE_TTL_SECONDS
 
 # --- Global Redis Client ---
-# Initialize Redis client once when the app starts
-redis_url = os.getenv("REDIS_URL")
-
+# Clients connect lazily and reconnect on their own (see redis_connection.py), so a Redis outage at boot
+# or later only degrades chat history and the shared scrape cache until Redis is back.
 # decode_responses=True automatically decodes Redis responses to UTF-8 strings
-redis_client = redis.from_url(redis_url, decode_responses=True)
+redis_client = redis_connection.connect(decode_responses=True)
+# Scrape snapshots are stored in a binary format (see snapshot_codec.py), so they get a client that returns raw bytes
+scrape_cache_redis_client = redis_connection.connect()
+# Calls to redis_client are skipped for a while after a failure instead of paying the timeout on every request
+chat_history_backoff = redis_connection.RedisBackoff("chat history")
+response_cache_backoff = redis_connection.RedisBackoff("response cache")
 # Ping Redis to check connection (optional, good for debugging startup)
 try:
     redis_client.ping()
     print("INFO: Successfully connected to Redis!")
-except redis.exceptions.ConnectionError as e:
-    print(f"ERROR: Could not connect to Redis: {e}")
-    redis_client = None # Set to None if connection fails
+except redis.exceptions.RedisError as e:
+    print(f"ERROR: Could not connect to Redis: {e}. Will keep retrying; chat history will not persist until it is back.")
+
+scrape_cache.configure(scrape_cache_redis_client, SCRAPE_CACHE_TTL_SECONDS)
+rate_limit.configure(scrape_cache_redis_client)
 
 # Create the Flask app instance
 app = Flask(__name__)
@@ -43,8 +60,108 @@ def make_session_permanent():
     session.permanent = True
 
 # --- Constants for Redis Keys and TTLs ---
-CHAT_HISTORY_TTL_SECONDS = int(timedelta(minutes=15).total_seconds()) # Match Flask session lifetime
-SCRAPE_CACHE_TTL_SECONDS = int(timedelta(minutes=15).total_seconds()) # Cache scrape for 1 hour
+# Chat history TTL and window size live in chat_history.py
+# SCRAPE_CACHE_TTL_SECONDS comes from scrape_cache.py so the web app and the prefetch worker agree on it
+# Most queries one /api/availability request may batch together
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "20"))
+# Retry-After of an /api/availability 503 when a city's scrape timed out or failed (rate limits say how long to wait)
+AVAILABILITY_RETRY_AFTER_SECONDS = int(os.getenv("AVAILABILITY_RETRY_AFTER_SECONDS", "10"))
+
+
+# --- Agent ---
+# The tool, prompt and agent are built once per worker and shared by every request;
+# only the user's chat history is loaded per request (see chat_history.py).
+@tool(args_schema=FilterToolInput)
+def filter_tool_for_llm(
+        date: str,
+        city_names: Optional[List[str]] = None,
+        min_start_time: Optional[str] = None,
+        max_end_time: Optional[str] = None,
+        park_name: Optional[str] = None,
+        court_name: Optional[str] = None,
+        min_duration_minutes: Optional[int] = None,
+        end_date: Optional[str] = None,
+        page: Optional[int] = None
+) -> str:
+    """
+    Filters court availability slots based on specified criteria. Returns the free time ranges grouped by
+    date and city, park and court; long results are split into pages.
+    """
+    try:
+        slots, unavailable = find_available_slots( # Call directly, it manages Redis internally
+            date=date,
+            city_names=city_names,
+            min_start_time=min_start_time,
+            max_end_time=max_end_time,
+            park_name=park_name,
+            court_name=court_name,
+            min_duration_minutes=min_duration_minutes,
+            end_date=end_date
+        )
+    except ValueError as e:
+        return f"Error: Invalid date, date range or time provided ({e}). Please use MM/DD/YYYY and HH:MM (24-hour)."
+    output = format_slots_for_llm(slots, page=page or 1, unavailable=unavailable)
+    TOOL_OUTPUT_TOKENS.observe(estimate_tokens(output))
+    return output
+
+
+@tool(args_schema=AlternativesInput)
+def alternatives_tool_for_llm(
+        date: str,
+        start_time: str,
+        duration_minutes: Optional[int] = None,
+        city_names: Optional[List[str]] = None,
+        park_name: Optional[str] = None,
+        court_name: Optional[str] = None,
+        max_shift_minutes: Optional[int] = None,
+        max_results: Optional[int] = None
+) -> str:
+    """
+    Finds the nearest available alternatives when the requested court or time is not free: the requested court
+    at nearby times and other courts around the requested time, ranked best first, in one call.
+    """
+    try:
+        alternatives, unavailable = find_alternative_slots(
+            date=date,
+            start_time=start_time,
+            duration_minutes=duration_minutes,
+            city_names=city_names,
+            park_name=park_name,
+            court_name=court_name,
+            max_shift_minutes=max_shift_minutes,
+            max_results=max_results
+        )
+    except ValueError as e:
+        return f"Error: Invalid date or time provided ({e}). Please use MM/DD/YYYY and HH:MM."
+    output = format_alternatives_for_llm(alternatives, show_location=bool(park_name or court_name), unavailable=unavailable)
+    TOOL_OUTPUT_TOKENS.observe(estimate_tokens(output))
+    return output
+
+
+agent_tools = [filter_tool_for_llm, alternatives_tool_for_llm]
+# Built by warm_up() or the first chat rather than at import (see "LLM Setup" in agent.py); assign one to replace it
+agent_executor = None
+_agent_executor_lock = threading.Lock()
+
+
+def shared_agent_executor():
+    """Returns the AgentExecutor shared by every request, building it (and the LLM client) on first use."""
+    global agent_executor
+    if agent_executor is None:
+        with _agent_executor_lock:
+            if agent_executor is None:
+                agent_executor = get_agent_executor(agent_tools)
+    return agent_executor
+
+
+def warm_up():
+    """
+    Loads the LLM stack and builds the shared AgentExecutor ahead of the first chat. gunicorn calls it in the
+    master before forking workers when preloading, otherwise in each worker before it accepts requests.
+    """
+    started = time.perf_counter()
+    shared_agent_executor()
+    print(f"INFO: Agent ready in {time.perf_counter() - started:.2f}s (pid {os.getpid()}).")
 
 
 # --- Flask Routes ---
@@ -54,9 +171,8 @@ def home():
     return render_template('index.html')
 
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    # --- Assign user session ---
+def get_user_id() -> str:
+    """Returns the session's user_id, assigning a new one on the first request."""
     user_id = session.get('user_id')
     if not user_id:
         user_id = str(uuid.uuid4())
@@ -64,39 +180,89 @@ def chat():
         print(f"INFO: Initializing new session for user_id: {user_id}")
     else:
         print(f"INFO: Existing session for user_id: {user_id}")
+    return user_id
+
+
+# Per-session admission control for /chat and /chat/stream (see rate_limit.py): past a burst of CHAT_RATE_LIMIT_BURST
+# messages, a session sending more than CHAT_RATE_LIMIT_PER_MINUTE is answered with an immediate 429 rather than
+# holding a worker for another agent run
+chat_limiter = rate_limit.TokenBucket("chat", rate_limit.CHAT_RATE_LIMIT_PER_MINUTE / 60, rate_limit.CHAT_RATE_LIMIT_BURST)
+
+
+def chat_rate_limit_response(user_id: str):
+    """Returns a 429 response if the session is over its chat rate limit, or None if its message may go ahead."""
+    allowed, retry_after = chat_limiter.reserve(user_id)
+    if allowed:
+        return None
+    seconds = max(1, math.ceil(retry_after))
+    print(f"INFO: Rate limited user_id: {user_id} for {seconds}s")
+    message = f"You're sending messages faster than I can answer them. Please wait {seconds} seconds and try again."
+    return jsonify({'response': message}), 429, {'Retry-After': str(seconds)}
+
 
-    chat_history_key = f"chat_history:{user_id}"
-    # --- Load User Memory (Chat History) from Redis ---
-    user_specific_memory = None
-    if redis_client:
-        stored_chat_history_json = redis_client.get(chat_history_key)
-
-        past_messages = []
-        if stored_chat_history_json:
-            try:
-                past_messages_dicts = json.loads(stored_chat_history_json)
-                past_messages = messages_from_dict(past_messages_dicts)
-                print(f"INFO: Loaded chat history from Redis for user_id: {user_id}")
-            except (json.JSONDecodeError, TypeError) as e:
-                print(f"WARNING: Could not decode chat history from Redis for user_id {user_id}: {e}. Will start with empty history.")
-                pass
-
-        # --- CORRECTED INITIALIZATION ---
-        user_specific_memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            input_key="message",
-            return_messages=True,
-            chat_memory=ChatMessageHistory(messages=past_messages) # <--- THIS IS THE CORRECT WAY
+def load_past_messages(user_id: str) -> List:
+    """Loads the recent chat history (plus a summary of older turns) from Redis."""
+    with timed("chat_history_load"):
+        past_messages = chat_history_backoff.call(lambda: chat_history.load_history(redis_client, user_id))
+    if past_messages is None:
+        # Without Redis there is nowhere to keep history between requests
+        print("WARNING: Redis not available. Chat history will not persist.")
+        return []
+    print(f"INFO: Loaded {len(past_messages)} chat history messages from Redis for user_id: {user_id}")
+    return past_messages
+
+
+def save_turn(user_id: str, user_message: str, output: str):
+    """Appends this turn to the chat history in Redis, compacting old turns when the history gets long."""
+    with timed("chat_history_save"):
+        history_length = chat_history_backoff.call(
+            lambda: chat_history.append_messages(redis_client, user_id, [HumanMessage(content=user_message), AIMessage(content=output)])
         )
-    else:
-        # Fallback to in-memory if Redis not available
-        print("WARNING: Redis not available. Using in-memory chat history (will not persist).")
-        user_specific_memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            input_key="message",
-            return_messages=True
+    if history_length is None:
+        return
+    print(f"INFO: Saved chat history to Redis for user_id: {user_id}")
+    if chat_history.needs_compaction(history_length):
+        chat_history.compact_in_background(redis_client, user_id, summarize_messages)
+
+
+def cached_response(past_messages: List, user_message: str, current_date_str: str) -> Optional[str]:
+    """Returns the cached answer to a first message while the availability it was built from is unchanged, or None."""
+    if past_messages:
+        return None
+    with timed("response_cache_lookup"):
+        result, entry = response_cache_backoff.call(
+            lambda: response_cache.lookup(redis_client, user_message, current_date_str), ("miss", None)
+        )
+    RESPONSE_CACHE_LOOKUPS.labels(result).inc()
+    if entry is None:
+        return None
+    RESPONSE_CACHE_SAVED_SECONDS.inc(entry.get("agent_seconds", 0.0))
+    print(f"INFO: Answered from the response cache: {user_message!r}")
+    return entry["output"]
+
+
+def run_agent_turn(past_messages: List, user_message: str, current_date_str: str, callbacks=None) -> str:
+    """Runs the agent for one message and returns its answer, caching answers to first messages (see response_cache.py)."""
+    started = time.perf_counter()
+    with record_snapshot_reads() as snapshots:
+        response = invoke_agent(shared_agent_executor(), past_messages, user_message, current_date_str, callbacks=callbacks)
+    output = response["output"]
+    if not past_messages:
+        agent_seconds = time.perf_counter() - started
+        response_cache_backoff.call(
+            lambda: response_cache.store(redis_client, user_message, current_date_str, output, snapshots, agent_seconds)
         )
+    return output
+
 
+@app.route('/chat', methods=['POST'])
+@timed("chat")
+def chat():
+    user_id = get_user_id()
+    rate_limited = chat_rate_limit_response(user_id)
+    if rate_limited:
+        return rate_limited
+    past_messages = load_past_messages(user_id)
 
     # Note: user_caches global is now completely removed. The Redis client will be passed
     # and filter_court_availability will handle caching itself.
@@ -110,48 +276,10 @@ def chat():
         today = datetime.now()
         current_date_str = today.strftime('%m/%d/%Y')
 
-
-        # 2. Define a new tool with a clean signature for the LLM
-        @tool(args_schema=FilterInput)
-        def filter_tool_for_llm(
-                date: str,
-                city_names: Optional[List[str]] = None,
-                min_start_time: Optional[str] = None,
-                max_end_time: Optional[str] = None,
-                park_name: Optional[str] = None,
-                court_name: Optional[str] = None,
-                min_duration_minutes: Optional[int] = None
-        ) -> List:
-            """
-            Filters a list of court availability slots based on specified criteria.
-            """
-            return filter_court_availability( # Call directly, it manages Redis internally
-                date=date,
-                city_names=city_names,
-                min_start_time=min_start_time,
-                max_end_time=max_end_time,
-                park_name=park_name,
-                court_name=court_name,
-                min_duration_minutes=min_duration_minutes
-            )
-
-        # Get a fresh agent executor with the user's specific tools and memory
-        agent_executor = get_agent_executor(
-            user_specific_memory,
-            [filter_tool_for_llm],  # Pass the new tool here
-            current_date_str,
-            redis_client,
-            SCRAPE_CACHE_TTL_SECONDS
-        )
-
-        response = agent_executor.invoke({"message": user_message})
-        output = response["output"]
-
-        # --- Save User Memory (Chat History) to Redis ---
-        if redis_client and user_specific_memory:
-            current_chat_history_dicts = messages_to_dict(user_specific_memory.chat_memory.messages)
-            redis_client.set(chat_history_key, json.dumps(current_chat_history_dicts), ex=CHAT_HISTORY_TTL_SECONDS)
-            print(f"INFO: Saved chat history to Redis for user_id: {user_id}")
+        output = cached_response(past_messages, user_message, current_date_str)
+        if output is None:
+            output = run_agent_turn(past_messages, user_message, current_date_str)
+        save_turn(user_id, user_message, output)
 
         return jsonify({'response': output})
 
@@ -162,5 +290,120 @@ def chat():
         print(f"Error: {e}")
         return jsonify({'response': 'An error occurred while processing your request.'}), 500
 
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming variant of /chat, answered as Server-Sent Events: "status" events while tools run
+    (e.g. "Checking Albany courts…"), "token" events as the LLM writes the answer, then a final "done"
+    event with the whole response (or an "error" event). The agent runs in a separate thread so events
+    are flushed as soon as they are produced.
+    """
+    user_id = get_user_id()
+    rate_limited = chat_rate_limit_response(user_id)
+    if rate_limited:
+        return rate_limited
+    user_message = (request.get_json(silent=True) or {}).get('message')
+    if not user_message:
+        return jsonify({'response': 'Please provide a message.'}), 400
+    past_messages = load_past_messages(user_id)
+    current_date_str = datetime.now().strftime('%m/%d/%Y')
+
+    events = queue.Queue()
+
+    def run_agent():
+        try:
+            output = cached_response(past_messages, user_message, current_date_str)
+            if output is None:
+                output = run_agent_turn(past_messages, user_message, current_date_str,
+                                        callbacks=[AgentEventQueueHandler(events)])
+            # Saved here rather than in the generator so the turn is kept even if the client disconnects
+            save_turn(user_id, user_message, output)
+            events.put(("done", {"response": output}))
+        except OutputParserException as e:
+            print(f"Error: {e}")
+            events.put(("error", {"response": "Sorry, I couldn't process that request."}))
+        except Exception as e:
+            print(f"Error: {e}")
+            events.put(("error", {"response": "An error occurred while processing your request."}))
+
+    threading.Thread(target=run_agent, name=f"chat-stream-{user_id}", daemon=True).start()
+
+    started = time.perf_counter()
+
+    def generate():
+        first_event = True
+        while True:
+            event, data = events.get()
+            if first_event:
+                # Time until the user sees the first progress update or token
+                STAGE_SECONDS.labels("chat_stream_first_event").observe(time.perf_counter() - started)
+                first_event = False
+            yield sse_event(event, data)
+            if event in ("done", "error"):
+                return
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/availability', methods=['POST'])
+@timed("api_availability")
+def availability_api():
+    """
+    Structured availability lookup that skips the LLM. The body is either a single FilterInput object,
+    answered as {"slots": [...]}, or {"queries": [FilterInput, ...]}, answered as {"results": [{"slots": [...]}, ...]}
+    in the same order. Batched queries share one snapshot fetch.
+    If any (date, city) pair could not be scraped, the answer is a 503 with Retry-After, an "error", and each
+    affected result also lists its pairs under "unavailable" (with whatever slots the other pairs had).
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': 'Expected a JSON object.'}), 400
+
+    batched = "queries" in body
+    raw_queries = body["queries"] if batched else [body]
+    if not isinstance(raw_queries, list) or not raw_queries:
+        return jsonify({'error': 'queries must be a non-empty list.'}), 400
+    if len(raw_queries) > MAX_BATCH_QUERIES:
+        return jsonify({'error': f'At most {MAX_BATCH_QUERIES} queries per request.'}), 400
+
+    try:
+        queries = [FilterInput.model_validate(raw_query) for raw_query in raw_queries]
+        results = filter_court_availability_batch(queries)
+    except ValidationError as e:
+        return jsonify({'error': 'Invalid query.', 'details': e.errors(include_url=False, include_context=False)}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({'error': 'An error occurred while looking up availability.'}), 500
+
+    answers = []
+    unavailable = []
+    for slots, query_unavailable in results:
+        answer = {'slots': [slot.to_dict() for slot in slots]}
+        if query_unavailable:
+            answer['unavailable'] = [{'date': item.date, 'city': item.city, 'message': item.message} for item in query_unavailable]
+            unavailable.extend(query_unavailable)
+        answers.append(answer)
+    body = {'results': answers} if batched else answers[0]
+    if not unavailable:
+        return jsonify(body)
+    retry_after = max(1, max(math.ceil(item.retry_after_seconds or AVAILABILITY_RETRY_AFTER_SECONDS) for item in unavailable))
+    cities = ", ".join(dict.fromkeys(item.city for item in unavailable))
+    body['error'] = f'Availability could not be loaded for {cities} right now. Please retry in {retry_after} seconds.'
+    return jsonify(body), 503, {'Retry-After': str(retry_after)}
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics: per-stage latency, scrape cache hits and misses, scrape sizes and LLM tokens (see metrics.py)."""
+    body, content_type = metrics.render()
+    return Response(body, mimetype=content_type)
+
 # if __name__ == '__main__':
 #     app.run(debug=True)
\ No newline at end of file
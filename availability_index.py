@@ -0,0 +1,180 @@
+import hashlib
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+from utils import hhmm_to_minutes, minutes_to_hhmm
+
+# --- Per-court availability bitmaps ---
+# Each court's day is a bitset of fixed-size cells (bit i = the cell starting at i * INDEX_RESOLUTION_MINUTES
+# after midnight), with a bit set when the court is free for that whole cell. Consecutive free slots become
+# runs of set bits, so window and duration queries are bitwise operations on one int per court.
+# The resolution matches the 30-minute booking slots the WebTrac sites use; a slot that doesn't cover a whole
+# cell is not marked free.
+INDEX_RESOLUTION_MINUTES = 30
+CELLS_PER_DAY = 24 * 60 // INDEX_RESOLUTION_MINUTES
+FULL_DAY_MASK = (1 << CELLS_PER_DAY) - 1
+INDEX_BYTES = (CELLS_PER_DAY + 7) // 8
+
+
+class CourtKey(NamedTuple):
+    """Identifies one court on one date."""
+    date: str
+    city_name: str
+    park_name: str
+    court_name: str
+
+
+def slot_cells(start_minutes: int, end_minutes: int) -> int:
+    """Returns the bits for the cells fully covered by a slot. An end at or before the start means midnight."""
+    if end_minutes <= start_minutes:
+        end_minutes = 24 * 60
+    first_cell = -(-start_minutes // INDEX_RESOLUTION_MINUTES)
+    last_cell = end_minutes // INDEX_RESOLUTION_MINUTES
+    if last_cell <= first_cell:
+        return 0
+    return ((1 << (last_cell - first_cell)) - 1) << first_cell
+
+
+def build_index(rows: List[Dict]) -> Dict[CourtKey, int]:
+    """
+    Builds the free-cell bitmap of every court in the rows. Courts with no free slot map to 0,
+    so every scraped court is present. Message rows are skipped.
+    """
+    index: Dict[CourtKey, int] = {}
+    for row in rows:
+        if "message" in row:
+            continue
+        key = CourtKey(row["date"], row["city_name"], row["park_name"], row["court_name"])
+        bits = index.get(key, 0)
+        if row["availability"] == "Available":
+            bits |= slot_cells(hhmm_to_minutes(row["start_time"]), hhmm_to_minutes(row["end_time"]))
+        index[key] = bits
+    return index
+
+
+def window_mask(start_minutes: Optional[int] = None, end_minutes: Optional[int] = None) -> int:
+    """Returns the bits for the cells that lie entirely within [start_minutes, end_minutes]; None means open-ended."""
+    start_minutes = start_minutes or 0
+    end_minutes = 24 * 60 if end_minutes is None else end_minutes
+    if end_minutes <= start_minutes:
+        return 0
+    return slot_cells(start_minutes, end_minutes)
+
+
+def block_starts(bits: int, cells: int) -> int:
+    """Returns the bits at which `cells` consecutive set bits begin (every possible start of a block that long)."""
+    starts = bits
+    for shift in range(1, cells):
+        starts &= bits >> shift
+    return starts
+
+
+def nearest_block_starts(bits: int, cells: int, target_minutes: int) -> List[int]:
+    """
+    Returns the start times (minutes) of the blocks of `cells` free cells that start nearest to target_minutes:
+    the latest one starting at or before it and the earliest one starting after it, whichever exist.
+    """
+    starts = block_starts(bits, cells)
+    target_cell = target_minutes // INDEX_RESOLUTION_MINUTES
+    nearest = []
+    at_or_before = starts & ((1 << (target_cell + 1)) - 1)
+    if at_or_before:
+        nearest.append((at_or_before.bit_length() - 1) * INDEX_RESOLUTION_MINUTES)
+    after = starts >> (target_cell + 1)
+    if after:
+        nearest.append(((after & -after).bit_length() - 1 + target_cell + 1) * INDEX_RESOLUTION_MINUTES)
+    return nearest
+
+
+def runs_at_least(bits: int, cells: int) -> int:
+    """Keeps only the runs of at least `cells` consecutive set bits."""
+    if cells <= 1:
+        return bits
+    # starts has a bit wherever a run of `cells` set bits begins
+    starts = block_starts(bits, cells)
+    # Spread each start back over the run it begins
+    kept = starts
+    for shift in range(1, cells):
+        kept |= starts << shift
+    return kept
+
+
+def free_blocks(bits: int) -> List[Tuple[int, int]]:
+    """Returns the runs of set bits as (start_minutes, end_minutes) pairs, earliest first."""
+    blocks = []
+    while bits:
+        start_cell = (bits & -bits).bit_length() - 1
+        shifted = bits >> start_cell
+        run_length = (~shifted & (shifted + 1)).bit_length() - 1
+        blocks.append((start_cell * INDEX_RESOLUTION_MINUTES, (start_cell + run_length) * INDEX_RESOLUTION_MINUTES))
+        bits &= ~(((1 << run_length) - 1) << start_cell)
+    return blocks
+
+
+def minutes_to_cells(minutes: int) -> int:
+    """Returns how many cells a duration needs, rounding up."""
+    return -(-minutes // INDEX_RESOLUTION_MINUTES)
+
+
+def diff_indexes(old: Dict[CourtKey, int], new: Dict[CourtKey, int]) -> List[Dict]:
+    """
+    Compares two indexes of the same (date, city) and returns one entry per court whose availability changed:
+    {"date", "city_name", "park_name", "court_name", "freed": [[start, end], ...], "taken": [[start, end], ...]},
+    with consecutive cells merged into HH:MM ranges. A court missing from one side counts as fully taken there.
+    """
+    changes = []
+    for court in list(old) + [court for court in new if court not in old]:
+        old_bits = old.get(court, 0)
+        new_bits = new.get(court, 0)
+        if old_bits == new_bits:
+            continue
+        changes.append({
+            **court._asdict(),
+            "freed": [[minutes_to_hhmm(start), minutes_to_hhmm(end)] for start, end in free_blocks(new_bits & ~old_bits)],
+            "taken": [[minutes_to_hhmm(start), minutes_to_hhmm(end)] for start, end in free_blocks(old_bits & ~new_bits)],
+        })
+    return changes
+
+
+def index_fingerprint(index: Dict[CourtKey, int]) -> str:
+    """
+    Returns a short hash of an index's availability (which cells of which courts are free), independent of
+    when it was scraped or the order of its courts. Equal fingerprints mean identical availability.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for court, bits in sorted(index.items()):
+        digest.update("\x1f".join(court).encode())
+        digest.update(bits.to_bytes(INDEX_BYTES, "little"))
+    return digest.hexdigest()
+
+
+# --- Vectorized queries ---
+# For queries over many courts and days at once, the bitmaps are stacked into a (courts, CELLS_PER_DAY) boolean
+# matrix and the window, duration and run extraction happen in a few NumPy passes instead of a loop per court.
+
+def bitmaps_to_matrix(bitmaps: List[int]) -> np.ndarray:
+    """Stacks per-court bitmaps into a (len(bitmaps), CELLS_PER_DAY) boolean matrix, one row per court."""
+    packed = np.frombuffer(b"".join(bits.to_bytes(INDEX_BYTES, "little") for bits in bitmaps), dtype=np.uint8)
+    packed = packed.reshape(len(bitmaps), INDEX_BYTES)
+    return np.unpackbits(packed, axis=1, count=CELLS_PER_DAY, bitorder="little").view(bool)
+
+
+def window_vector(start_minutes: Optional[int] = None, end_minutes: Optional[int] = None) -> np.ndarray:
+    """Boolean row vector of the cells entirely within the window, for ANDing with a bitmap matrix."""
+    mask = window_mask(start_minutes, end_minutes)
+    packed = np.frombuffer(mask.to_bytes(INDEX_BYTES, "little"), dtype=np.uint8)
+    return np.unpackbits(packed, count=CELLS_PER_DAY, bitorder="little").view(bool)
+
+
+def matrix_free_blocks(matrix: np.ndarray, min_cells: int = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds every run of free cells in a bitmap matrix that is at least min_cells long.
+    Returns (row, start_minutes, end_minutes) arrays, ordered by row and then start time.
+    """
+    padded = np.zeros((matrix.shape[0], matrix.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = matrix
+    edges = np.diff(padded, axis=1)
+    # Row-major order pairs each run's rising edge with its falling edge
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    keep = (ends - starts) >= min_cells
+    return rows[keep], starts[keep] * INDEX_RESOLUTION_MINUTES, ends[keep] * INDEX_RESOLUTION_MINUTES
@@ -0,0 +1,81 @@
+"""
+Measures the per-request setup cost of /chat, excluding the LLM call itself.
+"old" rebuilds the tool, prompt, agent and AgentExecutor on every request, as /chat used to.
+"new" reuses one AgentExecutor and only builds the prompt inputs per request.
+No request is sent to OpenAI, so any OPENAI_API_KEY value works.
+
+    OPENAI_API_KEY=x python -m benchmarks.bench_agent_setup --iterations 500
+"""
+import argparse
+from typing import List, Optional
+
+from langchain.agents import AgentExecutor, create_tool_calling_agent
+from langchain.memory import ConversationBufferMemory
+from langchain_core.tools import tool
+
+from agent import FilterInput, filter_court_availability, get_agent_executor, get_agent_prompt, get_llm
+from benchmarks.common import FIXTURE_DATE, time_per_call
+
+
+def new_memory() -> ConversationBufferMemory:
+    return ConversationBufferMemory(memory_key="chat_history", input_key="message", return_messages=True)
+
+
+def build_tool():
+    @tool(args_schema=FilterInput)
+    def filter_tool_for_llm(
+            date: str,
+            city_names: Optional[List[str]] = None,
+            min_start_time: Optional[str] = None,
+            max_end_time: Optional[str] = None,
+            park_name: Optional[str] = None,
+            court_name: Optional[str] = None,
+            min_duration_minutes: Optional[int] = None,
+            end_date: Optional[str] = None
+    ) -> List:
+        """
+        Filters a list of court availability slots based on specified criteria.
+        """
+        return filter_court_availability(date=date, city_names=city_names, min_start_time=min_start_time,
+                                         max_end_time=max_end_time, park_name=park_name, court_name=court_name,
+                                         min_duration_minutes=min_duration_minutes, end_date=end_date)
+    return filter_tool_for_llm
+
+
+def old_setup():
+    """What /chat did before the first LLM call: build everything around the user's memory."""
+    memory = new_memory()
+    tools = [build_tool()]
+    executor = AgentExecutor(
+        agent=create_tool_calling_agent(get_llm(), tools, get_agent_prompt()),
+        tools=tools,
+        verbose=True,
+        memory=memory,
+        return_intermediate_steps=True
+    )
+    return executor.prep_inputs({"message": "any courts tonight?", "current_date": FIXTURE_DATE})
+
+
+def new_setup():
+    """What /chat does now before the first LLM call: only the inputs are per request (history is loaded from Redis)."""
+    return shared_executor.prep_inputs({"message": "any courts tonight?", "current_date": FIXTURE_DATE, "chat_history": []})
+
+
+shared_executor = get_agent_executor([build_tool()])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    old_seconds = time_per_call(old_setup, args.iterations)
+    new_seconds = time_per_call(new_setup, args.iterations)
+    print(f"{'setup':<8} {'us/request':>12}")
+    print(f"{'old':<8} {old_seconds * 1e6:>12.1f}")
+    print(f"{'new':<8} {new_seconds * 1e6:>12.1f}")
+    print(f"saved {(old_seconds - new_seconds) * 1e6:.1f} us per request ({old_seconds / new_seconds:.1f}x less setup)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Compares the JSON scrape cache format with the binary snapshot format from snapshot_codec.py,
+using the rows parsed from the hand-written fixtures. Reports encoded size and encode/decode time,
+and fails if a binary round trip doesn't reproduce the rows exactly.
+
+    python -m benchmarks.bench_cache_format --iterations 2000
+"""
+import argparse
+import json
+import sys
+import time
+
+from benchmarks.common import FIXTURE_DATE, load_fixtures, time_per_call
+from scrapers import parse_webtrac_results
+from snapshot_codec import decode_rows, encode_snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    failures = 0
+    print(f"{'fixture':<32} {'format':<8} {'rows':>6} {'bytes':>8} {'encode us':>10} {'decode us':>10}")
+    for name, page in load_fixtures().items():
+        rows = parse_webtrac_results(page, city_name="Albany", target_date=FIXTURE_DATE)
+        fetched_at = time.time()
+
+        json_blob = json.dumps({"fetched_at": fetched_at, "rows": rows})
+        binary_blob = encode_snapshot(rows, fetched_at)
+        if decode_rows(binary_blob) != rows:
+            failures += 1
+            print(f"MISMATCH: {name}: binary round trip changed the rows")
+
+        formats = (
+            ("json", json_blob, lambda: json.dumps({"fetched_at": fetched_at, "rows": rows}), lambda: json.loads(json_blob)["rows"]),
+            ("binary", binary_blob, lambda: encode_snapshot(rows, fetched_at), lambda: decode_rows(binary_blob)),
+        )
+        for label, blob, encode, decode in formats:
+            encode_seconds = time_per_call(encode, args.iterations)
+            decode_seconds = time_per_call(decode, args.iterations)
+            size = len(blob.encode("utf-8") if isinstance(blob, str) else blob)
+            print(f"{name:<32} {label:<8} {len(rows):>6} {size:>8} {encode_seconds * 1e6:>10.1f} {decode_seconds * 1e6:>10.1f}")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Measures the cost of filtering availability as the number of days and cities grows, comparing the per-court loop
+over the bitmaps with the vectorized NumPy pass. agent.filter_snapshots switches between the two at VECTORIZE_MIN_COURTS.
+Snapshots are built from the hand-written fixtures, with each city a renamed copy, so no Redis or network is needed.
+
+    python -m benchmarks.bench_filter --iterations 200
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+import agent
+from agent import SlotRecord, filter_snapshots
+from availability_index import free_blocks, minutes_to_cells, runs_at_least, window_mask
+from benchmarks.common import load_fixtures, time_per_call
+from scrapers import parse_webtrac_results
+from snapshot_codec import Snapshot, encode_snapshot
+from utils import hhmm_to_minutes
+
+FILTERS = {"min_start_time": "17:00", "max_end_time": "22:00", "min_duration_minutes": 60}
+
+
+def build_snapshots(pages, days, cities):
+    start = datetime(2025, 6, 16)
+    snapshots = {}
+    for day in range(days):
+        date = (start + timedelta(days=day)).strftime("%m/%d/%Y")
+        page = pages[day % len(pages)]
+        for city_number in range(cities):
+            city = f"City{city_number}"
+            rows = parse_webtrac_results(page, city_name=city, target_date=date)
+            snapshots[(date, city)] = Snapshot.from_blob(encode_snapshot(rows, time.time()))
+    return snapshots
+
+
+def per_court_loop(snapshots):
+    mask = window_mask(hhmm_to_minutes(FILTERS["min_start_time"]), hhmm_to_minutes(FILTERS["max_end_time"]))
+    min_cells = minutes_to_cells(FILTERS["min_duration_minutes"])
+    results = []
+    for snapshot in snapshots.values():
+        for court, bits in snapshot.index.items():
+            for start, end in free_blocks(runs_at_least(bits & mask, min_cells)):
+                results.append(SlotRecord(court, start, end))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    pages = list(load_fixtures().values())
+    print(f"{'days':>5} {'cities':>7} {'courts':>7} {'slots':>7} {'results':>8} {'loop us':>10} {'vector us':>10} {'vector ns/slot':>15}")
+    for days, cities in ((1, 1), (7, 1), (7, 4), (14, 8)):
+        snapshots = build_snapshots(pages, days, cities)
+        for snapshot in snapshots.values():
+            snapshot.index  # decode once, as a warm cache hit would
+        courts = sum(len(snapshot.index) for snapshot in snapshots.values())
+        slots = sum(len(snapshot.rows) for snapshot in snapshots.values())
+
+        agent.VECTORIZE_MIN_COURTS = 0  # always take the vectorized path
+        vector_results = filter_snapshots(snapshots, **FILTERS)
+        loop_results = per_court_loop(snapshots)
+        if vector_results != loop_results:
+            print(f"MISMATCH at {days} days x {cities} cities")
+            sys.exit(1)
+
+        loop_seconds = time_per_call(lambda: per_court_loop(snapshots), args.iterations)
+        vector_seconds = time_per_call(lambda: filter_snapshots(snapshots, **FILTERS), args.iterations)
+        print(f"{days:>5} {cities:>7} {courts:>7} {slots:>7} {len(vector_results):>8} {loop_seconds * 1e6:>10.1f} {vector_seconds * 1e6:>10.1f} {vector_seconds * 1e9 / slots:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Compares the line-based text parser with the structured WebTrac table parser over the fixtures in benchmarks/fixtures,
+hand-written pages that follow the WebTrac results markup (the live site was not reachable to record from).
+Reports rows/sec and peak memory for each, and fails if the two parsers disagree.
+Peak memory is measured with tracemalloc, so it covers Python objects but not lxml's C-level tree.
+
+    python -m benchmarks.bench_parser --iterations 200
+"""
+import argparse
+import sys
+
+from benchmarks.common import FIXTURE_DATE, load_fixtures, peak_memory_bytes, time_per_call
+from scrapers import clean_page_text, parse_webtrac_results, parse_webtrac_text
+
+
+def old_parser(page: bytes):
+    return parse_webtrac_text(clean_page_text(page.decode("utf-8")), city_name="Albany", target_date=FIXTURE_DATE)
+
+
+def new_parser(page: bytes):
+    return parse_webtrac_results(page, city_name="Albany", target_date=FIXTURE_DATE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    mismatches = 0
+    print(f"{'fixture':<32} {'parser':<8} {'rows':>6} {'ms/page':>10} {'rows/sec':>12} {'peak KiB':>10}")
+    for name, page in load_fixtures().items():
+        old_rows = old_parser(page)
+        new_rows = new_parser(page)
+        if old_rows != new_rows:
+            mismatches += 1
+            print(f"MISMATCH: {name}: text parser produced {len(old_rows)} rows, table parser produced {len(new_rows)} rows")
+
+        for label, func, rows in (("old", old_parser, old_rows), ("new", new_parser, new_rows)):
+            seconds = time_per_call(lambda: func(page), args.iterations)
+            peak = peak_memory_bytes(lambda: func(page))
+            print(f"{name:<32} {label:<8} {len(rows):>6} {seconds * 1000:>10.3f} {len(rows) / seconds:>12,.0f} {peak / 1024:>10.1f}")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Compares gunicorn worker classes for the chat pipeline. For each mode it starts gunicorn on
+benchmarks.serving_app (app.py with a fake LLM that waits --llm-latency seconds per call), sends --requests
+/chat requests from --concurrency clients at once, and reports throughput and latency percentiles.
+Every mode gets the same number of worker processes, so the difference is how many chats one worker can hold.
+
+    OPENAI_API_KEY=x python -m benchmarks.bench_serving --workers 2 --concurrency 32 --requests 128
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+MODES = ("sync", "gthread", "gevent")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout_seconds: float = 60):
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except (requests.ConnectionError, requests.Timeout):
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not start within {timeout_seconds}s")
+
+
+def send_chat(base_url: str) -> float:
+    """Sends one /chat request from a fresh client session and returns its latency in seconds."""
+    start = time.perf_counter()
+    response = requests.post(f"{base_url}/chat", json={"message": "Any courts tonight after 6pm?"}, timeout=120)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def run_mode(mode: str, args) -> dict:
+    port = free_port()
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=mode, WEB_CONCURRENCY=str(args.workers),
+               GUNICORN_THREADS=str(args.threads), BENCH_LLM_LATENCY_SECONDS=str(args.llm_latency),
+               OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "x"), REDIS_URL=os.getenv("BENCH_REDIS_URL", "redis://127.0.0.1:1"))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+         "--log-level", "warning", "benchmarks.serving_app:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_up(base_url, process)
+        with ThreadPoolExecutor(max_workers=args.concurrency) as clients:
+            start = time.perf_counter()
+            latencies = sorted(clients.map(lambda _: send_chat(base_url), range(args.requests)))
+            elapsed = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    return {
+        "mode": mode,
+        "rps": args.requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=16, help="threads per worker in gthread mode")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=128)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds the fake LLM waits per call")
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers, {args.concurrency} concurrent clients, {args.requests} requests, "
+          f"fake LLM latency {args.llm_latency}s")
+    print(f"{'mode':<10} {'req/s':>8} {'p50 s':>8} {'p95 s':>8}")
+    for mode in args.modes:
+        result = run_mode(mode, args)
+        print(f"{result['mode']:<10} {result['rps']:>8.1f} {result['p50']:>8.2f} {result['p95']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Measures what building Pydantic models costs per filter call. Compares the original pipeline (one FilteredCourtSlot
+per matching scraped row, then a second round of models when merging consecutive slots) with the SlotRecord
+pipeline: agent.filter_snapshots on its own (what /api/availability and the agent tool use), and with the
+conversion to models that filter_court_availability still returns. Reports time and Python heap
+allocations per call (peak during the call, and what the result keeps alive). Snapshots come from the hand-written fixtures.
+
+    OPENAI_API_KEY=x python -m benchmarks.bench_slot_records --iterations 200
+"""
+import argparse
+import gc
+import sys
+import tracemalloc
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
+
+from agent import FilteredCourtSlot, filter_snapshots
+from benchmarks.bench_filter import build_snapshots
+from benchmarks.common import load_fixtures, time_per_call
+from utils import hhmm_to_minutes
+
+FILTERS = {"min_start_time": "17:00", "max_end_time": "22:00"}
+
+
+def legacy_merge_consecutive_slots(filtered_rows: List[FilteredCourtSlot]) -> List[FilteredCourtSlot]:
+    """The original pipeline's merge_consecutive_slots: models in, tuples while merging, new models out."""
+    grouped = defaultdict(list)
+    for row in filtered_rows:
+        if row.availability == "Available":
+            grouped[(row.date, row.city_name, row.park_name, row.court_name)].append((row.start_time, row.end_time))
+    merged = []
+    for (date, city, park, court), intervals in grouped.items():
+        intervals.sort(key=lambda interval: hhmm_to_minutes(interval[0]))
+        merged_intervals = []
+        current_start, current_end = intervals[0]
+        for start, end in intervals[1:]:
+            if hhmm_to_minutes(start) == hhmm_to_minutes(current_end):
+                current_end = end
+            else:
+                merged_intervals.append((current_start, current_end))
+                current_start, current_end = start, end
+        merged_intervals.append((current_start, current_end))
+        for start, end in merged_intervals:
+            merged.append(FilteredCourtSlot(date=date, city_name=city, park_name=park, court_name=court,
+                                            start_time=start, end_time=end, availability="Available"))
+    return merged
+
+
+def legacy_pipeline(snapshots) -> List[FilteredCourtSlot]:
+    """The original filter: a model for every matching scraped row, then merge_consecutive_slots."""
+    min_start = hhmm_to_minutes(FILTERS["min_start_time"])
+    max_end = hhmm_to_minutes(FILTERS["max_end_time"])
+    filtered = []
+    for (date, _), snapshot in snapshots.items():
+        for slot in snapshot.rows:
+            if slot.get("availability") != "Available" or slot.get("date") != date:
+                continue
+            if hhmm_to_minutes(slot["start_time"]) < min_start or hhmm_to_minutes(slot["end_time"]) > max_end:
+                continue
+            filtered.append(FilteredCourtSlot(**{field: slot[field] for field in FilteredCourtSlot.model_fields}))
+    return legacy_merge_consecutive_slots(filtered)
+
+
+def allocations(func: Callable) -> Tuple[int, int, int]:
+    """Returns (peak bytes during the call, bytes and blocks still held by its result) for one call of func()."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        stats = tracemalloc.take_snapshot().statistics("filename")
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak, sum(stat.size for stat in stats), sum(stat.count for stat in stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    pages = list(load_fixtures().values())
+    paths: Dict[str, Callable] = {
+        "legacy rows -> models -> merge": legacy_pipeline,
+        "SlotRecord -> models": lambda snapshots: [slot.to_model() for slot in filter_snapshots(snapshots, **FILTERS)],
+        "SlotRecord only": lambda snapshots: filter_snapshots(snapshots, **FILTERS),
+    }
+    print(f"{'days':>4} {'cities':>6} {'results':>7}  {'path':<32} {'us/call':>9} {'peak KiB':>9} {'result KiB':>10} {'result blocks':>13}")
+    for days, cities in ((1, 1), (7, 4)):
+        snapshots = build_snapshots(pages, days, cities)
+        for snapshot in snapshots.values():
+            snapshot.rows, snapshot.index  # decode once, as a warm cache hit would
+
+        expected = [slot.model_dump() for slot in legacy_pipeline(snapshots)]
+        if sorted(map(repr, expected)) != sorted(repr(slot.to_dict()) for slot in filter_snapshots(snapshots, **FILTERS)):
+            print(f"MISMATCH at {days} days x {cities} cities")
+            sys.exit(1)
+
+        for name, path in paths.items():
+            seconds = time_per_call(lambda: path(snapshots), args.iterations)
+            peak, held, blocks = allocations(lambda: path(snapshots))
+            print(f"{days:>4} {cities:>6} {len(expected):>7}  {name:<32} {seconds * 1e6:>9.1f} {peak / 1024:>9.1f} {held / 1024:>10.1f} {blocks:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Measures the SQLite snapshot store (snapshot_store.py) on a temporary file: recording snapshots, the warm-start
+lookup of the latest snapshot for a day's cities, and range scans over the recorded history. The history is
+--days dates x --cities cities x --versions snapshots each, built from the hand-written fixtures; consecutive
+versions of a (date, city) use different fixture pages, so each one is a new availability state and gets a row.
+
+    python -m benchmarks.bench_snapshot_store --days 14 --cities 4 --versions 50
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import snapshot_store
+from benchmarks.common import load_fixtures, time_per_call
+from scrapers import parse_webtrac_results
+from snapshot_codec import Snapshot, encode_snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--cities", type=int, default=4)
+    parser.add_argument("--versions", type=int, default=50, help="snapshots recorded per (date, city)")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    pages = list(load_fixtures().values())
+    start = datetime(2025, 6, 16)
+    dates = [(start + timedelta(days=day)).strftime("%m/%d/%Y") for day in range(args.days)]
+    cities = [f"City{number}" for number in range(args.cities)]
+    blobs = {
+        (date, city, page): encode_snapshot(parse_webtrac_results(pages[page], city_name=city, target_date=date), 0.0)
+        for date in dates for city in cities for page in range(len(pages))
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_store.configure(os.path.join(directory, "snapshots.sqlite3"))
+        now = time.time()
+        started = time.perf_counter()
+        for version in range(args.versions):
+            fetched_at = now - (args.versions - version) * 300
+            for day, date in enumerate(dates):
+                for city in cities:
+                    blob = blobs[(date, city, (day + version) % len(pages))]
+                    snapshot_store.record(date, city, Snapshot(fetched_at, blob=blob))
+        snapshot_store.flush()
+        write_seconds = time.perf_counter() - started
+        recorded = args.versions * len(dates) * len(cities)
+        size = os.path.getsize(os.path.join(directory, "snapshots.sqlite3"))
+        print(f"recorded {recorded} snapshots ({size / 1e6:.1f} MB) in {write_seconds:.2f}s: "
+              f"{recorded / write_seconds:.0f} snapshots/s")
+
+        keys = [(dates[0], city) for city in cities]
+        latest_seconds = time_per_call(lambda: snapshot_store.latest(keys, max_age_seconds=1e9), args.iterations)
+        print(f"latest() for {len(keys)} cities: {latest_seconds * 1e6:.0f} us")
+
+        for label, scan_args in (
+            ("one date, one city", (dates[0], dates[0], cities[0])),
+            ("all dates, one city", (dates[0], dates[-1], cities[0])),
+            ("all dates, all cities", (dates[0], dates[-1], None)),
+        ):
+            started = time.perf_counter()
+            rows = sum(1 for _ in snapshot_store.scan(*scan_args))
+            scan_seconds = time.perf_counter() - started
+            print(f"scan {label}: {rows} snapshots in {scan_seconds * 1000:.1f} ms ({rows / scan_seconds:.0f} snapshots/s)")
+        snapshot_store.configure(None)
+
+
+if __name__ == "__main__":
+    main()
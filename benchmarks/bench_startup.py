@@ -0,0 +1,77 @@
+"""
+Measures how long importing each entry point takes in a fresh interpreter, which is what a gunicorn worker
+(without preload), the prefetch worker and every dyno restart pay before serving anything. For each module it
+reports the median wall time and peak RSS over --runs processes, and the heaviest third-party packages it pulls
+in (from `python -X importtime`). Redis is pointed at a closed port so no connection is made.
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["scrapers", "scrape_cache", "prefetch", "agent", "app"]
+TOP_PACKAGES = 6
+
+_MEASURE = (
+    "import resource, sys, time\n"
+    "start = time.perf_counter()\n"
+    "import {module}\n"
+    "elapsed = time.perf_counter() - start\n"
+    "sys.stderr.write(f'@@ {{elapsed}} {{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}\\n')\n"
+)
+
+
+def _environment() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "x")
+    env["REDIS_URL"] = "redis://localhost:1"
+    env["SNAPSHOT_STORE_PATH"] = ""
+    env["PYTHONPATH"] = ROOT
+    return env
+
+
+def measure(module: str) -> Tuple[float, int]:
+    """Returns (import seconds, peak RSS in KiB) of importing module in a new interpreter."""
+    result = subprocess.run([sys.executable, "-c", _MEASURE.format(module=module)], cwd=ROOT, env=_environment(),
+                            capture_output=True, text=True, check=True)
+    line = next(line for line in result.stderr.splitlines() if line.startswith("@@ "))
+    seconds, rss = line.split()[1:]
+    return float(seconds), int(rss)
+
+
+def heaviest_packages(module: str) -> List[Tuple[str, float]]:
+    """Returns the top-level packages with the largest self import time when importing module, in seconds."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                            env=_environment(), capture_output=True, text=True, check=True)
+    totals = defaultdict(float)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        totals[name.strip().split(".")[0]] += int(self_us) / 1e6
+    return sorted(totals.items(), key=lambda item: -item[1])[:TOP_PACKAGES]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    print(f"{'module':<14} {'import s':>9} {'RSS MiB':>8}  heaviest packages (self import s)")
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.runs)]
+        seconds = statistics.median(run[0] for run in runs)
+        rss = statistics.median(run[1] for run in runs)
+        packages = ", ".join(f"{name} {package_seconds:.2f}" for name, package_seconds in heaviest_packages(module))
+        print(f"{module:<14} {seconds:>9.2f} {rss / 1024:>8.0f}  {packages}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Shared helpers for the benchmark scripts. Run the scripts from the repo root, e.g. `python -m benchmarks.bench_parser`."""
+import os
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FIXTURE_DATE = "06/21/2025"
+
+
+def load_fixtures() -> Dict[str, bytes]:
+    """Returns the WebTrac HTML pages in benchmarks/fixtures (hand-written copies of the results markup), keyed by file name."""
+    pages = {}
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        if name.endswith(".html"):
+            with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+                pages[name] = f.read()
+    return pages
+
+
+def time_per_call(func: Callable, iterations: int) -> float:
+    """Returns the mean wall time of func() in seconds over the given number of iterations."""
+    func()  # warm up caches and lazy imports
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+
+def peak_memory_bytes(func: Callable) -> int:
+    """Returns the peak Python heap allocation while running func() once."""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
@@ -0,0 +1,159 @@
+"""
+Stand-ins for the external services, so benchmarks can run the real app offline: a local HTTP server that serves
+the hand-written WebTrac pages in benchmarks/fixtures, and a deterministic chat model that speaks the tool-calling protocol.
+"""
+import json
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage, get_buffer_string
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from benchmarks.common import load_fixtures
+
+DATE_PATTERN = re.compile(r"\b(\d{2}/\d{2}/\d{4})\b")
+AFTER_PATTERN = re.compile(r"\bafter (\d{1,2}:\d{2})\b")
+PARK_PATTERN = re.compile(r"\bat ([A-Z][\w ]*? Park)\b")
+RANGE_PATTERN = re.compile(r"\b\d{2}:\d{2}-\d{2}:\d{2}\b")
+
+
+class FakeWebTracServer:
+    """
+    Serves the hand-written WebTrac search pages over HTTP on 127.0.0.1, after latency_seconds, picking the weekend
+    or weekday page from the request's date parameter. Point the Albany scraper at it with ALBANY_WEBTRAC_BASE_URL.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0):
+        fixtures = load_fixtures()
+        self.pages = {
+            "weekday": fixtures["albany_webtrac_weekday.html"],
+            "weekend": fixtures["albany_webtrac_weekend.html"],
+        }
+        self.latency_seconds = latency_seconds
+        self.requests_served = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                page = server.page_for(query.get("date", [""])[0])
+                time.sleep(server.latency_seconds)
+                with server._lock:
+                    server.requests_served += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def page_for(self, date: str) -> bytes:
+        try:
+            weekend = datetime.strptime(date, "%m/%d/%Y").weekday() >= 5
+        except ValueError:
+            weekend = False
+        return self.pages["weekend" if weekend else "weekday"]
+
+    def start(self) -> "FakeWebTracServer":
+        threading.Thread(target=self._httpd.serve_forever, name="fake-webtrac", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+
+
+class FakeToolCallingChatModel(BaseChatModel):
+    """
+    Deterministic chat model for load tests. For a new user message it calls tool_name with the date
+    (MM/DD/YYYY), "after HH:MM" and "at <Name> Park" found in the message; once the tool result is in the
+    conversation it answers with a short summary, streamed word by word. Every call waits latency_seconds
+    and reports roughly 4 characters per token as usage.
+    """
+    tool_name: str = "filter_tool_for_llm"
+    latency_seconds: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-tool-calling"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _reply(self, messages: List[BaseMessage]) -> AIMessage:
+        usage = {"input_tokens": len(get_buffer_string(messages)) // 4}
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            slots = len(RANGE_PATTERN.findall(str(last.content)))
+            content = f"I found {slots} available time ranges. Would you like to book one of them?"
+            usage["output_tokens"] = len(content) // 4
+            usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+            return AIMessage(content=content, usage_metadata=usage)
+
+        text = str(last.content) if isinstance(last, HumanMessage) else ""
+        args: Dict[str, Any] = {"city_names": ["Albany"]}
+        date = DATE_PATTERN.search(text)
+        if date:
+            args["date"] = date.group(1)
+        after = AFTER_PATTERN.search(text)
+        if after:
+            args["min_start_time"] = after.group(1).zfill(5)
+        park = PARK_PATTERN.search(text)
+        if park:
+            args["park_name"] = park.group(1)
+        usage["output_tokens"] = 20
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return AIMessage(content="", tool_calls=[{"name": self.tool_name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}],
+                         usage_metadata=usage)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency_seconds)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        time.sleep(self.latency_seconds)
+        reply = self._reply(messages)
+        if reply.tool_calls:
+            call = reply.tool_calls[0]
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}],
+                usage_metadata=reply.usage_metadata,
+            ))
+            return
+        words = reply.content.split(" ")
+        for i, word in enumerate(words):
+            token = word if i == len(words) - 1 else word + " "
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content=token,
+                usage_metadata=reply.usage_metadata if i == 0 else None,
+            ))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def simulated_messages(dates: List[str], turns: int, user_index: int) -> List[str]:
+    """The messages one simulated user sends, cycling through dates, start times and parks."""
+    parks = ["", " at Memorial Park", " at Ocean View Park", " at Terrace Park"]
+    messages = []
+    for turn in range(turns):
+        date = dates[(user_index + turn) % len(dates)]
+        hour = 7 + (user_index * 3 + turn * 5) % 14
+        park = parks[(user_index + turn) % len(parks)]
+        messages.append(f"Any tennis courts on {date} after {hour:02d}:00{park}?")
+    return messages
+
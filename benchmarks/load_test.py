@@ -0,0 +1,185 @@
+"""
+Offline load test of the real Flask app. Starts a stand-in WebTrac server with the hand-written pages
+in benchmarks/fixtures, swaps the OpenAI model for a deterministic tool-calling fake, keeps Redis in fakeredis
+(or --redis-url), serves app.py on a local port and drives --users concurrent simulated users through /chat
+(or /chat/stream with --stream), each sending --turns messages, --waves times over on fresh sessions (so later
+waves' opening messages can hit the response cache). Reports throughput, latency percentiles, cache and token
+figures and the per-stage breakdown from /metrics. Nothing is sent to OpenAI or the real booking site.
+
+    OPENAI_API_KEY=x python -m benchmarks.load_test --users 16 --turns 4
+"""
+import argparse
+import contextlib
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+from benchmarks.common import FIXTURE_DATE
+from benchmarks.fakes import FakeToolCallingChatModel, FakeWebTracServer, simulated_messages
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def read_metrics(base_url: str) -> Dict[Tuple[str, Tuple], float]:
+    """Returns every sample on /metrics keyed by (sample name, sorted labels)."""
+    samples = {}
+    for family in text_string_to_metric_families(requests.get(f"{base_url}/metrics", timeout=10).text):
+        for sample in family.samples:
+            samples[(sample.name, tuple(sorted(sample.labels.items())))] = sample.value
+    return samples
+
+
+def metrics_delta(before: Dict, after: Dict) -> Dict:
+    return {key: value - before.get(key, 0.0) for key, value in after.items()}
+
+
+def run_user(base_url: str, messages: List[str], stream: bool) -> List[Tuple[float, str]]:
+    """
+    Sends one simulated user's messages in order on its own session. Returns (latency seconds, outcome) per turn,
+    the outcome being "ok", "rate_limited" (a 429 from the per-session chat limit) or "error".
+    """
+    session = requests.Session()
+    results = []
+    for message in messages:
+        start = time.perf_counter()
+        try:
+            if stream:
+                response = session.post(f"{base_url}/chat/stream", json={"message": message}, stream=True, timeout=120)
+                ok = response.ok and any(line.startswith(b"event: done") for line in response.iter_lines())
+            else:
+                response = session.post(f"{base_url}/chat", json={"message": message}, timeout=120)
+                ok = response.ok
+            outcome = "ok" if ok else "rate_limited" if response.status_code == 429 else "error"
+        except requests.RequestException:
+            outcome = "error"
+        results.append((time.perf_counter() - start, outcome))
+    return results
+
+
+def start_app(args, upstream: FakeWebTracServer) -> str:
+    """Imports app.py against the fakes and serves it on a free local port. Returns its base URL."""
+    os.environ["ALBANY_WEBTRAC_BASE_URL"] = upstream.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "x")
+    os.environ["REDIS_URL"] = args.redis_url or "redis://127.0.0.1:1"
+
+    import agent
+    import app as chat_app
+    import rate_limit
+    import scrape_cache
+    import snapshot_store
+    from metrics import LLMMetricsHandler
+    from werkzeug.serving import make_server
+
+    if not args.redis_url:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        chat_app.redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+        scrape_cache.configure(fakeredis.FakeRedis(server=server))
+        rate_limit.configure(fakeredis.FakeRedis(server=server))
+    elif args.flush_redis:
+        chat_app.redis_client.flushdb()
+    snapshot_store.configure(args.snapshot_store)
+
+    agent.llm = FakeToolCallingChatModel(latency_seconds=args.llm_latency, callbacks=[LLMMetricsHandler()])
+    chat_app.agent_executor = agent.get_agent_executor(chat_app.agent_tools)
+
+    if not args.verbose:
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    httpd = make_server("127.0.0.1", 0, chat_app.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, name="load-test-app", daemon=True).start()
+    return f"http://127.0.0.1:{httpd.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=16, help="concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=4, help="messages per user")
+    parser.add_argument("--waves", type=int, default=1, help="run the users this many times, one wave after another, each on new sessions")
+    parser.add_argument("--days", type=int, default=3, help="distinct dates the users ask about")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds the fake LLM waits per call")
+    parser.add_argument("--upstream-latency", type=float, default=0.5, help="seconds the fake WebTrac site waits per page")
+    parser.add_argument("--stream", action="store_true", help="use /chat/stream instead of /chat")
+    parser.add_argument("--redis-url", help="use this Redis instead of fakeredis")
+    parser.add_argument("--flush-redis", action="store_true", help="FLUSHDB the --redis-url database first")
+    parser.add_argument("--snapshot-store", help="record snapshots in (and warm-start from) this SQLite file; off by default")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own log output")
+    args = parser.parse_args()
+
+    upstream = FakeWebTracServer(args.upstream_latency).start()
+    start_date = datetime.strptime(FIXTURE_DATE, "%m/%d/%Y")
+    dates = [(start_date + timedelta(days=offset)).strftime("%m/%d/%Y") for offset in range(args.days)]
+
+    app_output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with app_output:
+        base_url = start_app(args, upstream)
+        before = read_metrics(base_url)
+        with ThreadPoolExecutor(max_workers=args.users) as users:
+            start = time.perf_counter()
+            per_user = []
+            for _ in range(args.waves):
+                per_user.extend(users.map(
+                    lambda user: run_user(base_url, simulated_messages(dates, args.turns, user), args.stream),
+                    range(args.users)
+                ))
+            elapsed = time.perf_counter() - start
+        delta = metrics_delta(before, read_metrics(base_url))
+    upstream.stop()
+
+    results = [result for user_results in per_user for result in user_results]
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, outcome in results if outcome == "error")
+    rate_limited = sum(1 for _, outcome in results if outcome == "rate_limited")
+    answered = max(1, len(results) - rate_limited)
+
+    endpoint = "/chat/stream" if args.stream else "/chat"
+    print(f"{args.waves} x {args.users} users x {args.turns} turns on {endpoint}, {args.days} dates, "
+          f"fake LLM {args.llm_latency}s/call, fake upstream {args.upstream_latency}s/page")
+    print(f"requests {len(results)}  errors {errors}  rate limited {rate_limited}  elapsed {elapsed:.2f}s  throughput {len(results) / elapsed:.1f} req/s")
+    print(f"latency p50 {statistics.median(latencies) * 1000:.0f} ms  p95 {percentile(latencies, 0.95) * 1000:.0f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms")
+    print(f"upstream pages fetched {upstream.requests_served}")
+
+    cache = {dict(labels)["result"]: value for (name, labels), value in delta.items() if name == "tennis_scrape_cache_lookups_total"}
+    tokens = {dict(labels)["kind"]: value for (name, labels), value in delta.items() if name == "tennis_llm_tokens_total"}
+    print(f"scrape cache hit {cache.get('hit', 0):.0f}  stale {cache.get('stale', 0):.0f}  miss {cache.get('miss', 0):.0f}")
+    print(f"LLM tokens prompt {tokens.get('prompt', 0):.0f}  completion {tokens.get('completion', 0):.0f}  "
+          f"per turn {tokens.get('prompt', 0) / answered:.0f} + {tokens.get('completion', 0) / answered:.0f}")
+    responses = {dict(labels)["result"]: value for (name, labels), value in delta.items() if name == "tennis_response_cache_lookups_total"}
+    print(f"response cache hit {responses.get('hit', 0):.0f}  miss {responses.get('miss', 0):.0f}  "
+          f"invalidated {responses.get('invalidated', 0):.0f}  agent time saved {delta.get(('tennis_response_cache_saved_seconds_total', ()), 0.0):.2f}s")
+    limits = {(dict(labels)["limiter"], dict(labels)["result"]): value for (name, labels), value in delta.items()
+              if name == "tennis_rate_limit_decisions_total"}
+    print("rate limits " + "  ".join(f"{limiter} {result} {value:.0f}" for (limiter, result), value in sorted(limits.items()) if value))
+    tool_calls = delta.get(("tennis_tool_output_tokens_count", ()), 0.0)
+    if tool_calls:
+        print(f"tool output tokens per call {delta[('tennis_tool_output_tokens_sum', ())] / tool_calls:.0f} (estimated)")
+
+    stages = defaultdict(dict)
+    for (name, labels), value in delta.items():
+        if name in ("tennis_stage_seconds_sum", "tennis_stage_seconds_count"):
+            stages[dict(labels)["stage"]][name.rsplit("_", 1)[1]] = value
+    print(f"\n{'stage':<32} {'count':>7} {'mean ms':>9} {'total s':>9}")
+    for stage, values in sorted(stages.items(), key=lambda item: -item[1].get("sum", 0.0)):
+        count = values.get("count", 0.0)
+        if not count:
+            continue
+        print(f"{stage:<32} {count:>7.0f} {values['sum'] / count * 1000:>9.1f} {values['sum']:>9.2f}")
+
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
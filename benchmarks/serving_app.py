@@ -0,0 +1,43 @@
+"""
+app.py with the OpenAI model replaced by a fake that waits BENCH_LLM_LATENCY_SECONDS per call, and chat history
+kept in fakeredis, so bench_serving.py can measure how many concurrent chats a worker class sustains without
+calling OpenAI. Served by gunicorn as `benchmarks.serving_app:app`; not for production use.
+"""
+import os
+import time
+from typing import Any, List, Optional
+
+import fakeredis
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+
+import agent
+import app as chat_app
+
+LLM_LATENCY_SECONDS = float(os.getenv("BENCH_LLM_LATENCY_SECONDS", "0.5"))
+
+
+class SlowFakeChatModel(FakeListChatModel):
+    """Answers every call with the same text after sleeping, like a model waiting on the network."""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _call(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> str:
+        time.sleep(LLM_LATENCY_SECONDS)
+        return self.responses[0]
+
+    def _stream(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        # The agent streams its LLM calls, so this is the path /chat actually takes
+        time.sleep(LLM_LATENCY_SECONDS)
+        yield ChatGenerationChunk(message=AIMessageChunk(content=self.responses[0]))
+
+
+agent.llm = SlowFakeChatModel(responses=["There are courts available at Memorial Park from 18:00 to 20:00."])
+chat_app.agent_executor = agent.get_agent_executor(chat_app.agent_tools)
+chat_app.redis_client = fakeredis.FakeRedis(decode_responses=True)
+# Every request is a first message, so the response cache would answer all but the first without the agent
+chat_app.cached_response = lambda past_messages, user_message, current_date_str: None
+
+app = chat_app.app
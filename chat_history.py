@@ -0,0 +1,161 @@
+import os
+import json
+import threading
+import uuid
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from langchain_core.messages import BaseMessage, SystemMessage, message_to_dict, messages_from_dict
+from redis_connection import RELEASE_LOCK_SCRIPT
+
+# --- Windowed chat history (Redis) ---
+# Each user's messages are an append-only Redis list under chat_messages:{user_id}, one JSON message per item.
+# A turn appends its two messages with RPUSH and each read fetches only the last CHAT_HISTORY_WINDOW_MESSAGES
+# with LRANGE, so Redis I/O and the history sent to the LLM stay the same size however long the conversation.
+# Once the list holds CHAT_HISTORY_COMPACT_BATCH_MESSAGES more than the window, the oldest ones are folded into
+# a running summary under chat_summary:{user_id} (in the background) and trimmed off the list with LTRIM.
+# Both keys expire CHAT_HISTORY_TTL_SECONDS after the user's last turn.
+CHAT_HISTORY_TTL_SECONDS = int(os.getenv("CHAT_HISTORY_TTL_SECONDS", int(timedelta(minutes=15).total_seconds())))
+CHAT_HISTORY_WINDOW_MESSAGES = int(os.getenv("CHAT_HISTORY_WINDOW_MESSAGES", "12"))
+CHAT_HISTORY_COMPACT_BATCH_MESSAGES = int(os.getenv("CHAT_HISTORY_COMPACT_BATCH_MESSAGES", "8"))
+# Hard cap so the list stays bounded even if summarizing keeps failing; messages past it are dropped unsummarized.
+# It is not applied while a compaction holds the user's lock, so only the compaction removes messages from the front
+# of the list while it summarizes them.
+CHAT_HISTORY_MAX_MESSAGES = CHAT_HISTORY_WINDOW_MESSAGES + 4 * CHAT_HISTORY_COMPACT_BATCH_MESSAGES
+COMPACT_LOCK_TTL_SECONDS = 60
+
+# KEYS: messages, summary, compaction lock. ARGV: max messages, TTL, then the messages to append.
+# Returns the list length after appending (before the cap).
+_APPEND_SCRIPT = """
+local length = redis.call("rpush", KEYS[1], unpack(ARGV, 3))
+if redis.call("exists", KEYS[3]) == 0 then
+    redis.call("ltrim", KEYS[1], -tonumber(ARGV[1]), -1)
+end
+redis.call("expire", KEYS[1], ARGV[2])
+redis.call("expire", KEYS[2], ARGV[2])
+return length
+"""
+
+# KEYS: messages, summary, compaction lock. ARGV: lock token, new summary, TTL, number of summarized messages.
+# Stores the summary and trims the summarized messages off the front only if the lock is still ours, i.e. it was
+# held the whole time, so no hard cap has shifted the list since those messages were read.
+_COMMIT_COMPACTION_SCRIPT = """
+if redis.call("get", KEYS[3]) ~= ARGV[1] then
+    return 0
+end
+redis.call("set", KEYS[2], ARGV[2], "EX", ARGV[3])
+redis.call("ltrim", KEYS[1], ARGV[4], -1)
+return 1
+"""
+
+_compact_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-compact")
+_compacting = set()
+_compacting_lock = threading.Lock()
+
+
+def messages_key(user_id: str) -> str:
+    return f"chat_messages:{user_id}"
+
+
+def summary_key(user_id: str) -> str:
+    return f"chat_summary:{user_id}"
+
+
+def compact_lock_key(user_id: str) -> str:
+    return f"chat_compact_lock:{user_id}"
+
+
+def _decode_messages(user_id: str, raw_messages: List[str]) -> List[BaseMessage]:
+    message_dicts = []
+    for raw_message in raw_messages:
+        try:
+            message_dicts.append(json.loads(raw_message))
+        except (json.JSONDecodeError, TypeError) as e:
+            print(f"WARNING: Skipping undecodable chat message for user_id {user_id}: {e}")
+    try:
+        return messages_from_dict(message_dicts)
+    except (KeyError, ValueError, TypeError) as e:
+        print(f"WARNING: Could not decode chat history for user_id {user_id}: {e}. Will start with empty history.")
+        return []
+
+
+def load_history(redis_client, user_id: str) -> List[BaseMessage]:
+    """
+    Returns the messages to send to the LLM for this user: the summary of older turns (as a system message)
+    followed by the last CHAT_HISTORY_WINDOW_MESSAGES messages. Also extends both keys' TTL, in the same round trip.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.lrange(messages_key(user_id), -CHAT_HISTORY_WINDOW_MESSAGES, -1)
+    pipe.get(summary_key(user_id))
+    pipe.expire(messages_key(user_id), CHAT_HISTORY_TTL_SECONDS)
+    pipe.expire(summary_key(user_id), CHAT_HISTORY_TTL_SECONDS)
+    raw_messages, summary, _, _ = pipe.execute()
+
+    history = _decode_messages(user_id, raw_messages)
+    if summary:
+        history.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
+    return history
+
+
+def append_messages(redis_client, user_id: str, messages: List[BaseMessage]) -> int:
+    """Appends a turn's messages to the user's history. Returns how many messages the history now holds."""
+    length = redis_client.eval(
+        _APPEND_SCRIPT, 3, messages_key(user_id), summary_key(user_id), compact_lock_key(user_id),
+        CHAT_HISTORY_MAX_MESSAGES, CHAT_HISTORY_TTL_SECONDS,
+        *(json.dumps(message_to_dict(message)) for message in messages)
+    )
+    return min(length, CHAT_HISTORY_MAX_MESSAGES)
+
+
+def needs_compaction(length: int) -> bool:
+    return length >= CHAT_HISTORY_WINDOW_MESSAGES + CHAT_HISTORY_COMPACT_BATCH_MESSAGES
+
+
+def compact(redis_client, user_id: str, summarize: Callable[[Optional[str], List[BaseMessage]], str]) -> bool:
+    """
+    Folds every message older than the window into the user's summary and trims them off the list.
+    summarize(previous_summary, messages) returns the new summary. Only one worker compacts a user at a time.
+    Returns True if anything was compacted (False also if the lock expired while summarizing).
+    """
+    lock_token = uuid.uuid4().hex
+    if not redis_client.set(compact_lock_key(user_id), lock_token, nx=True, ex=COMPACT_LOCK_TTL_SECONDS):
+        return False
+    try:
+        overflow = redis_client.llen(messages_key(user_id)) - CHAT_HISTORY_WINDOW_MESSAGES
+        if overflow <= 0:
+            return False
+        old_messages = _decode_messages(user_id, redis_client.lrange(messages_key(user_id), 0, overflow - 1))
+        new_summary = summarize(redis_client.get(summary_key(user_id)), old_messages)
+
+        # While the lock is held, new turns are only appended (the hard cap is skipped), so the first `overflow`
+        # items are still the ones just summarized
+        committed = redis_client.eval(
+            _COMMIT_COMPACTION_SCRIPT, 3, messages_key(user_id), summary_key(user_id), compact_lock_key(user_id),
+            lock_token, new_summary, CHAT_HISTORY_TTL_SECONDS, overflow
+        )
+        if not committed:
+            print(f"WARNING: Chat history compaction lock expired while summarizing for user_id: {user_id}. Discarding the summary.")
+            return False
+        print(f"INFO: Compacted {overflow} chat messages into the summary for user_id: {user_id}")
+        return True
+    finally:
+        redis_client.eval(RELEASE_LOCK_SCRIPT, 1, compact_lock_key(user_id), lock_token)
+
+
+def compact_in_background(redis_client, user_id: str, summarize: Callable[[Optional[str], List[BaseMessage]], str]):
+    """Schedules compact() off the request path, unless one is already running for this user in this process."""
+    with _compacting_lock:
+        if user_id in _compacting:
+            return
+        _compacting.add(user_id)
+
+    def _run():
+        try:
+            compact(redis_client, user_id, summarize)
+        except Exception as e:
+            print(f"ERROR: Chat history compaction failed for user_id {user_id}: {e}")
+        finally:
+            with _compacting_lock:
+                _compacting.discard(user_id)
+
+    _compact_executor.submit(_run)
@@ -0,0 +1,51 @@
+# gunicorn.conf.py
+# Loaded automatically by `gunicorn app:app` from the repo root (Procfile and Dockerfile).
+#
+# Serving modes, picked with GUNICORN_WORKER_CLASS:
+#   gevent  (default) cooperative concurrency. gunicorn monkey-patches sockets, sleeps and threads before loading
+#           the app, so the OpenAI client, redis-py and the scrapers' requests session all yield while they wait
+#           on the network and each worker serves up to GUNICORN_WORKER_CONNECTIONS chats at once.
+#   gthread a pool of GUNICORN_THREADS OS threads per worker, for when gevent is not installed or a native
+#           library misbehaves under monkey-patching.
+#   sync    one request per worker, the previous deployment.
+# See benchmarks/bench_serving.py for a comparison of the three.
+import os
+
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+# gunicorn quietly turns sync workers into gthread ones when threads > 1, so only set it for gthread
+threads = int(os.getenv("GUNICORN_THREADS", "16")) if worker_class == "gthread" else 1
+# A chat can wait on a scrape and two LLM calls; SSE responses stay open for the whole run
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+# Preloading (GUNICORN_PRELOAD, on by default): the master imports the app and loads the LLM stack once
+# (app.warm_up), then forks workers that share it copy-on-write, so booting or replacing a worker costs a fork
+# instead of seconds of imports. Workers also share one FLASK_SECRET_KEY fallback. It is fork-safe because
+# redis-py pools reconnect in a new pid and the app's thread pools start no threads until first used.
+# Code changes need a full restart rather than a HUP. Without preload each worker warms up before taking requests.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+if preload_app and worker_class == "gevent":
+    # The app is now imported in the master, so patch the standard library there first, as the gevent worker
+    # would have before loading it
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        import app
+        app.warm_up()
+
+
+def post_worker_init(worker):
+    if not worker.cfg.preload_app:
+        import app
+        app.warm_up()
+
+
+def child_exit(server, worker):
+    # Drop an exited worker's live gauges from the shared Prometheus directory (see metrics.py)
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
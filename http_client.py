@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+import rate_limit
+# Load .env
+from dotenv import load_dotenv, find_dotenv
+
+_ = load_dotenv(find_dotenv())
+
+# --- Shared HTTP session for all scrapers ---
+# One keep-alive connection pool per process, so warm scrapes through the proxy skip the TCP+TLS handshake.
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("SCRAPER_CONNECT_TIMEOUT_SECONDS", "5"))
+READ_TIMEOUT_SECONDS = float(os.getenv("SCRAPER_READ_TIMEOUT_SECONDS", "15"))
+MAX_RETRIES = int(os.getenv("SCRAPER_MAX_RETRIES", "2"))
+RETRY_BACKOFF_SECONDS = float(os.getenv("SCRAPER_RETRY_BACKOFF_SECONDS", "0.5"))
+# A fetch, retries included, gives up once this long has passed since its first attempt, so it ends within the
+# scraper timeout (scrapers.py) and well within the scrape lock's TTL (scrape_cache.py). Every attempt's timeouts
+# are cut to what is left, and a retry that can't start in time isn't made.
+FETCH_BUDGET_SECONDS = float(os.getenv("SCRAPER_FETCH_BUDGET_SECONDS", "15"))
+# Responses worth retrying. 429 is not: the site is asking us to slow down, which the rate limit handles.
+RETRY_STATUSES = frozenset((500, 502, 503, 504))
+POOL_MAXSIZE = int(os.getenv("SCRAPER_POOL_MAXSIZE", "8"))
+# Set SCRAPER_COMPRESSION=0 to ask upstream sites for uncompressed pages
+COMPRESSION_ENABLED = os.getenv("SCRAPER_COMPRESSION", "1") != "0"
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+# Every fetch takes a token from its host's bucket (shared by all processes through Redis, see rate_limit.py),
+# waiting up to UPSTREAM_RATE_LIMIT_MAX_WAIT_SECONDS for one, so a burst of cache misses can't hammer a booking site
+_upstream_limiter = rate_limit.TokenBucket(
+    "upstream",
+    rate_limit.UPSTREAM_RATE_LIMIT_PER_SECOND,
+    rate_limit.UPSTREAM_RATE_LIMIT_BURST,
+    rate_limit.UPSTREAM_RATE_LIMIT_MAX_WAIT_SECONDS,
+)
+
+
+class UpstreamRateLimited(requests.RequestException):
+    """Raised by fetch when the upstream host's rate limit would not allow the request soon enough."""
+
+    def __init__(self, host: str, retry_after_seconds: float):
+        super().__init__(f"Rate limit for {host} reached, next request allowed in {retry_after_seconds:.1f}s")
+        self.host = host
+        self.retry_after_seconds = retry_after_seconds
+
+
+def _proxies() -> dict:
+    """Returns the BrightData proxy settings, or no proxies if credentials are not configured."""
+    username = os.getenv("BRIGHTDATA_USERNAME")  # e.g., brd-customer-xxxx-zone-xxxx
+    password = os.getenv("BRIGHTDATA_PASSWORD")
+    if not username or not password:
+        return {}
+    host = 'brd.superproxy.io'
+    port = 33335
+    proxy_url = f'http://{username}:{password}@{host}:{port}'
+    return {
+        'http': proxy_url,
+        'https': proxy_url
+    }
+
+
+def _accept_encoding() -> str:
+    """Only advertise encodings urllib3 can actually decode (br/zstd are included when their packages are installed)."""
+    if not COMPRESSION_ENABLED:
+        return "identity"
+    return make_headers(accept_encoding=True)["accept-encoding"]
+
+
+def _build_session() -> requests.Session:
+    # No urllib3 retries: fetch retries itself, so each attempt takes a rate limit token and fits the fetch budget
+    adapter = HTTPAdapter(pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.proxies.update(_proxies())
+    session.verify = False
+    session.headers["Accept-Encoding"] = _accept_encoding()
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide pooled session, creating it on first use.
+    The pid check gives every forked gunicorn worker its own pool instead of sharing sockets with the parent.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def fetch(url: str, headers: dict = None) -> requests.Response:
+    """
+    GETs a URL through the shared session with connect/read timeouts, once its host's rate limit allows.
+    Connection errors, timeouts and RETRY_STATUSES responses are retried up to MAX_RETRIES times with exponential
+    backoff, each retry taking its own rate limit token, all within FETCH_BUDGET_SECONDS of the first attempt.
+    Raises requests.RequestException if the request fails or the final response is an HTTP error,
+    UpstreamRateLimited (a subclass) if the rate limit would make the first attempt wait too long.
+    """
+    host = urllib.parse.urlsplit(url).hostname or url
+    allowed, retry_after = _upstream_limiter.acquire(host)
+    if not allowed:
+        raise UpstreamRateLimited(host, retry_after)
+    deadline = time.monotonic() + FETCH_BUDGET_SECONDS
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            response = get_session().get(url, headers=headers,
+                                         timeout=(min(CONNECT_TIMEOUT_SECONDS, remaining), min(READ_TIMEOUT_SECONDS, remaining)))
+            if response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return response
+            error = requests.HTTPError(f"{response.status_code} Server Error for url: {url}", response=response)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+
+        backoff = RETRY_BACKOFF_SECONDS * 2 ** attempt
+        attempt += 1
+        if attempt > MAX_RETRIES or time.monotonic() + backoff >= deadline:
+            raise error
+        # The retry's token may be due later than the backoff; give up if it isn't due before the deadline
+        allowed, wait = _upstream_limiter.reserve(host)
+        if not allowed or time.monotonic() + max(backoff, wait) >= deadline:
+            raise error
+        print(f"WARNING: Retrying {host} after {error} (attempt {attempt + 1} of {MAX_RETRIES + 1})")
+        time.sleep(max(backoff, wait))
@@ -0,0 +1,150 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Tuple
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+# --- Prometheus metrics ---
+# Exported by the web app at /metrics. Under gunicorn every worker is its own process, so set
+# PROMETHEUS_MULTIPROC_DIR to an empty, writable directory: each process then writes its samples there and
+# /metrics aggregates all of them (gunicorn.conf.py cleans up after exited workers).
+STAGE_SECONDS = Histogram(
+    "tennis_stage_seconds",
+    "Wall time of each stage of answering a chat or availability request.",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60),
+)
+SCRAPE_CACHE_LOOKUPS = Counter(
+    "tennis_scrape_cache_lookups_total",
+    "Scrape snapshot lookups by result: hit (fresh), stale (served while refreshing) or miss (scraped inline).",
+    ["result"],
+)
+SCRAPE_L1_LOOKUPS = Counter(
+    "tennis_scrape_l1_lookups_total",
+    "In-process scrape snapshot cache lookups: hit, miss (read from Redis), or redis_down_hit/redis_down_miss while Redis is unreachable.",
+    ["result"],
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "tennis_response_cache_lookups_total",
+    "Response cache lookups for first chat messages: hit, miss or invalidated (availability changed).",
+    ["result"],
+)
+RESPONSE_CACHE_SAVED_SECONDS = Counter(
+    "tennis_response_cache_saved_seconds_total",
+    "Agent time the response cache saved: the recorded agent latency of every answer served from it.",
+)
+SNAPSHOT_STORE_WARM_STARTS = Counter(
+    "tennis_snapshot_store_warm_starts_total",
+    "Snapshots missing from Redis that were loaded from the on-disk snapshot store instead of scraped.",
+)
+RATE_LIMIT_DECISIONS = Counter(
+    "tennis_rate_limit_decisions_total",
+    "Rate limiter decisions by limiter (upstream, chat) and result: allowed, queued (waited for its token) or rejected.",
+    ["limiter", "result"],
+)
+SCRAPES = Counter(
+    "tennis_scrapes_total",
+    "Scrapes of a city's booking site by outcome (ok, unchanged, fallback_parser, fetch_error, rate_limited, queue_timeout, timeout, error).",
+    ["city", "outcome"],
+)
+SCRAPE_PAYLOAD_BYTES = Histogram(
+    "tennis_scrape_payload_bytes",
+    "Size of the page body downloaded per scrape (after decompression).",
+    ["city"],
+    buckets=(1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6),
+)
+SCRAPE_ROWS = Histogram(
+    "tennis_scrape_rows",
+    "Slot rows parsed per scrape.",
+    ["city"],
+    buckets=(0, 10, 50, 100, 250, 500, 1000, 2500),
+)
+LLM_TOKENS = Counter(
+    "tennis_llm_tokens_total",
+    "Tokens used by LLM calls, by kind (prompt or completion).",
+    ["kind"],
+)
+TURN_TOKENS = Histogram(
+    "tennis_turn_tokens",
+    "Tokens used by all the LLM calls of one chat turn, by kind (prompt or completion).",
+    ["kind"],
+    buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+TOOL_OUTPUT_TOKENS = Histogram(
+    "tennis_tool_output_tokens",
+    "Estimated tokens of each filter tool result handed to the LLM.",
+    buckets=(10, 50, 100, 250, 500, 1000, 2000, 4000),
+)
+
+
+@contextmanager
+def timed(stage: str):
+    """Records how long the with-block takes under tennis_stage_seconds{stage=...}, also when it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """Callback handler that records each LLM call's latency (stage "llm") and token usage."""
+
+    def __init__(self):
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            STAGE_SECONDS.labels("llm").observe(time.perf_counter() - started)
+        prompt_tokens, completion_tokens = usage_tokens(response)
+        LLM_TOKENS.labels("prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels("completion").inc(completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+
+class TurnTokenCounter(BaseCallbackHandler):
+    """Callback handler for one agent run that adds up the tokens of its LLM calls; observe() records the totals."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        prompt_tokens, completion_tokens = usage_tokens(response)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def observe(self):
+        TURN_TOKENS.labels("prompt").observe(self.prompt_tokens)
+        TURN_TOKENS.labels("completion").observe(self.completion_tokens)
+
+
+def usage_tokens(response) -> Tuple[int, int]:
+    """Returns the (prompt, completion) tokens reported in an LLMResult's usage_metadata."""
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+def render() -> Tuple[bytes, str]:
+    """Returns the current metrics in the Prometheus text format, with its content type."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
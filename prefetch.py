@@ -0,0 +1,68 @@
+# prefetch.py
+# Background worker that keeps scrape snapshots for today and the next PREFETCH_DAYS days warm in Redis,
+# so tool calls almost always hit the cache. Runs as its own Procfile process: `python prefetch.py`.
+
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List
+import redis
+
+import rate_limit
+import redis_connection
+import scrape_cache
+from scrapers import registered_cities
+
+PREFETCH_DAYS = int(os.getenv("PREFETCH_DAYS", "7"))
+# Must be shorter than SCRAPE_CACHE_TTL_SECONDS so every snapshot is refreshed before it goes stale
+PREFETCH_INTERVAL_SECONDS = int(os.getenv("PREFETCH_INTERVAL_SECONDS", scrape_cache.SCRAPE_CACHE_TTL_SECONDS // 3))
+
+
+def prefetch_dates(days: int = None) -> List[str]:
+    """Returns today plus the next `days` dates (PREFETCH_DAYS by default) in MM/DD/YYYY format."""
+    if days is None:
+        days = PREFETCH_DAYS
+    today = datetime.now()
+    return [(today + timedelta(days=offset)).strftime("%m/%d/%Y") for offset in range(days + 1)]
+
+
+def prefetch_once(interval_seconds: int = PREFETCH_INTERVAL_SECONDS):
+    """
+    Refreshes every (date, city) snapshot that is missing or would go stale before the next pass.
+    Dates are refreshed one at a time, cities within a date concurrently.
+    The pass is skipped while Redis is unreachable, since its snapshots would not reach the web workers.
+    """
+    if not scrape_cache.ping():
+        print("WARNING: Redis unavailable, skipping this prefetch pass.")
+        return
+    refresh_after_seconds = max(0, scrape_cache.SCRAPE_CACHE_TTL_SECONDS - interval_seconds)
+    for date in prefetch_dates():
+        due_cities = []
+        for city in registered_cities():
+            snapshot = scrape_cache.read_snapshot(date, city, header_only=True)
+            if snapshot is None or scrape_cache.snapshot_age_seconds(snapshot.fetched_at) >= refresh_after_seconds:
+                due_cities.append(city)
+        if due_cities:
+            print(f"INFO: Prefetching {date} for {', '.join(due_cities)}")
+            scrape_cache.refresh(date, due_cities, wait=False)
+
+
+def main():
+    # Snapshots are binary, so this client must not decode responses
+    redis_client = redis_connection.connect()
+    scrape_cache.configure(redis_client)
+    # Prefetch scrapes draw from the same per-site rate limit as the web app's
+    rate_limit.configure(redis_client)
+    print(f"INFO: Prefetch worker started: {PREFETCH_DAYS} days ahead, every {PREFETCH_INTERVAL_SECONDS}s")
+    while True:
+        started = time.monotonic()
+        try:
+            prefetch_once()
+        except redis.exceptions.RedisError as e:
+            print(f"ERROR: Prefetch pass failed, Redis unavailable: {e}")
+        elapsed = time.monotonic() - started
+        time.sleep(max(0.0, PREFETCH_INTERVAL_SECONDS - elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from typing import Dict, Tuple
+import redis_connection
+from metrics import RATE_LIMIT_DECISIONS, timed
+
+# --- Rate limiting (Redis token buckets) ---
+# Each TokenBucket limits calls per key (an upstream host, a chat session) to rate_per_second on average, with up
+# to `burst` calls at once. Buckets live in Redis under rate_limit:{name}:{key} and are updated by one Lua script
+# using the Redis clock, so every gunicorn worker and the prefetch worker draw from the same bucket.
+# A call over the limit either waits for its token, if that is at most max_wait_seconds away (the token is
+# reserved right away, so waiting callers are served in order), or is rejected with the time until it would be
+# allowed. While Redis is unreachable (see redis_connection.RedisBackoff) each process keeps its own buckets,
+# so the limit then holds per process rather than overall.
+UPSTREAM_RATE_LIMIT_PER_SECOND = float(os.getenv("UPSTREAM_RATE_LIMIT_PER_SECOND", "2"))
+UPSTREAM_RATE_LIMIT_BURST = int(os.getenv("UPSTREAM_RATE_LIMIT_BURST", "5"))
+UPSTREAM_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("UPSTREAM_RATE_LIMIT_MAX_WAIT_SECONDS", "5"))
+CHAT_RATE_LIMIT_PER_MINUTE = float(os.getenv("CHAT_RATE_LIMIT_PER_MINUTE", "10"))
+CHAT_RATE_LIMIT_BURST = int(os.getenv("CHAT_RATE_LIMIT_BURST", "5"))
+
+# Returns {allowed (1/0), milliseconds to wait before the call (allowed) or until it would be allowed (rejected)}.
+# An allowed call takes its token even if it has to wait for it, so the bucket can go negative by at most
+# max_wait * rate; a rejected call changes nothing.
+_TOKEN_BUCKET_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = math.max(0, (1 - tokens) / rate)
+if wait > max_wait then
+    return {0, math.ceil(wait * 1000)}
+end
+tokens = tokens - 1
+redis.call("HSET", KEYS[1], "tokens", string.format("%.6f", tokens), "updated", string.format("%.6f", now))
+redis.call("PEXPIRE", KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return {1, math.ceil(wait * 1000)}
+"""
+
+_redis_client = None
+_redis_backoff = redis_connection.RedisBackoff("rate limits")
+
+
+def configure(redis_client):
+    """Sets the Redis client the buckets are kept in; None keeps them in this process only."""
+    global _redis_client
+    _redis_client = redis_client
+
+
+class TokenBucket:
+    """A named token bucket limiter, applied separately to each key (see the section comment above)."""
+
+    def __init__(self, name: str, rate_per_second: float, burst: int, max_wait_seconds: float = 0.0):
+        self.name = name
+        self.rate_per_second = rate_per_second
+        self.burst = max(1, burst)
+        self.max_wait_seconds = max_wait_seconds
+        self._local: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def is_enabled(self) -> bool:
+        return self.rate_per_second > 0
+
+    def _reserve_in_redis(self, key: str) -> Tuple[bool, float]:
+        allowed, wait_ms = _redis_client.eval(_TOKEN_BUCKET_SCRIPT, 1, f"rate_limit:{self.name}:{key}",
+                                              self.burst, self.rate_per_second, self.max_wait_seconds)
+        return bool(int(allowed)), int(wait_ms) / 1000
+
+    def _reserve_locally(self, key: str) -> Tuple[bool, float]:
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._local.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate_per_second)
+            wait = max(0.0, (1 - tokens) / self.rate_per_second)
+            if wait > self.max_wait_seconds:
+                return False, wait
+            self._local[key] = (tokens - 1, now)
+            # Drop keys whose buckets have refilled, so one-off keys (e.g. sessions) don't accumulate
+            if len(self._local) > 1024:
+                full_after = self.burst / self.rate_per_second + self.max_wait_seconds
+                self._local = {k: v for k, v in self._local.items() if now - v[1] < full_after}
+            return True, wait
+
+    def reserve(self, key: str) -> Tuple[bool, float]:
+        """
+        Takes a token for key. Returns (True, seconds to wait before making the call) if it is allowed, or
+        (False, seconds until it would be allowed) if it is over the limit. Always allowed when disabled.
+        """
+        if not self.is_enabled():
+            return True, 0.0
+        result = None
+        if _redis_client is not None:
+            result = _redis_backoff.call(lambda: self._reserve_in_redis(key))
+        if result is None:
+            result = self._reserve_locally(key)
+        allowed, wait = result
+        RATE_LIMIT_DECISIONS.labels(self.name, "rejected" if not allowed else "queued" if wait else "allowed").inc()
+        return allowed, wait
+
+    def acquire(self, key: str) -> Tuple[bool, float]:
+        """
+        Like reserve, but sleeps until an allowed call is due (for callers that queue rather than reject).
+        Returns (True, 0.0) once the call may go ahead, or (False, seconds until it would be allowed).
+        """
+        allowed, wait = self.reserve(key)
+        if allowed and wait:
+            with timed(f"{self.name}_rate_limit_wait"):
+                time.sleep(wait)
+            return True, 0.0
+        return allowed, wait
@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+import redis
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
+
+# --- Redis connections ---
+# Clients are created without connecting: redis-py opens connections on first use and re-opens them after
+# a failure, so Redis being down at boot no longer disables caching for the life of the process.
+# Short timeouts keep a slow or unreachable Redis from stalling requests; callers wrap their calls in a
+# RedisBackoff so that, once Redis fails, they stop trying for a while instead of paying the timeout every time.
+REDIS_SOCKET_TIMEOUT_SECONDS = float(os.getenv("REDIS_SOCKET_TIMEOUT_SECONDS", "0.5"))
+REDIS_CONNECT_TIMEOUT_SECONDS = float(os.getenv("REDIS_CONNECT_TIMEOUT_SECONDS", "0.5"))
+REDIS_BACKOFF_BASE_SECONDS = float(os.getenv("REDIS_BACKOFF_BASE_SECONDS", "1"))
+REDIS_BACKOFF_MAX_SECONDS = float(os.getenv("REDIS_BACKOFF_MAX_SECONDS", "30"))
+
+# Deletes a lock (KEYS[1]) only if we still own it (ARGV[1] is our token); it may have expired and been taken by another worker
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def connect(redis_url: str = None, decode_responses: bool = False) -> redis.Redis:
+    """Returns a lazily connecting client for REDIS_URL (or redis_url) with short timeouts and one quick retry."""
+    return redis.from_url(
+        redis_url or os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+        decode_responses=decode_responses,
+        socket_timeout=REDIS_SOCKET_TIMEOUT_SECONDS,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT_SECONDS,
+        retry=Retry(ExponentialBackoff(cap=0.1, base=0.01), retries=1),
+        health_check_interval=30,
+    )
+
+
+class RedisBackoff:
+    """
+    Tracks whether Redis is worth calling. After a failure, calls are skipped for an exponentially
+    growing delay (REDIS_BACKOFF_BASE_SECONDS doubling up to REDIS_BACKOFF_MAX_SECONDS); the first call
+    after the delay is the reconnect attempt. A success resets the delay.
+    """
+
+    def __init__(self, name: str, base_seconds: float = REDIS_BACKOFF_BASE_SECONDS, max_seconds: float = REDIS_BACKOFF_MAX_SECONDS):
+        self.name = name
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+        self._failures = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return time.monotonic() >= self._retry_at
+
+    def record_success(self):
+        if self._failures:
+            with self._lock:
+                if self._failures:
+                    print(f"INFO: Redis ({self.name}) is reachable again.")
+                    self._failures = 0
+                    self._retry_at = 0.0
+
+    def record_failure(self, error: Exception):
+        with self._lock:
+            self._failures += 1
+            delay = min(self.max_seconds, self.base_seconds * 2 ** (self._failures - 1))
+            self._retry_at = time.monotonic() + delay
+        print(f"WARNING: Redis ({self.name}) call failed: {error}. Not retrying for {delay:g}s.")
+
+    def call(self, func, fallback=None):
+        """Returns func() or, if Redis is backing off or the call fails, fallback."""
+        if not self.available():
+            return fallback
+        try:
+            result = func()
+        except redis.exceptions.RedisError as e:
+            self.record_failure(e)
+            return fallback
+        self.record_success()
+        return result
@@ -0,0 +1,85 @@
+import os
+import re
+import json
+import hashlib
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+from availability_index import index_fingerprint
+from snapshot_codec import Snapshot
+import scrape_cache
+
+# --- Response cache (Redis) ---
+# Answers to a user's first message (no chat history yet) are cached under response_cache:{current_date}:{hash},
+# the hash being of the normalized message, so the next user asking the same thing on the same day gets the answer
+# without any LLM call. Each entry records the fingerprint of the availability (availability_index.index_fingerprint)
+# of every (date, city) snapshot its tool calls read; it only counts as a hit while all those snapshots still exist,
+# are fresh and have the same fingerprints, so a cached answer is dropped as soon as availability changes.
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", int(timedelta(minutes=15).total_seconds())))
+
+_PUNCTUATION = re.compile(r"[^\w\s:/]")
+_SPACED_MERIDIEM = re.compile(r"(\d)\s+(am|pm)\b")
+
+
+def normalize_message(message: str) -> str:
+    """Lowercases the message and drops punctuation and extra whitespace, keeping times and dates ("6 PM?" -> "6pm")."""
+    text = _PUNCTUATION.sub(" ", message.lower())
+    text = _SPACED_MERIDIEM.sub(r"\1\2", " ".join(text.split()))
+    return text
+
+
+def response_key(message: str, current_date: str) -> str:
+    digest = hashlib.sha256(normalize_message(message).encode()).hexdigest()[:32]
+    return f"response_cache:{current_date}:{digest}"
+
+
+def current_fingerprints(keys: List[Tuple[str, str]]) -> Optional[Dict[Tuple[str, str], str]]:
+    """
+    Returns the availability fingerprint of the cached snapshot of each (date, city), or None if any of them is
+    missing or stale (an answer built on a stale snapshot should be recomputed, which also refreshes the snapshot).
+    """
+    fingerprints = {}
+    for key, snapshot in scrape_cache.read_snapshots(keys).items():
+        if snapshot is None or scrape_cache.is_stale(snapshot.fetched_at):
+            return None
+        fingerprints[key] = index_fingerprint(snapshot.index)
+    return fingerprints
+
+
+def lookup(redis_client, message: str, current_date: str) -> Tuple[str, Optional[Dict]]:
+    """
+    Looks up the cached answer to a first message. Returns (result, entry): result is "hit", "miss" (nothing cached)
+    or "invalidated" (availability changed since), and entry, on a hit, is {"output": ..., "agent_seconds": ...}.
+    """
+    raw_entry = redis_client.get(response_key(message, current_date))
+    if not raw_entry:
+        return "miss", None
+    try:
+        entry = json.loads(raw_entry)
+        expected = {(date, city): fingerprint for date, city, fingerprint in entry["snapshots"]}
+    except (ValueError, TypeError, KeyError) as e:
+        print(f"WARNING: Corrupted response cache entry for {response_key(message, current_date)}: {e}")
+        return "miss", None
+    if expected and current_fingerprints(list(expected)) != expected:
+        return "invalidated", None
+    return "hit", entry
+
+
+def store(redis_client, message: str, current_date: str, output: str,
+          snapshots: Dict[Tuple[str, str], Snapshot], agent_seconds: float) -> bool:
+    """
+    Caches the answer to a first message along with the fingerprints of the snapshots it was built from
+    (see agent.record_snapshot_reads). Nothing is cached (False is returned) if any of them was stale or
+    is not in the scrape cache, e.g. the error result of a failed scrape.
+    """
+    fingerprints = {}
+    for key, snapshot in snapshots.items():
+        if snapshot.blob is None or scrape_cache.is_stale(snapshot.fetched_at):
+            return False
+        fingerprints[key] = index_fingerprint(snapshot.index)
+    entry = {
+        "output": output,
+        "snapshots": [[date, city, fingerprint] for (date, city), fingerprint in fingerprints.items()],
+        "agent_seconds": agent_seconds,
+    }
+    redis_client.set(response_key(message, current_date), json.dumps(entry), ex=RESPONSE_CACHE_TTL_SECONDS)
+    return True
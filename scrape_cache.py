@@ -0,0 +1,483 @@
+import os
+import json
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from availability_index import diff_indexes
+from scrapers import ScrapeResult, as_scrape_result, max_scrape_seconds, scrape_many
+from snapshot_codec import Snapshot, encode_snapshot, is_encoded_snapshot, with_fetched_at
+from metrics import SCRAPE_L1_LOOKUPS, SNAPSHOT_STORE_WARM_STARTS, timed
+from redis_connection import RELEASE_LOCK_SCRIPT, RedisBackoff
+import snapshot_store
+
+# --- Scrape snapshot cache (Redis) ---
+# Each (date, city) snapshot is stored under scrape_cache:{date}:{city} in the binary format from snapshot_codec.py,
+# so the Redis client given to configure() must be created without decode_responses.
+# A snapshot is fresh for SCRAPE_CACHE_TTL_SECONDS. After that it is still served for up to
+# SCRAPE_CACHE_STALE_SECONDS while a background refresh replaces it (stale-while-revalidate),
+# so a tool call only blocks on the upstream site when there is no snapshot at all.
+SCRAPE_CACHE_TTL_SECONDS = int(os.getenv("SCRAPE_CACHE_TTL_SECONDS", int(timedelta(minutes=15).total_seconds())))
+SCRAPE_CACHE_STALE_SECONDS = int(os.getenv("SCRAPE_CACHE_STALE_SECONDS", int(timedelta(hours=1).total_seconds())))
+
+# --- In-process cache (L1) ---
+# Each process keeps up to SCRAPE_L1_MAX_ENTRIES decoded snapshots in memory, least recently used evicted first,
+# so repeated lookups skip the Redis round trip and the decode. An entry is used for SCRAPE_L1_TTL_SECONDS after it
+# was read or written, and only while the snapshot is fresh; after that Redis is asked again, since another worker
+# may have refreshed it. While Redis is unreachable, entries are served for as long as Redis would have kept them
+# and refreshes are written here only (see redis_connection.RedisBackoff for when Redis is tried again).
+SCRAPE_L1_MAX_ENTRIES = int(os.getenv("SCRAPE_L1_MAX_ENTRIES", "256"))
+SCRAPE_L1_TTL_SECONDS = float(os.getenv("SCRAPE_L1_TTL_SECONDS", "30"))
+
+# --- Single-flight ---
+# Only one process scrapes a given (date, city) at a time: the first one to take scrape_lock:{date}:{city}
+# scrapes, the others poll for the snapshot it writes. If the lock holder fails or the wait runs out,
+# waiters fall back to scraping themselves, so a dead worker can't block everyone.
+# Waiters wait as long as a scrape can take (scrapers.max_scrape_seconds: waiting for a worker, then the slowest
+# scraper's timeout plus the rate-limit queue) and a bit more for the write. The lock is held until the scrape's thread has finished, even
+# past that timeout (a late result is still cached), and its TTL only matters if the holder dies.
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", max_scrape_seconds() + 5))
+SCRAPE_LOCK_TTL_SECONDS = int(os.getenv("SCRAPE_LOCK_TTL_SECONDS", math.ceil(SINGLE_FLIGHT_WAIT_SECONDS) + 10))
+SINGLE_FLIGHT_POLL_SECONDS = 0.2
+
+# --- Change feed ---
+# A refresh that changes a snapshot appends the courts whose availability changed (slots freed or taken,
+# see availability_index.diff_indexes) to the scrape_changes Redis stream, so consumers can follow
+# availability with XREAD instead of re-reading whole days. The stream is capped at about
+# SCRAPE_CHANGES_MAXLEN entries. Refreshes that find the page unchanged skip parsing and only bump fetched_at.
+SCRAPE_CHANGES_STREAM = "scrape_changes"
+SCRAPE_CHANGES_MAXLEN = int(os.getenv("SCRAPE_CHANGES_MAXLEN", "1000"))
+
+_redis_client = None
+_redis_backoff = RedisBackoff("scrape cache")
+_ttl_seconds = SCRAPE_CACHE_TTL_SECONDS
+
+# Scrapes in progress in this process, for single-flight while Redis (and so the scrape lock) is unavailable
+_local_flights = {}
+_local_flights_lock = threading.Lock()
+
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="scrape-refresh")
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def configure(redis_client, ttl_seconds: int = SCRAPE_CACHE_TTL_SECONDS):
+    """Sets the Redis client and freshness TTL used for scrape snapshots, and empties the in-process cache."""
+    global _redis_client, _ttl_seconds
+    _redis_client = redis_client
+    _ttl_seconds = ttl_seconds
+    _local_cache.clear()
+
+
+def is_enabled() -> bool:
+    return _redis_client is not None
+
+
+def _redis_call(func, fallback=None):
+    """Runs func() against Redis unless it is unconfigured or backing off after a failure; returns fallback then."""
+    if _redis_client is None:
+        return fallback
+    return _redis_backoff.call(func, fallback)
+
+
+def ping() -> bool:
+    """Returns whether Redis answers right now (a failed ping starts the backoff like any other call)."""
+    return _redis_call(lambda: _redis_client.ping(), False)
+
+
+class LocalSnapshotCache:
+    """Bounded, thread-safe LRU of (date, city) -> Snapshot whose entries expire ttl_seconds after they are stored."""
+
+    def __init__(self, max_entries: int = SCRAPE_L1_MAX_ENTRIES, ttl_seconds: float = SCRAPE_L1_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # (date, city) -> (stored_at, Snapshot)
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str], redis_down: bool = False) -> Optional[Snapshot]:
+        """
+        Returns the snapshot for key if it is still usable: within ttl_seconds and fresh, or, with redis_down=True,
+        as long as it is within the stale window. Entries past the stale window are dropped.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, snapshot = entry
+            if snapshot_age_seconds(snapshot.fetched_at) >= _ttl_seconds + SCRAPE_CACHE_STALE_SECONDS:
+                del self._entries[key]
+                return None
+            if not redis_down and (time.monotonic() - stored_at >= self.ttl_seconds or is_stale(snapshot.fetched_at)):
+                return None
+            self._entries.move_to_end(key)
+            return snapshot
+
+    def put(self, key: Tuple[str, str], snapshot: Snapshot):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_local_cache = LocalSnapshotCache()
+
+
+def cache_key(date: str, city: str) -> str:
+    """Create a unique cache key for each date and city"""
+    return f"scrape_cache:{date}:{city.lower()}"
+
+
+def _decode_snapshot(key: str, cached_value, header_only: bool = False) -> Optional[Snapshot]:
+    if not cached_value:
+        return None
+    try:
+        if is_encoded_snapshot(cached_value):
+            snapshot = Snapshot.from_blob(cached_value)
+            if not header_only:
+                snapshot.index  # walks the whole blob, so corruption is caught here
+            return snapshot
+        # JSON written by workers running an older version during a deploy
+        cached = json.loads(cached_value)
+        if isinstance(cached, list):
+            # Entry written before snapshots carried a timestamp, treat it as stale
+            return Snapshot(0.0, rows=cached)
+        return Snapshot(cached["fetched_at"], rows=cached["rows"])
+    except (ValueError, TypeError, KeyError) as e:
+        print(f"WARNING: Corrupted cache data for {key}: {e}. Will re-scrape.")
+        # In case of corruption, delete the bad key to force re-scrape
+        _redis_call(lambda: _redis_client.delete(key))
+        return None
+
+
+def read_snapshots(keys: List[Tuple[str, str]], header_only: bool = False) -> Dict[Tuple[str, str], Optional[Snapshot]]:
+    """
+    Reads the snapshots for several (date, city) pairs, from the in-process cache where it has them and
+    from Redis with a single MGET for the rest. Returns a dict mapping each pair to its Snapshot, or None on a miss.
+    With header_only=True the in-process cache is skipped (so snapshot ages are Redis's) and only the
+    header of what Redis returns is validated. Corrupted entries are deleted so the next read re-scrapes.
+    If Redis is unreachable, the in-process cache answers alone. Pairs found in neither are looked up in the
+    snapshot store (warm start, see snapshot_store.py).
+    """
+    results = {}
+    remote_keys = []
+    for key in keys:
+        snapshot = None if header_only else _local_cache.get(key)
+        if snapshot is not None:
+            SCRAPE_L1_LOOKUPS.labels("hit").inc()
+            results[key] = snapshot
+        else:
+            remote_keys.append(key)
+    if not remote_keys:
+        return results
+
+    redis_keys = [cache_key(date, city) for date, city in remote_keys]
+    with timed("redis_read"):
+        values = _redis_call(lambda: _redis_client.mget(redis_keys))
+    if values is None:
+        # Redis is down (or not configured): keep serving what this process has
+        for key in remote_keys:
+            results[key] = _local_cache.get(key, redis_down=True)
+            SCRAPE_L1_LOOKUPS.labels("redis_down_hit" if results[key] is not None else "redis_down_miss").inc()
+    else:
+        for key, redis_key, value in zip(remote_keys, redis_keys, values):
+            snapshot = _decode_snapshot(redis_key, value, header_only)
+            if not header_only:
+                SCRAPE_L1_LOOKUPS.labels("miss").inc()
+                if snapshot is not None:
+                    _local_cache.put(key, snapshot)
+            results[key] = snapshot
+
+    missing = [key for key in remote_keys if results[key] is None]
+    if missing and snapshot_store.is_enabled():
+        results.update(_warm_start(missing))
+    return results
+
+
+def _warm_start(keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Snapshot]:
+    """
+    Loads the latest recorded snapshots of (date, city) pairs missing from Redis from the snapshot store, if they are
+    still within the stale window, and puts them back into Redis and the in-process cache.
+    """
+    with timed("snapshot_store_read"):
+        stored = snapshot_store.latest(keys, max_age_seconds=_ttl_seconds + SCRAPE_CACHE_STALE_SECONDS)
+    for (date, city), snapshot in stored.items():
+        SNAPSHOT_STORE_WARM_STARTS.inc()
+        print(f"INFO: Warm start of {cache_key(date, city)} from the snapshot store.")
+        _local_cache.put((date, city), snapshot)
+        expires_in = int(_ttl_seconds + SCRAPE_CACHE_STALE_SECONDS - snapshot_age_seconds(snapshot.fetched_at))
+        if expires_in > 0:
+            _redis_call(lambda: _redis_client.set(cache_key(date, city), snapshot.blob, ex=expires_in, nx=True))
+    return stored
+
+
+def read_snapshot(date: str, city: str, header_only: bool = False) -> Optional[Snapshot]:
+    """Returns the cached Snapshot for (date, city), or None on a miss."""
+    return read_snapshots([(date, city)], header_only)[(date, city)]
+
+
+def write_snapshot(date: str, city: str, rows: List[Dict], page_hash: Optional[bytes] = None,
+                   court_hashes: Optional[Dict] = None) -> Optional[Snapshot]:
+    """
+    Caches a successful scrape, in this process and in Redis, and returns it as a Snapshot. Empty results and
+    error messages are not cached (None is returned). The Redis TTL covers the fresh window plus the stale window.
+    """
+    key = cache_key(date, city)
+    if not rows or any("message" in r for r in rows):
+        print(f"WARNING: Did not cache for {key} due to empty rows or error message from scraper.")
+        return None
+    fetched_at = time.time()
+    blob = encode_snapshot(rows, fetched_at, page_hash, court_hashes)
+    snapshot = Snapshot(fetched_at, rows=rows, blob=blob)
+    _local_cache.put((date, city), snapshot)
+    with timed("redis_write"):
+        _redis_call(lambda: _redis_client.set(key, blob, ex=_ttl_seconds + SCRAPE_CACHE_STALE_SECONDS))
+    print(f"INFO: Cached {len(rows)} entries for {key}")
+    return snapshot
+
+
+def touch_snapshot(date: str, city: str, previous: Snapshot) -> Snapshot:
+    """Marks a snapshot as freshly fetched without re-encoding it, for a refresh that found the page unchanged."""
+    key = cache_key(date, city)
+    fetched_at = time.time()
+    blob = with_fetched_at(previous.blob, fetched_at)
+    snapshot = Snapshot(fetched_at, blob=blob)
+    _local_cache.put((date, city), snapshot)
+    with timed("redis_write"):
+        _redis_call(lambda: _redis_client.set(key, blob, ex=_ttl_seconds + SCRAPE_CACHE_STALE_SECONDS))
+    print(f"INFO: Page unchanged for {key}, refreshed its fetch time.")
+    return snapshot
+
+
+def publish_changes(date: str, city: str, previous: Snapshot, snapshot: Snapshot) -> List[Dict]:
+    """Appends the availability changes between two snapshots to the change feed (if Redis is up). Returns the changes."""
+    changes = diff_indexes(previous.index, snapshot.index)
+    if changes:
+        _redis_call(lambda: _redis_client.xadd(
+            SCRAPE_CHANGES_STREAM,
+            {"date": date, "city": city, "fetched_at": snapshot.fetched_at, "changes": json.dumps(changes)},
+            maxlen=SCRAPE_CHANGES_MAXLEN,
+            approximate=True,
+        ))
+        print(f"INFO: {len(changes)} courts changed for {cache_key(date, city)}")
+    return changes
+
+
+def _store_scrape(date: str, city: str, result: ScrapeResult, previous: Optional[Snapshot]) -> Snapshot:
+    """
+    Writes one scrape to the cache (touch, full write or nothing for failures), records it in the snapshot store
+    and publishes its changes.
+    """
+    if result.unchanged and previous is not None and previous.blob is not None:
+        snapshot = touch_snapshot(date, city, previous)
+        snapshot_store.record_unchanged(date, city, snapshot)
+        return snapshot
+    snapshot = write_snapshot(date, city, result.rows, result.page_hash, result.court_hashes)
+    if snapshot is None:
+        return Snapshot(time.time(), rows=result.rows)
+    snapshot_store.record(date, city, snapshot)
+    if previous is not None:
+        publish_changes(date, city, previous, snapshot)
+    return snapshot
+
+
+def snapshot_age_seconds(fetched_at: float) -> float:
+    return time.time() - fetched_at
+
+
+def is_stale(fetched_at: float) -> bool:
+    return snapshot_age_seconds(fetched_at) >= _ttl_seconds
+
+
+def lock_key(date: str, city: str) -> str:
+    return f"scrape_lock:{date}:{city.lower()}"
+
+
+def _acquire_locks(keys: List[Tuple[str, str]]) -> Optional[Dict[Tuple[str, str], Optional[str]]]:
+    """
+    Tries to take the scrape lock for each (date, city) pair in one pipeline.
+    Returns a dict mapping each pair to its lock token, or None if another worker holds it.
+    Returns None altogether if Redis is unavailable.
+    """
+    tokens = {key: uuid.uuid4().hex for key in keys}
+    pipe = _redis_client.pipeline(transaction=False)
+    for key, token in tokens.items():
+        pipe.set(lock_key(*key), token, nx=True, ex=SCRAPE_LOCK_TTL_SECONDS)
+    acquired = _redis_call(pipe.execute)
+    if acquired is None:
+        return None
+    return {key: (token if ok else None) for (key, token), ok in zip(tokens.items(), acquired)}
+
+
+def _release_locks(tokens: Dict[Tuple[str, str], str]):
+    pipe = _redis_client.pipeline(transaction=False)
+    for key, token in tokens.items():
+        pipe.eval(RELEASE_LOCK_SCRIPT, 1, lock_key(*key), token)
+    # If this fails the locks simply expire after SCRAPE_LOCK_TTL_SECONDS
+    _redis_call(pipe.execute)
+
+
+def _store_late_scrape(key: Tuple[str, str], previous: Optional[Snapshot], future: Future):
+    """Caches the result of a scrape that finished after scrape_many stopped waiting for it."""
+    try:
+        if not future.cancelled() and future.exception() is None:
+            _store_scrape(*key, as_scrape_result(future.result()), previous)
+    except Exception as e:
+        print(f"ERROR: Could not cache the late scrape of {cache_key(*key)}: {e}")
+
+
+def _scrape_and_write(keys: List[Tuple[str, str]], late: Optional[Dict[Tuple[str, str], Future]] = None) -> Dict[Tuple[str, str], Snapshot]:
+    """
+    Scrapes the given pairs and caches the results. A scrape that times out is returned as its message; its result
+    is cached if it arrives later, and if late is given the pair is added to it with the scrape's future.
+    """
+    # The previous snapshots (usually stale ones being refreshed) let scrapers skip unchanged pages and courts
+    previous = read_snapshots(keys, header_only=True)
+    timed_out = {}
+    results = scrape_many(keys, previous, timed_out)
+    for key, future in timed_out.items():
+        future.add_done_callback(lambda done, key=key: _store_late_scrape(key, previous.get(key), done))
+    if late is not None:
+        late.update(timed_out)
+    return {(date, city): _store_scrape(date, city, result, previous.get((date, city))) for (date, city), result in results.items()}
+
+
+def _wait_for_snapshots(keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Snapshot]:
+    """
+    Waits for other workers to finish scraping the given (date, city) pairs and returns their snapshots.
+    Pairs whose lock holder gave up (lock released without a snapshot) or that are still
+    missing after SINGLE_FLIGHT_WAIT_SECONDS are scraped here instead.
+    """
+    results = {}
+    waiting = list(keys)
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_SECONDS
+    while waiting and time.monotonic() < deadline:
+        time.sleep(SINGLE_FLIGHT_POLL_SECONDS)
+        abandoned = []
+        still_waiting = []
+        for key, snapshot in read_snapshots(waiting).items():
+            if snapshot is not None:
+                results[key] = snapshot
+            elif _redis_call(lambda: _redis_client.exists(lock_key(*key)), 0):
+                still_waiting.append(key)
+            else:
+                print(f"WARNING: Scrape for {cache_key(*key)} finished without a snapshot. Scraping here.")
+                abandoned.append(key)
+        if abandoned:
+            results.update(_scrape_and_write(abandoned))
+        waiting = still_waiting
+
+    if waiting:
+        print(f"WARNING: Timed out waiting for another worker to scrape {', '.join(cache_key(*key) for key in waiting)}. Scraping here.")
+        results.update(_scrape_and_write(waiting))
+    return results
+
+
+def _end_local_flights(keys: List[Tuple[str, str]]):
+    with _local_flights_lock:
+        for key in keys:
+            _local_flights.pop(key).set()
+
+
+def _refresh_locally(keys: List[Tuple[str, str]], wait: bool) -> Dict[Tuple[str, str], Snapshot]:
+    """refresh_many without Redis: single-flight only among the threads of this process."""
+    with _local_flights_lock:
+        own = [key for key in keys if key not in _local_flights]
+        for key in own:
+            _local_flights[key] = threading.Event()
+        in_flight = {key: _local_flights[key] for key in keys if key not in own}
+
+    results = {}
+    late = {}
+    try:
+        if own:
+            results.update(_scrape_and_write(own, late))
+    finally:
+        # Scrapes that outlived their timeout stay in flight until their thread is done
+        _end_local_flights([key for key in own if key not in late])
+        for key, future in late.items():
+            future.add_done_callback(lambda _, key=key: _end_local_flights([key]))
+
+    if wait:
+        for key, done in in_flight.items():
+            done.wait(SINGLE_FLIGHT_WAIT_SECONDS)
+            snapshot = _local_cache.get(key, redis_down=True)
+            if snapshot is None:
+                # That scrape failed (failures are not cached) or is still running
+                results.update(_scrape_and_write([key]))
+            else:
+                results[key] = snapshot
+    return results
+
+
+def refresh_many(keys: List[Tuple[str, str]], wait: bool = True) -> Dict[Tuple[str, str], Snapshot]:
+    """
+    Scrapes the given (date, city) pairs concurrently, writes the results to the cache and returns them as
+    Snapshots (failed scrapes are returned uncached, as a Snapshot of their message row).
+    Pairs that another worker is already scraping are not scraped again: with wait=True the
+    call waits for that worker's snapshot, with wait=False they are left out of the result.
+    Without Redis, single-flight only covers this process and results are only cached in this process.
+    """
+    lock_tokens = _acquire_locks(keys) if _redis_client is not None and _redis_backoff.available() else None
+    if lock_tokens is None:
+        return _refresh_locally(keys, wait)
+
+    tokens = {key: token for key, token in lock_tokens.items() if token}
+    in_flight = [key for key, token in lock_tokens.items() if not token]
+
+    results = {}
+    late = {}
+    try:
+        if tokens:
+            results.update(_scrape_and_write(list(tokens), late))
+    finally:
+        # Locks of scrapes that outlived their timeout are released when their thread is done
+        finished = {key: token for key, token in tokens.items() if key not in late}
+        if finished:
+            _release_locks(finished)
+        for key, future in late.items():
+            future.add_done_callback(lambda _, key=key: _release_locks({key: tokens[key]}))
+
+    if in_flight:
+        in_flight_keys = ', '.join(cache_key(*key) for key in in_flight)
+        if wait:
+            print(f"INFO: {in_flight_keys} already being scraped by another worker. Waiting for it.")
+            results.update(_wait_for_snapshots(in_flight))
+        else:
+            print(f"INFO: {in_flight_keys} already being scraped by another worker. Skipping.")
+    return results
+
+
+def refresh(date: str, city_names: List[str], wait: bool = True) -> Dict[str, Snapshot]:
+    """Same as refresh_many for several cities on one date, keyed by city name."""
+    results = refresh_many([(date, city) for city in city_names], wait=wait)
+    return {city: snapshot for (_, city), snapshot in results.items()}
+
+
+def refresh_in_background(date: str, city: str):
+    """Schedules a refresh of a stale snapshot, unless one is already running in this process."""
+    key = cache_key(date, city)
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def _run():
+        try:
+            refresh(date, [city], wait=False)
+        except Exception as e:
+            print(f"ERROR: Background refresh failed for {key}: {e}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    print(f"INFO: Serving stale {key}, refreshing in background.")
+    _refresh_executor.submit(_run)
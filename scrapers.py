@@ -1,16 +1,175 @@
 from utils import from_hhmm, to_hhmm, calculate_duration_minutes
-from langchain_community.document_loaders import WebBaseLoader
 import re
 import requests
 import os
+from http_client import UpstreamRateLimited, fetch
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from time import monotonic
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import threading
 # Load .env
 from dotenv import load_dotenv, find_dotenv
 import urllib.parse
-from bs4 import BeautifulSoup
+from lxml import html as lxml_html
+from functools import lru_cache
+import hashlib
+from availability_index import CourtKey
+from snapshot_codec import COURT_HASH_BYTES, PAGE_HASH_BYTES, Snapshot
+from metrics import SCRAPES, SCRAPE_PAYLOAD_BYTES, SCRAPE_ROWS, timed
+from rate_limit import UPSTREAM_RATE_LIMIT_MAX_WAIT_SECONDS
 
 _ = load_dotenv(find_dotenv())
 
-def albany_scraper(target_date):
+# --- Scraper registry ---
+# Every city scraper has the same interface: it takes a date in MM/DD/YYYY format and the previous Snapshot
+# for that date (or None), and returns a ScrapeResult whose rows are slot dicts
+# (city_name, park_name, court_name, start_time, end_time, date, availability),
+# or a single {"message": ...} dict if the site could not be scraped (with "retry_after_seconds" when it knows how
+# long to wait, e.g. rate limits). A plain list of rows is accepted too.
+DEFAULT_SCRAPER_TIMEOUT_SECONDS = float(os.getenv("SCRAPER_TIMEOUT_SECONDS", "30"))
+
+
+class ScrapeResult(NamedTuple):
+    """
+    A scrape's rows plus what the next refresh needs to skip unchanged work: the hash of the raw page
+    and of each court's section of it. unchanged=True means the page hash matched the previous snapshot,
+    so nothing was parsed and rows is empty.
+    """
+    rows: List[Dict]
+    page_hash: Optional[bytes] = None
+    court_hashes: Optional[Dict[CourtKey, bytes]] = None
+    unchanged: bool = False
+
+
+def content_hash(data: bytes, size: int) -> bytes:
+    return hashlib.blake2b(data, digest_size=size).digest()
+
+
+class ScraperSpec(NamedTuple):
+    """A registered city scraper and the time budget it gets per tool call."""
+    city_name: str
+    scrape: Callable[[str, Optional[Snapshot]], ScrapeResult]
+    timeout_seconds: float
+
+
+_SCRAPERS: Dict[str, ScraperSpec] = {}
+
+
+def register_scraper(city_name: str, timeout_seconds: Optional[float] = None):
+    """Decorator that registers a scraper function for a city (matched case-insensitively)."""
+    def decorator(func):
+        _SCRAPERS[city_name.lower()] = ScraperSpec(
+            city_name=city_name,
+            scrape=func,
+            timeout_seconds=timeout_seconds or DEFAULT_SCRAPER_TIMEOUT_SECONDS,
+        )
+        return func
+    return decorator
+
+
+def get_scraper(city_name: str) -> Optional[ScraperSpec]:
+    """Returns the registered scraper for a city, or None if the city is not supported."""
+    return _SCRAPERS.get(city_name.lower())
+
+
+def registered_cities() -> List[str]:
+    """Returns the display names of all cities that have a registered scraper."""
+    return [spec.city_name for spec in _SCRAPERS.values()]
+
+
+def scrape_seconds(spec: ScraperSpec) -> float:
+    """How long scrape_many waits for a running scrape: its own timeout, after its fetch may have queued for the site's rate limit."""
+    return spec.timeout_seconds + UPSTREAM_RATE_LIMIT_MAX_WAIT_SECONDS
+
+
+def max_scrape_seconds() -> float:
+    """The longest scrape_many can wait for any registered scraper, including waiting for a worker to start it."""
+    longest = max((scrape_seconds(spec) for spec in _SCRAPERS.values()), default=DEFAULT_SCRAPER_TIMEOUT_SECONDS + UPSTREAM_RATE_LIMIT_MAX_WAIT_SECONDS)
+    return SCRAPE_MAX_QUEUE_SECONDS + longest
+
+
+def as_scrape_result(result) -> ScrapeResult:
+    """Scrapers may return a plain list of rows; wraps it in a ScrapeResult."""
+    return result if isinstance(result, ScrapeResult) else ScrapeResult(rows=result)
+
+
+# Each city has its own bounded pool of SCRAPE_MAX_WORKERS threads, shared by all tool calls in this process, so
+# cache misses for several dates are scraped in parallel and a slow site can only queue up its own scrapes.
+# A scrape's timeout runs from when a worker starts it; one still queued after SCRAPE_MAX_QUEUE_SECONDS is cancelled.
+SCRAPE_MAX_WORKERS = int(os.getenv("SCRAPE_MAX_WORKERS", "4"))
+SCRAPE_MAX_QUEUE_SECONDS = float(os.getenv("SCRAPE_MAX_QUEUE_SECONDS", "30"))
+_scrape_executors: Dict[str, ThreadPoolExecutor] = {}
+_scrape_executors_lock = threading.Lock()
+
+
+def _scrape_executor(spec: ScraperSpec) -> ThreadPoolExecutor:
+    with _scrape_executors_lock:
+        executor = _scrape_executors.get(spec.city_name)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=SCRAPE_MAX_WORKERS, thread_name_prefix=f"scraper-{spec.city_name.lower()}")
+            _scrape_executors[spec.city_name] = executor
+        return executor
+
+
+def _timed_from_start(spec: ScraperSpec, target_date: str, previous: Optional[Snapshot], started: list, running: threading.Event):
+    """Runs a scrape in its pool, noting when it started so its timeout doesn't count time spent queued."""
+    started.append(monotonic())
+    running.set()
+    return spec.scrape(target_date, previous)
+
+
+def scrape_many(keys: List[Tuple[str, str]], previous: Optional[Dict[Tuple[str, str], Optional[Snapshot]]] = None,
+                late: Optional[Dict[Tuple[str, str], Future]] = None) -> Dict[Tuple[str, str], ScrapeResult]:
+    """
+    Runs the registered scrapers for several (date, city) pairs concurrently, in each city's own pool, passing each
+    the previous snapshot for its pair (if any) so unchanged pages and courts can be skipped.
+    Each scrape is bounded by its city's own timeout (scrape_seconds) from when it starts running, and may wait
+    SCRAPE_MAX_QUEUE_SECONDS to start, so one slow site can't hold up the others.
+    Returns a dict mapping each supported (date, city) pair to its ScrapeResult (a single message row on failure).
+    A timed-out scrape keeps running in the pool; if late is given, its pair is added to it with the scrape's future.
+    """
+    previous = previous or {}
+    pending = {}
+    queue_deadline = monotonic() + SCRAPE_MAX_QUEUE_SECONDS
+    for target_date, city in keys:
+        spec = get_scraper(city)
+        if spec is None:
+            print(f"WARNING: No scraper registered for city '{city}'. Skipping.")
+            continue
+        started, running = [], threading.Event()
+        future = _scrape_executor(spec).submit(_timed_from_start, spec, target_date, previous.get((target_date, city)), started, running)
+        pending[(target_date, city)] = (future, spec, started, running)
+
+    results = {}
+    for (target_date, city), (future, spec, started, running) in pending.items():
+        if not running.wait(timeout=max(0.0, queue_deadline - monotonic())) and future.cancel():
+            print(f"WARNING: Scraper for {city} did not start within {SCRAPE_MAX_QUEUE_SECONDS:.0f}s for {target_date}.")
+            SCRAPES.labels(city, "queue_timeout").inc()
+            results[(target_date, city)] = ScrapeResult(rows=[{"message": f"Sorry, the {city} court website is busy with other requests. Please try again shortly."}])
+            continue
+        running.wait()  # cancel() failed, so it has just started
+        try:
+            result = future.result(timeout=max(0.0, started[0] + scrape_seconds(spec) - monotonic()))
+            results[(target_date, city)] = as_scrape_result(result)
+        except FuturesTimeoutError:
+            print(f"WARNING: Scraper for {city} timed out for {target_date}.")
+            SCRAPES.labels(city, "timeout").inc()
+            if late is not None:
+                late[(target_date, city)] = future
+            results[(target_date, city)] = ScrapeResult(rows=[{"message": f"Sorry, the {city} court website took too long to respond. Please try again shortly."}])
+        except Exception as e:
+            print(f"ERROR: Scraper for {city} failed for {target_date}: {e}")
+            SCRAPES.labels(city, "error").inc()
+            results[(target_date, city)] = ScrapeResult(rows=[{"message": f"Sorry, I couldn't load court availability for {city} right now."}])
+    return results
+
+
+# Overridable so load tests can point the scraper at a local stand-in server (see benchmarks/load_test.py)
+ALBANY_WEBTRAC_BASE_URL = os.getenv("ALBANY_WEBTRAC_BASE_URL", "https://caalbanyweb.myvscloud.com")
+
+
+@register_scraper("Albany", timeout_seconds=float(os.getenv("ALBANY_SCRAPER_TIMEOUT_SECONDS", "20")))
+def albany_scraper(target_date, previous: Optional[Snapshot] = None):
     begintime_url_param = "05:00 am"
 
     headers = {
@@ -18,9 +177,8 @@ def albany_scraper(target_date):
         "Referer": "https://caalbanyweb.myalbanyweb.myvscloud.com/",
         "Origin": "https://caalbanyweb.myvscloud.com",
         "Accept-Language": "en-US,en;q=0.9",
-        # "Accept-Encoding": "gzip, deflate, br",
+        # Accept-Encoding and Connection: keep-alive are set on the shared session in http_client.py
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-        "Connection": "keep-alive",
         "Sec-Fetch-Dest": "document",
         "Sec-Fetch-Mode": "navigate",
         "Sec-Fetch-Site": "same-origin",
@@ -31,70 +189,152 @@ def albany_scraper(target_date):
     }
 
 
-    original_base_url = f"https://caalbanyweb.myvscloud.com/webtrac/web/search.html?module=FR&FRClass=TENNI&date={target_date}&begintime={begintime_url_param.replace(' ', '%20')}&Action=Start"
+    original_base_url = f"{ALBANY_WEBTRAC_BASE_URL}/webtrac/web/search.html?module=FR&FRClass=TENNI&date={target_date}&begintime={begintime_url_param.replace(' ', '%20')}&Action=Start"
 
     # base_url = f"https://app.scrapingbee.com/api/v1/?api_key={SCRAPERAPI_API_KEY}&url={original_base_url}&render_js=false"
 
 ##############################################################################################################################
 
-    host = 'brd.superproxy.io'
-    port = 33335
-    BRIGHTDATA_USERNAME = os.getenv("BRIGHTDATA_USERNAME")  # e.g., brd-customer-xxxx-zone-xxxx
-    BRIGHTDATA_PASSWORD = os.getenv("BRIGHTDATA_PASSWORD")
-
-    proxy_url = f'http://{BRIGHTDATA_USERNAME}:{BRIGHTDATA_PASSWORD}@{host}:{port}'
-
-    proxies = {
-        'http': proxy_url,
-        'https': proxy_url
-    }
-
-    response = requests.get(original_base_url, proxies=proxies, verify=False)
-
-
-    # from readability import Document
-    # import io
-    # from langchain_community.document_loaders import UnstructuredHTMLLoader
-
+    # The BrightData proxy, timeouts and retries are configured on the shared session
+    try:
+        with timed("scrape_fetch"):
+            response = fetch(original_base_url, headers=headers)
+    except UpstreamRateLimited as e:
+        print(f"WARNING: Albany scrape skipped for {target_date}: {e}")
+        SCRAPES.labels("Albany", "rate_limited").inc()
+        return ScrapeResult(rows=[{"message": "The Albany court booking website is getting a lot of requests right now. Please try again in a few seconds.",
+                                   "retry_after_seconds": e.retry_after_seconds}])
+    except requests.RequestException as e:
+        print(f"ERROR: Albany scrape failed for {target_date}: {e}")
+        SCRAPES.labels("Albany", "fetch_error").inc()
+        return ScrapeResult(rows=[{"message": "Sorry, I couldn't reach the Albany court booking website right now. Please try again shortly."}])
+    SCRAPE_PAYLOAD_BYTES.labels("Albany").observe(len(response.content))
+
+    page_hash = content_hash(response.content, PAGE_HASH_BYTES)
+    if previous is not None and previous.page_hash == page_hash:
+        SCRAPES.labels("Albany", "unchanged").inc()
+        return ScrapeResult(rows=[], page_hash=page_hash, unchanged=True)
+
+    outcome = "ok"
+    court_hashes = None
+    with timed("scrape_parse"):
+        parsed = parse_webtrac_courts(response.content, city_name="Albany", target_date=target_date, previous=previous)
+        if parsed is None:
+            # The page didn't have the expected results table (e.g. the site layout changed), fall back to the text parser
+            print(f"WARNING: WebTrac results table not found for Albany on {target_date}. Falling back to text parsing.")
+            outcome = "fallback_parser"
+            rows = parse_webtrac_text(clean_page_text(response.text), city_name="Albany", target_date=target_date)
+        else:
+            rows, court_hashes = parsed
+    SCRAPES.labels("Albany", outcome).inc()
+    SCRAPE_ROWS.labels("Albany").observe(len(rows))
+    return ScrapeResult(rows=rows, page_hash=page_hash, court_hashes=court_hashes)
+
+
+# --- WebTrac result parsing ---
+
+# Regex for matching time slots, e.g. "8:00 am - 8:30 am"
+time_pattern = re.compile(r'(\d{1,2}:\d{2} [ap]m)\s*-\s*(\d{1,2}:\d{2} [ap]m)')
+
+_to_hhmm_cached = lru_cache(maxsize=256)(to_hhmm)
+
+
+def parse_webtrac_results(page, city_name: str, target_date: str) -> Optional[List[Dict]]:
+    """
+    Parses a WebTrac facility search results page by walking the results table directly.
+    Each table row is one court: the court name comes from the Description cell, the park from
+    the Location cell and the time slots from the buttons in the cart-blocks cell.
+
+    Returns:
+        A list of slot dicts, or None if the page has no results table.
+    """
+    parsed = parse_webtrac_courts(page, city_name, target_date)
+    return parsed[0] if parsed is not None else None
+
+
+def parse_webtrac_courts(page, city_name: str, target_date: str, previous: Optional[Snapshot] = None) -> Optional[Tuple[List[Dict], Dict[CourtKey, bytes]]]:
+    """
+    Same as parse_webtrac_results, also hashing each court's table row. Courts whose row hash matches
+    the previous snapshot's reuse its rows instead of parsing their slot buttons again.
+
+    Returns:
+        (slot dicts, court hashes), or None if the page has no results table.
+    """
+    tree = lxml_html.fromstring(page)
+    tables = tree.xpath("//table[contains(concat(' ', normalize-space(@class), ' '), ' result-table ')]")
+    if not tables:
+        return None
+
+    previous_hashes = previous.court_hashes if previous is not None else {}
+    previous_rows = None
+    rows = []
+    court_hashes = {}
+    for tr in tables[0].iterfind(".//tbody/tr"):
+        court_name = tr.xpath("normalize-space(td[@data-title='Description'])")
+        park_name = tr.xpath("normalize-space(td[@data-title='Location'])")
+        court = CourtKey(target_date, city_name, park_name, court_name)
+        court_hash = content_hash(lxml_html.tostring(tr), COURT_HASH_BYTES)
+        court_hashes[court] = court_hash
+        if previous_hashes.get(court) == court_hash:
+            if previous_rows is None:
+                previous_rows = _rows_by_court(previous.rows)
+            if court in previous_rows:
+                rows.extend(previous_rows[court])
+                continue
+        for button in tr.iterfind(".//div[@class='cart-blocks']/a"):
+            text = button.text_content()
+            match = time_pattern.search(text)
+            if not match:
+                continue
+            rows.append({
+                "city_name": city_name,
+                "park_name": park_name,
+                "court_name": court_name,
+                "start_time": _to_hhmm_cached(match.group(1)),
+                "end_time": _to_hhmm_cached(match.group(2)),
+                "date": target_date,
+                "availability": "Unavailable" if "Unavailable" in text else "Available"
+            })
+    return rows, court_hashes
 
-    def fetch_and_clean_webbased_style(response) -> str:
-        soup = BeautifulSoup(response.text, "html.parser")
 
-        # Remove scripts and styles
-        for tag in soup(["script", "style", "head", "title", "meta", "[document]"]):
-            tag.decompose()
+def _rows_by_court(rows: List[Dict]) -> Dict[CourtKey, List[Dict]]:
+    grouped = {}
+    for row in rows:
+        if "message" not in row:
+            grouped.setdefault(CourtKey(row["date"], row["city_name"], row["park_name"], row["court_name"]), []).append(row)
+    return grouped
 
-        # Get text with spaces (no forced newlines)
-        text = soup.get_text(separator="\n")
-        # Collapse multiple spaces/newlines into one space
-        text = re.sub(r'\n\s*\n', '\n', text.strip())
-        cleaned = text.strip()
-        return cleaned
 
-    s = fetch_and_clean_webbased_style(response)
-    print(s)
+def clean_page_text(page_html: str) -> str:
+    """Flattens an HTML page to its visible text, one text node per line."""
+    # Only the fallback parser needs BeautifulSoup, so it is not imported until a page misses the results table
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(page_html, "html.parser")
 
-    # loader = WebBaseLoader(original_base_url)
-    #
-    # docs = loader.load()
-    # print(docs)
+    # Remove scripts and styles
+    for tag in soup(["script", "style", "head", "title", "meta", "[document]"]):
+        tag.decompose()
 
-    # if not docs:
-    #     print("Failed to load documents. Returning empty list.")
-    #     return [{"message": "No availability found or failed to load from the website."}]
+    # Get text with spaces (no forced newlines)
+    text = soup.get_text(separator="\n")
+    # Collapse multiple spaces/newlines into one space
+    text = re.sub(r'\n\s*\n', '\n', text.strip())
+    cleaned = text.strip()
+    return cleaned
 
-    # s = docs[0].page_content
 
+def parse_webtrac_text(s: str, city_name: str, target_date: str) -> List[Dict]:
+    """
+    Parses the flattened page text from clean_page_text line by line, guessing court and park
+    names from their wording. Used as a fallback when the results table can't be found.
+    """
     # pattern_available = r'(?P<start>\d{1,2}:\d{2} [ap]m)\s*-\s*(?P<end>\d{1,2}:\d{2} [ap]m)(?!Unavailable)'
     # pattern_unavailable = r'(?P<start>\d{1,2}:\d{2} [ap]m)\s*-\s*(?P<end>\d{1,2}:\d{2} [ap]m)(?P<unavailable>Unavailable)?'
 
     rows = []
     court_name = ""
     park_name = ""
-    city_name = "Albany"
-
-    # Regex for matching time slots
-    time_pattern = r'(\d{1,2}:\d{2} [ap]m)\s*-\s*(\d{1,2}:\d{2} [ap]m)'
 
     lines = s.split('\n')
     i = 0
@@ -110,8 +350,8 @@ def albany_scraper(target_date):
             park_name = line
 
         # Check for Time Slots
-        elif re.match(time_pattern, line):
-            match = re.match(time_pattern, line)
+        elif time_pattern.match(line):
+            match = time_pattern.match(line)
             start_time_str = match.group(1)
             end_time_str = match.group(2)
 
@@ -0,0 +1,247 @@
+import struct
+from typing import Dict, List, Optional
+from utils import hhmm_to_minutes, minutes_to_hhmm
+from availability_index import INDEX_BYTES, CourtKey, build_index
+
+# --- Binary encoding for scrape snapshots ---
+# Layout (little-endian), version 3:
+#   header:  magic "TCS", version (u8), fetched_at (f64)
+#   strings: count (u16), then per string: length (u16) + UTF-8 bytes. Dates, cities, parks and courts are interned here.
+#   courts:  count (u16), then per court: date, city, park, court string indexes (u16 each), slot count (u16),
+#            slot start/end pairs as minutes since midnight (u16 each), availability bitmask (1 bit per slot, 1 = Available)
+#   index:   per court, in the same order, its free-cell bitmap from availability_index.py (INDEX_BYTES bytes)
+#   hashes:  hash of the raw scraped page (PAGE_HASH_BYTES), then per court, in the same order, the hash of its
+#            section of the page (COURT_HASH_BYTES). All zero when unknown. Used to skip work on refreshes.
+# Slots are grouped by court in the order the court first appears, which is the order the scrapers emit them.
+# Version 2 is the same without the hashes section, version 1 also without the index section; a missing
+# index is rebuilt from the rows when needed.
+MAGIC = b"TCS"
+FORMAT_VERSION = 3
+SUPPORTED_VERSIONS = (1, 2, 3)
+PAGE_HASH_BYTES = 16
+COURT_HASH_BYTES = 8
+
+_HEADER = struct.Struct("<3sBd")
+_U16 = struct.Struct("<H")
+_COURT = struct.Struct("<5H")
+
+# Precomputed so decoding doesn't format a time string per slot
+_HHMM = [minutes_to_hhmm(minutes) for minutes in range(24 * 60)]
+
+
+def encode_snapshot(rows: List[Dict], fetched_at: float, page_hash: Optional[bytes] = None,
+                    court_hashes: Optional[Dict[CourtKey, bytes]] = None) -> bytes:
+    """
+    Encodes scraped slot rows and their fetch time into the compact binary format, along with the hashes of the
+    raw page and of each court's section of it when the scraper provides them.
+    """
+    strings: Dict[str, int] = {}
+    courts: Dict[tuple, list] = {}
+    for row in rows:
+        key = tuple(strings.setdefault(row[field], len(strings)) for field in ("date", "city_name", "park_name", "court_name"))
+        courts.setdefault(key, []).append(row)
+
+    parts = [_HEADER.pack(MAGIC, FORMAT_VERSION, fetched_at), _U16.pack(len(strings))]
+    for value in strings:
+        encoded = value.encode("utf-8")
+        parts.append(_U16.pack(len(encoded)))
+        parts.append(encoded)
+
+    parts.append(_U16.pack(len(courts)))
+    court_keys = []
+    for key, court_rows in courts.items():
+        court_keys.append(CourtKey(*(court_rows[0][field] for field in ("date", "city_name", "park_name", "court_name"))))
+        parts.append(_COURT.pack(*key, len(court_rows)))
+        times = []
+        mask = 0
+        for i, row in enumerate(court_rows):
+            times.append(hhmm_to_minutes(row["start_time"]))
+            times.append(hhmm_to_minutes(row["end_time"]))
+            if row["availability"] == "Available":
+                mask |= 1 << i
+        parts.append(struct.pack(f"<{len(times)}H", *times))
+        parts.append(mask.to_bytes((len(court_rows) + 7) // 8, "little"))
+
+    index = build_index(rows)
+    for court_key in court_keys:
+        parts.append(index[court_key].to_bytes(INDEX_BYTES, "little"))
+
+    parts.append(page_hash or bytes(PAGE_HASH_BYTES))
+    court_hashes = court_hashes or {}
+    for court_key in court_keys:
+        parts.append(court_hashes.get(court_key) or bytes(COURT_HASH_BYTES))
+    return b"".join(parts)
+
+
+def with_fetched_at(blob: bytes, fetched_at: float) -> bytes:
+    """Returns the blob with only its fetch time replaced, for a refresh that found the page unchanged."""
+    _, version, _ = _HEADER.unpack_from(blob, 0)
+    return _HEADER.pack(MAGIC, version, fetched_at) + bytes(blob[_HEADER.size:])
+
+
+def is_encoded_snapshot(blob: bytes) -> bool:
+    return isinstance(blob, (bytes, bytearray, memoryview)) and bytes(blob[:len(MAGIC)]) == MAGIC
+
+
+def _read_header(blob: bytes) -> tuple:
+    """Returns (version, fetched_at). Raises ValueError for data in another format or version."""
+    if len(blob) < _HEADER.size:
+        raise ValueError("snapshot is truncated")
+    magic, version, fetched_at = _HEADER.unpack_from(blob, 0)
+    if magic != MAGIC:
+        raise ValueError("not an encoded snapshot")
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"unsupported snapshot format version {version}")
+    return version, fetched_at
+
+
+def decode_fetched_at(blob: bytes) -> float:
+    """Reads only the header. Raises ValueError for data in another format or version."""
+    return _read_header(blob)[1]
+
+
+def _decode(blob: bytes, want_rows: bool) -> tuple:
+    """
+    Walks the blob once. Returns (rows, index, page_hash, court_hashes): rows is None unless want_rows,
+    index is None for version 1 blobs, and the hashes are None (and {}) before version 3 or when not recorded.
+    """
+    version, _ = _read_header(blob)
+    try:
+        offset = _HEADER.size
+        (string_count,) = _U16.unpack_from(blob, offset)
+        offset += _U16.size
+        strings = []
+        for _ in range(string_count):
+            (length,) = _U16.unpack_from(blob, offset)
+            offset += _U16.size
+            strings.append(bytes(blob[offset:offset + length]).decode("utf-8"))
+            offset += length
+
+        (court_count,) = _U16.unpack_from(blob, offset)
+        offset += _U16.size
+        rows = [] if want_rows else None
+        court_keys = []
+        for _ in range(court_count):
+            date_idx, city_idx, park_idx, court_idx, slot_count = _COURT.unpack_from(blob, offset)
+            offset += _COURT.size
+            date, city_name, park_name, court_name = strings[date_idx], strings[city_idx], strings[park_idx], strings[court_idx]
+            court_keys.append(CourtKey(date, city_name, park_name, court_name))
+            mask_length = (slot_count + 7) // 8
+            if not want_rows:
+                offset += 4 * slot_count + mask_length
+                continue
+
+            times = struct.unpack_from(f"<{2 * slot_count}H", blob, offset)
+            offset += 4 * slot_count
+            mask = int.from_bytes(blob[offset:offset + mask_length], "little")
+            offset += mask_length
+            for i in range(slot_count):
+                rows.append({
+                    "city_name": city_name,
+                    "park_name": park_name,
+                    "court_name": court_name,
+                    "start_time": _HHMM[times[2 * i]],
+                    "end_time": _HHMM[times[2 * i + 1]],
+                    "date": date,
+                    "availability": "Available" if mask >> i & 1 else "Unavailable"
+                })
+
+        index = None
+        if version >= 2:
+            if len(blob) < offset + court_count * INDEX_BYTES:
+                raise ValueError("index section is truncated")
+            index = {}
+            for court_key in court_keys:
+                index[court_key] = int.from_bytes(blob[offset:offset + INDEX_BYTES], "little")
+                offset += INDEX_BYTES
+
+        page_hash = None
+        court_hashes = {}
+        if version >= 3:
+            if len(blob) < offset + PAGE_HASH_BYTES + court_count * COURT_HASH_BYTES:
+                raise ValueError("hashes section is truncated")
+            page_hash = bytes(blob[offset:offset + PAGE_HASH_BYTES])
+            offset += PAGE_HASH_BYTES
+            for court_key in court_keys:
+                court_hash = bytes(blob[offset:offset + COURT_HASH_BYTES])
+                offset += COURT_HASH_BYTES
+                if any(court_hash):
+                    court_hashes[court_key] = court_hash
+            if not any(page_hash):
+                page_hash = None
+        return rows, index, page_hash, court_hashes
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"malformed snapshot: {e}") from e
+
+
+def decode_rows(blob: bytes) -> List[Dict]:
+    """Decodes the slot rows, in the same dict shape the scrapers produce. Raises ValueError for malformed data."""
+    return _decode(blob, want_rows=True)[0]
+
+
+def decode_index(blob: bytes) -> Dict[CourtKey, int]:
+    """Decodes the per-court free-cell bitmaps without building the rows (rebuilt from the rows for version 1)."""
+    _, index, _, _ = _decode(blob, want_rows=False)
+    if index is None:
+        index = build_index(decode_rows(blob))
+    return index
+
+
+class Snapshot:
+    """
+    A cached (date, city) scrape. Rows, the availability index and the page/court hashes are decoded from the
+    binary blob only when first accessed, so checking a snapshot's age (e.g. in the prefetch worker) only reads the header.
+    """
+    __slots__ = ("fetched_at", "_blob", "_rows", "_index", "_hashes")
+
+    def __init__(self, fetched_at: float, rows: Optional[List[Dict]] = None, blob: Optional[bytes] = None):
+        self.fetched_at = fetched_at
+        self._rows = rows
+        self._blob = blob
+        self._index = None
+        self._hashes = None
+
+    @classmethod
+    def from_blob(cls, blob: bytes) -> "Snapshot":
+        return cls(decode_fetched_at(blob), blob=blob)
+
+    @property
+    def blob(self) -> Optional[bytes]:
+        return self._blob
+
+    @property
+    def rows(self) -> List[Dict]:
+        if self._rows is None:
+            self._rows = decode_rows(self._blob)
+        return self._rows
+
+    @property
+    def index(self) -> Dict[CourtKey, int]:
+        """Free-cell bitmap per court, see availability_index.py."""
+        if self._index is None:
+            if self._blob is None:
+                self._index = build_index(self._rows)
+            else:
+                _, self._index, page_hash, court_hashes = _decode(self._blob, want_rows=False)
+                self._hashes = (page_hash, court_hashes)
+                if self._index is None:
+                    self._index = build_index(self.rows)
+        return self._index
+
+    def _load_hashes(self) -> tuple:
+        if self._hashes is None:
+            if self._blob is None:
+                self._hashes = (None, {})
+            else:
+                self.index  # decodes the hashes in the same walk
+        return self._hashes
+
+    @property
+    def page_hash(self) -> Optional[bytes]:
+        """Hash of the raw page this snapshot was parsed from, or None if it wasn't recorded."""
+        return self._load_hashes()[0]
+
+    @property
+    def court_hashes(self) -> Dict[CourtKey, bytes]:
+        """Hash of each court's section of the raw page, for the courts where it was recorded."""
+        return self._load_hashes()[1]
@@ -0,0 +1,282 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from availability_index import index_fingerprint
+from scrapers import get_scraper
+from snapshot_codec import Snapshot, decode_index, with_fetched_at
+
+# --- Snapshot store (SQLite) ---
+# Every scrape snapshot is also recorded in an SQLite file at SNAPSHOT_STORE_PATH (set it empty to disable the store):
+# a new row only when a (date, city)'s availability changes (its availability_index.index_fingerprint differs from
+# the latest row's), with fetched_at (when that state was first scraped) and checked_at (the last scrape that still
+# found it). It is the warm-start source when Redis has no snapshot, e.g. after a flush or restart
+# (see scrape_cache.read_snapshots), and keeps SNAPSHOT_STORE_RETENTION_DAYS of history that scan() reads back in
+# date order for analysis and benchmarks.
+# Each process has two connections, each used under its own lock (so gevent greenlets don't each open one): one for
+# the background writer thread, and one for latest(), which runs on the request path. In WAL mode readers never
+# wait for writers, and latest() waits at most SNAPSHOT_STORE_READ_TIMEOUT_SECONDS for its lock and for SQLite
+# before giving up on the warm start (the pair is then scraped), so a busy store can't stall a gevent worker.
+# Several processes can share the file.
+# The default path is relative to the working directory. On Heroku that is the dyno's ephemeral filesystem, so the
+# history is lost on every restart and deploy and not shared between dynos; point SNAPSHOT_STORE_PATH at a
+# persistent volume if it must survive them.
+SNAPSHOT_STORE_PATH = os.getenv("SNAPSHOT_STORE_PATH", "snapshots.sqlite3")
+SNAPSHOT_STORE_RETENTION_DAYS = int(os.getenv("SNAPSHOT_STORE_RETENTION_DAYS", "30"))
+PRUNE_INTERVAL_SECONDS = 3600
+BUSY_TIMEOUT_SECONDS = 5
+READ_TIMEOUT_SECONDS = float(os.getenv("SNAPSHOT_STORE_READ_TIMEOUT_SECONDS", "0.1"))
+# Rows scan() reads per query, so it never holds the connection while the caller handles the rows
+SCAN_BATCH_ROWS = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    day TEXT NOT NULL,          -- YYYY-MM-DD, so dates sort and range-scan
+    city TEXT NOT NULL COLLATE NOCASE,  -- the scraper's display name, e.g. Albany
+    fetched_at REAL NOT NULL,
+    checked_at REAL NOT NULL,
+    blob BLOB NOT NULL          -- snapshot_codec format
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_day ON snapshots (day, city, fetched_at);
+"""
+
+_path = SNAPSHOT_STORE_PATH or None
+_connection_lock = threading.Lock()
+_shared_connection: Optional[sqlite3.Connection] = None
+_read_lock = threading.Lock()
+_read_connection: Optional[sqlite3.Connection] = None
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot-store")
+_last_prune = 0.0
+
+
+class StoredSnapshot(NamedTuple):
+    """One recorded availability state of a (date, city), as returned by scan()."""
+    date: str
+    city: str
+    fetched_at: float
+    checked_at: float
+    snapshot: Snapshot
+
+
+def configure(path: Optional[str]):
+    """Sets the SQLite file used for the store (created on first use); None disables it."""
+    global _path, _shared_connection, _read_connection
+    with _connection_lock, _read_lock:
+        _path = path or None
+        for connection in (_shared_connection, _read_connection):
+            if connection is not None:
+                connection.close()
+        _shared_connection = _read_connection = None
+
+
+def is_enabled() -> bool:
+    return _path is not None
+
+
+def _open(path: str, busy_timeout_seconds: float) -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=busy_timeout_seconds, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+@contextmanager
+def _connection() -> Iterator[sqlite3.Connection]:
+    """Holds this process's write connection (opened on first use) for one transaction."""
+    global _shared_connection
+    with _connection_lock:
+        if _shared_connection is None:
+            _shared_connection = _open(_path, BUSY_TIMEOUT_SECONDS)
+        with _shared_connection:
+            yield _shared_connection
+
+
+@contextmanager
+def _reading(timeout: Optional[float] = READ_TIMEOUT_SECONDS) -> Iterator[sqlite3.Connection]:
+    """Holds this process's read connection, waiting at most timeout seconds for it (None waits as long as it takes)."""
+    global _read_connection
+    if not _read_lock.acquire(timeout=-1 if timeout is None else timeout):
+        raise TimeoutError("the snapshot store's read connection is busy")
+    try:
+        if _read_connection is None:
+            _read_connection = _open(_path, READ_TIMEOUT_SECONDS)
+        yield _read_connection
+    finally:
+        _read_lock.release()
+
+
+def _reset_after_fork():
+    # A forked child must not use the parent's connections, or a lock some other parent thread held at the fork
+    global _connection_lock, _shared_connection, _read_lock, _read_connection
+    _connection_lock = threading.Lock()
+    _shared_connection = None
+    _read_lock = threading.Lock()
+    _read_connection = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _day(date: str) -> str:
+    return datetime.strptime(date, "%m/%d/%Y").strftime("%Y-%m-%d")
+
+
+def _date(day: str) -> str:
+    return datetime.strptime(day, "%Y-%m-%d").strftime("%m/%d/%Y")
+
+
+def _submit(write, *args):
+    def _run():
+        try:
+            with _connection() as connection:
+                write(connection, *args)
+            _prune_if_due()
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f"WARNING: Could not write to the snapshot store at {_path}: {e}")
+
+    _write_executor.submit(_run)
+
+
+def _display_name(city: str) -> str:
+    """The city's name as its scraper spells it (cities come in as typed by users and the LLM)."""
+    spec = get_scraper(city)
+    return spec.city_name if spec is not None else city
+
+
+def _latest_row(connection: sqlite3.Connection, date: str, city: str) -> Optional[tuple]:
+    return connection.execute(
+        "SELECT rowid, checked_at, blob FROM snapshots WHERE day = ? AND city = ? ORDER BY fetched_at DESC LIMIT 1",
+        (_day(date), city),
+    ).fetchone()
+
+
+def _insert(connection: sqlite3.Connection, date: str, city: str, snapshot: Snapshot):
+    connection.execute(
+        "INSERT INTO snapshots (day, city, fetched_at, checked_at, blob) VALUES (?, ?, ?, ?, ?)",
+        (_day(date), _display_name(city), snapshot.fetched_at, snapshot.fetched_at, snapshot.blob),
+    )
+
+
+def _mark_checked(connection: sqlite3.Connection, date: str, city: str, snapshot: Snapshot):
+    row = _latest_row(connection, date, city)
+    if row is None:
+        _insert(connection, date, city, snapshot)
+    else:
+        connection.execute("UPDATE snapshots SET checked_at = ? WHERE rowid = ?", (snapshot.fetched_at, row[0]))
+
+
+def _record_if_changed(connection: sqlite3.Connection, date: str, city: str, snapshot: Snapshot):
+    """Inserts snapshot if its availability differs from the latest row's; otherwise only marks that row checked."""
+    row = _latest_row(connection, date, city)
+    if row is not None and index_fingerprint(decode_index(row[2])) == index_fingerprint(snapshot.index):
+        connection.execute("UPDATE snapshots SET checked_at = ? WHERE rowid = ?", (snapshot.fetched_at, row[0]))
+    else:
+        _insert(connection, date, city, snapshot)
+
+
+def record(date: str, city: str, snapshot: Snapshot):
+    """
+    Records a newly scraped snapshot (in the background): a new row if its availability changed, otherwise a
+    check of the latest one (the page can change without the availability changing). Snapshots without a blob
+    (failed scrapes) are skipped.
+    """
+    if _path is None or snapshot.blob is None:
+        return
+    _submit(_record_if_changed, date, city, snapshot)
+
+
+def record_unchanged(date: str, city: str, snapshot: Snapshot):
+    """Records that a refresh found the latest snapshot of (date, city) unchanged, as of snapshot.fetched_at."""
+    if _path is None or snapshot.blob is None:
+        return
+    _submit(_mark_checked, date, city, snapshot)
+
+
+def latest(keys: List[Tuple[str, str]], max_age_seconds: float) -> Dict[Tuple[str, str], Snapshot]:
+    """
+    Returns the most recent recorded snapshot of each (date, city) pair that was last checked less than
+    max_age_seconds ago, with its fetched_at set to that check. Pairs without one are left out, and so are all
+    pairs if the store can't be read within READ_TIMEOUT_SECONDS.
+    """
+    if _path is None or not keys:
+        return {}
+    oldest = time.time() - max_age_seconds
+    results = {}
+    try:
+        with _reading() as connection:
+            rows = {(date, city): _latest_row(connection, date, city) for date, city in keys}
+        for (date, city), row in rows.items():
+            if row is not None and row[1] > oldest:
+                _, checked_at, blob = row
+                results[(date, city)] = Snapshot(checked_at, blob=with_fetched_at(blob, checked_at))
+    except (sqlite3.Error, OSError, ValueError) as e:  # TimeoutError is an OSError
+        print(f"WARNING: Could not read the snapshot store at {_path}: {e}")
+    return results
+
+
+def scan(start_date: str, end_date: str, city: Optional[str] = None,
+         since: Optional[float] = None, until: Optional[float] = None) -> Iterator[StoredSnapshot]:
+    """
+    Yields every recorded snapshot for dates start_date through end_date (MM/DD/YYYY), optionally of one city
+    and fetched between the since and until timestamps, ordered by date, city and fetch time.
+    """
+    if _path is None:
+        return
+    query = "SELECT day, city, fetched_at, checked_at, blob, rowid FROM snapshots WHERE day BETWEEN ? AND ?"
+    params = [_day(start_date), _day(end_date)]
+    if city:
+        query += " AND city = ?"
+        params.append(city)
+    if since is not None:
+        query += " AND fetched_at >= ?"
+        params.append(since)
+    if until is not None:
+        query += " AND fetched_at < ?"
+        params.append(until)
+    # Read in batches, each continuing after the last row of the one before
+    after = None
+    while True:
+        page_query, page_params = query, list(params)
+        if after is not None:
+            page_query += " AND (day, city, fetched_at, rowid) > (?, ?, ?, ?)"
+            page_params.extend(after)
+        page_query += " ORDER BY day, city, fetched_at, rowid LIMIT ?"
+        page_params.append(SCAN_BATCH_ROWS)
+        with _reading(timeout=None) as connection:
+            rows = connection.execute(page_query, page_params).fetchall()
+        for day, city_name, fetched_at, checked_at, blob, _ in rows:
+            yield StoredSnapshot(_date(day), city_name, fetched_at, checked_at, Snapshot.from_blob(blob))
+        if len(rows) < SCAN_BATCH_ROWS:
+            return
+        after = (rows[-1][0], rows[-1][1], rows[-1][2], rows[-1][5])
+
+
+def prune(retention_days: int = SNAPSHOT_STORE_RETENTION_DAYS) -> int:
+    """Deletes snapshots last checked more than retention_days ago. Returns how many were deleted."""
+    if _path is None:
+        return 0
+    cutoff = time.time() - timedelta(days=retention_days).total_seconds()
+    with _connection() as connection:
+        return connection.execute("DELETE FROM snapshots WHERE checked_at < ?", (cutoff,)).rowcount
+
+
+def _prune_if_due():
+    global _last_prune
+    if time.monotonic() - _last_prune >= PRUNE_INTERVAL_SECONDS:
+        _last_prune = time.monotonic()
+        deleted = prune()
+        if deleted:
+            print(f"INFO: Pruned {deleted} snapshots older than {SNAPSHOT_STORE_RETENTION_DAYS} days from the snapshot store.")
+
+
+def flush(timeout: Optional[float] = None):
+    """Waits until every write submitted so far is done (for scripts and benchmarks)."""
+    _write_executor.submit(lambda: None).result(timeout)
@@ -1,3 +1,4 @@
+import re
 from datetime import datetime, timedelta
 
 
@@ -30,16 +31,25 @@ def from_hhmm(hhmm_str):
     return datetime.strptime(hhmm_str, "%H:%M").time()
 
 
+_HHMM_PATTERN = re.compile(r"([0-9]{1,2}):([0-9]{2})")
+
+
+def hhmm_to_minutes(hhmm_str):
+    """Converts an H:MM or HH:MM (24-hour) string to minutes since midnight. Raises ValueError for anything else."""
+    match = _HHMM_PATTERN.fullmatch(hhmm_str) if isinstance(hhmm_str, str) else None
+    if match is None or int(match[1]) >= 24 or int(match[2]) >= 60:
+        raise ValueError(f"Invalid time format: {hhmm_str}. Expected 'HH:MM' (24-hour).")
+    return int(match[1]) * 60 + int(match[2])
+
+
+def minutes_to_hhmm(minutes):
+    """Converts minutes since midnight to an HH:MM (24-hour) string."""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
 def calculate_duration_minutes(start_str, end_str):
-    """Calculates the duration in minutes between two HH:MM time strings."""
-    start_time = from_hhmm(start_str)
-    end_time = from_hhmm(end_str)
-    if end_time < start_time:
-        time_delta = datetime.combine(datetime.min.date() + timedelta(days=1), end_time) - datetime.combine(
-            datetime.min.date(), start_time)
-    else:
-        time_delta = datetime.combine(datetime.min.date(), end_time) - datetime.combine(datetime.min.date(), start_time)
-    return int(time_delta.total_seconds() / 60)
+    """Calculates the duration in minutes between two HH:MM time strings. An end before the start wraps past midnight."""
+    return (hhmm_to_minutes(end_str) - hhmm_to_minutes(start_str)) % (24 * 60)
 
 
 # @tool